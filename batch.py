@@ -0,0 +1,158 @@
+'''Compiles many programs in parallel.
+
+Usage: python batch.py [--workers N] [--output-dir DIR] [--format FORMAT]
+                       [--cache DIR [--cache-size BYTES]] SOURCE...
+
+Each SOURCE is a program, a directory whose *.txt files are programs, or a
+manifest: a file whose name ends in .manifest and that lists one program
+per line (relative to the manifest; blank lines and lines starting with #
+are ignored). Every program is compiled to a .j file (or, with
+--format=class, a .class file) with the same name, next to the program or
+in the output directory. An error in one program is reported and does not
+stop the others. With --cache, programs that were compiled before by the
+same compiler are taken from the cache in DIR (see cache.py), which the
+workers share.
+'''
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import Compilation_Cache
+from classfile import Assembly_Error
+from compiler import Compile_Error, compile, compile_class
+
+# the Compilation_Cache of each cache directory and size this process uses,
+# kept from one program to the next
+_caches = {}
+
+def worker_cache(directory, max_bytes=None):
+    '''Returns the Compilation_Cache of this process for directory.'''
+    if (directory, max_bytes) not in _caches:
+        _caches[directory, max_bytes] = Compilation_Cache(directory, max_bytes) \
+                                        if max_bytes else Compilation_Cache(directory)
+    return _caches[directory, max_bytes]
+
+class Result:
+    '''The outcome of compiling one program: the name of the file written,
+       or the error report if the program could not be compiled. cached is
+       True if the output came from the cache.'''
+    def __init__(self, source, output=None, error=None, cached=False):
+        self.source = source
+        self.output = output
+        self.error = error
+        self.cached = cached
+
+def source_files(paths, suffix='.txt'):
+    '''Returns the programs named by paths, which may be programs,
+       directories or manifests. The programs in a directory are the files
+       whose names end with suffix.'''
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            result += sorted(os.path.join(path, name)
+                             for name in os.listdir(path)
+                             if name.endswith(suffix))
+        elif path.endswith('.manifest'):
+            directory = os.path.dirname(path)
+            with open(path) as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        result.append(os.path.join(directory, line))
+        else:
+            result.append(path)
+    return result
+
+def output_file(source, output_dir, format='jasmin'):
+    '''Returns the name of the .j or .class file for source.'''
+    stem = os.path.splitext(os.path.basename(source))[0]
+    suffix = '.class' if format == 'class' else '.j'
+    return os.path.join(output_dir or os.path.dirname(source), stem + suffix)
+
+def compile_file(source, output_dir=None, format='jasmin', cache=None,
+                 cache_size=None):
+    '''Compiles one program and writes its .j or .class file, using the
+       cache in the directory cache if it is given. Never raises, so that
+       one bad program cannot stop a batch.'''
+    try:
+        with open(source) as input_file:
+            text = input_file.read()
+        output = output_file(source, output_dir, format)
+        cached = False
+        if cache:
+            compilation_cache = worker_cache(cache, cache_size)
+            hits = compilation_cache.hits
+            bytecode = compilation_cache.compile(text, format)
+            cached = compilation_cache.hits > hits
+        elif format == 'class':
+            bytecode = compile_class(text)
+        else:
+            bytecode = compile(text)
+        if format == 'class':
+            with open(output, 'wb') as output_stream:
+                output_stream.write(bytecode)
+        else:
+            with open(output, 'w') as output_stream:
+                output_stream.write(bytecode)
+        return Result(source, output=output, cached=cached)
+    except (Compile_Error, Assembly_Error, OSError, UnicodeDecodeError) as error:
+        return Result(source, error=str(error))
+
+def compile_batch(sources, output_dir=None, workers=None, format='jasmin',
+                  cache=None, cache_size=None):
+    '''Compiles the programs in sources on a pool of worker processes and
+       returns a Result for each, in the order of sources. workers defaults
+       to the number of CPUs; cache and cache_size are those of
+       compile_file.'''
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    # small programs are cheap, so hand them out in chunks
+    chunksize = max(1, len(sources) // (4 * workers))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(compile_file, sources,
+                             [output_dir] * len(sources),
+                             [format] * len(sources),
+                             [cache] * len(sources),
+                             [cache_size] * len(sources),
+                             chunksize=chunksize))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compile many programs to Jasmin assembly in parallel.')
+    parser.add_argument('sources', nargs='+', metavar='SOURCE',
+                        help='a program, a directory of *.txt programs '
+                             'or a .manifest file listing programs')
+    parser.add_argument('--workers', '-j', type=int, default=None,
+                        help='number of worker processes (default: CPUs)')
+    parser.add_argument('--output-dir', '-o', default=None,
+                        help='directory for the output files '
+                             '(default: next to each program)')
+    parser.add_argument('--format', choices=['jasmin', 'class'],
+                        default='jasmin',
+                        help='write Jasmin assembly (the default) or class files')
+    parser.add_argument('--cache', metavar='DIR', default=None,
+                        help='reuse the output of programs compiled before, '
+                             'kept in DIR')
+    parser.add_argument('--cache-size', type=int, default=None,
+                        metavar='BYTES',
+                        help='the most the cache may take (default 64 MiB)')
+    args = parser.parse_args()
+    results = compile_batch(source_files(args.sources),
+                            args.output_dir, args.workers, args.format,
+                            args.cache, args.cache_size)
+    failed = [result for result in results if result.error]
+    for result in failed:
+        print(result.source + ': ' + result.error, file=sys.stderr)
+    print('%d compiled, %d failed' % (len(results) - len(failed), len(failed)),
+          file=sys.stderr)
+    if args.cache:
+        hits = sum(result.cached for result in results)
+        print('cache: %d hits, %d misses' % (hits, len(results) - hits),
+              file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,471 @@
+'''Benchmarks for the compiler.
+
+Run with: python benchmark.py
+
+The suite times the scanner, the parser and the code generator separately
+on random programs of growing size (see random_program). With --output the
+results are saved as JSON; with --baseline they are compared with results
+saved before, and the exit status is 1 if a phase got slower or grows
+faster with the size of the program than it did. python benchmark.py
+--classic runs the older benchmarks of the scanner, the memory used and
+the loop optimisations, and python benchmark.py --nesting checks that
+deeply nested programs compile in time linear in their depth.
+'''
+
+import argparse
+import io
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import classfile
+from compiler import Code_List, Context, Scanner, Token, compile_to, generate, int32, parse
+
+# One statement of every kind, repeated to build sources of a given size.
+STATEMENTS = '''read n;
+sum := 0;
+while n > 0 and not sum >= 1000 or n = 1 do
+  sum := sum + n * (n - 1) / 2;
+  n := n - 1
+end;
+if sum != 0 then write sum else write n end;
+'''
+
+def make_source(size):
+    '''Returns a program of roughly size characters.'''
+    return STATEMENTS * (size // len(STATEMENTS) + 1) + 'write 0'
+
+def random_program(statements, depth=3, expression_size=3, comparisons=2,
+                   boolean_mix=(1, 1, 1), variables=8, seed=0):
+    '''Returns a random program of about the given number of statements,
+       with if and while statements nested up to depth, expressions of
+       expression_size operators and conditions of the given number of
+       comparisons. boolean_mix weighs how often the comparisons are joined
+       by and and by or, and negated by not. All the variables are read at
+       the start. The programs are meant to be compiled; their loops need
+       not end.'''
+    rand = random.Random(seed)
+    # names of letters only, none of them a keyword
+    names = []
+    for i in range(variables):
+        name = ''
+        while True:
+            name = chr(ord('a') + i % 26) + name
+            i //= 26
+            if not i:
+                break
+        names.append('v' + name)
+    def leaf():
+        return rand.choice(names) if rand.random() < 0.7 else str(rand.randint(0, 999))
+    def expression():
+        result = leaf()
+        for i in range(expression_size):
+            result += ' ' + rand.choice('+-*/') + ' ' + leaf()
+            if rand.random() < 0.3:
+                result = '(' + result + ')'
+        return result
+    def condition():
+        (ands, ors, nots) = boolean_mix
+        result = ''
+        for i in range(comparisons):
+            if i:
+                result += rand.choices([' and ', ' or '], [ands, ors])[0]
+            if rand.random() < nots / (ands + ors + nots or 1):
+                result += 'not '
+            result += expression() + ' ' + \
+                      rand.choice(['<', '=', '>', '<=', '!=', '>=']) + ' ' + expression()
+        return result
+    parts = ['read ' + name + ';\n' for name in names]
+    # the kind of each statement that is open, and whether its else part
+    # has begun
+    open_statements = []
+    for i in range(statements):
+        indent = '  ' * len(open_statements)
+        choice = rand.random()
+        if len(open_statements) < depth and choice < 0.2:
+            kind = rand.choice(['if', 'while'])
+            parts.append(indent + kind + ' ' + condition() +
+                         (' then\n' if kind == 'if' else ' do\n'))
+            open_statements.append([kind, False])
+            continue
+        if choice < 0.8:
+            parts.append(indent + rand.choice(names) + ' := ' + expression())
+        else:
+            parts.append(indent + 'write ' + expression())
+        while open_statements and rand.random() < 0.3:
+            opened = open_statements[-1]
+            if opened == ['if', False] and rand.random() < 0.5:
+                parts.append('\n' + '  ' * (len(open_statements) - 1) + 'else\n')
+                opened[1] = True
+                break
+            open_statements.pop()
+            parts.append('\n' + '  ' * len(open_statements) + 'end')
+        else:
+            parts.append(';\n')
+    parts.append('  ' * len(open_statements) + 'write ' + names[0])
+    while open_statements:
+        open_statements.pop()
+        parts.append('\n' + '  ' * len(open_statements) + 'end')
+    return ''.join(parts)
+
+def scan(source):
+    '''Consumes every token of source and returns the number of tokens.'''
+    scanner = Scanner(io.StringIO(source))
+    count = 0
+    token = scanner.lookahead()
+    while token != None:
+        scanner.consume(token)
+        count += 1
+        token = scanner.lookahead()
+    return count
+
+def benchmark_scanner(sizes):
+    '''Times the scanner on sources of the given sizes. The time per token
+       stays constant if scanning is linear in the size of the source.'''
+    print('%12s %10s %10s %12s' % ('characters', 'tokens', 'seconds', 'us/token'))
+    for size in sizes:
+        source = make_source(size)
+        start = time.perf_counter()
+        count = scan(source)
+        seconds = time.perf_counter() - start
+        print('%12d %10d %10.3f %12.3f' %
+              (len(source), count, seconds, seconds / count * 1e6))
+
+def benchmark_memory(sizes):
+    '''Measures the memory taken by the abstract syntax tree of sources of
+       the given sizes, without the source text and the scanner.'''
+    print('%12s %10s %12s' % ('characters', 'MB', 'bytes/char'))
+    for size in sizes:
+        source = make_source(size)
+        context = Context(io.StringIO(source), None)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        ast = parse(context)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        print('%12d %10.1f %12.1f' % (len(source), used / 2**20, used / len(source)))
+
+def benchmark_streaming(sizes):
+    '''Measures the most memory taken at a time by the translation of
+       sources of the given sizes without optimisation, through the syntax
+       tree and in one pass, from a string and from a file.'''
+    print('%12s %12s %12s %12s' % ('characters', 'tree MB', 'streamed MB',
+                                   'from file MB'))
+    for size in sizes:
+        source = make_source(size)
+        peaks = []
+        with tempfile.TemporaryFile() as program_file:
+            program_file.write(source.encode('ascii'))
+            program_file.seek(0)
+            for (program, stream) in [(source, False), (source, True),
+                                      (program_file, True)]:
+                with open(os.devnull, 'w') as output_file:
+                    tracemalloc.start()
+                    compile_to(program, output_file, optimise=False, stream=stream)
+                    peaks.append(tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+        print('%12d %12.1f %12.1f %12.1f' % ((len(source),) +
+                                             tuple(peak / 2**20 for peak in peaks)))
+
+# A loop with an invariant expression and multiplications of the induction
+# variable, as in the loops the workloads spend their time in.
+LOOP = '''read n; read a; read b; read c;
+i := 0; sum := 0;
+while i < n do
+  sum := sum + (a*b+c) * 2 + i*8 + i*a;
+  i := i + 1
+end;
+write sum
+'''
+
+def execute(instructions, inputs):
+    '''Runs the main method of the instructions collected by a Code_List,
+       with inputs as the numbers read, and returns the numbers written and
+       the number of JVM instructions executed. Only the instructions the
+       compiler emits are understood.'''
+    start = instructions.index(('.method', 'public', 'static',
+                                'main([Ljava/lang/String;)V'))
+    code = []
+    labels = {}
+    for instruction in instructions[start + 1:]:
+        if instruction == ('.end', 'method'):
+            break
+        if classfile.is_label(instruction):
+            labels[instruction[0][:-1]] = len(code)
+        elif instruction[0][0] != '.':
+            code.append(instruction)
+    compare = { 'eq': lambda a, b: a == b, 'ne': lambda a, b: a != b,
+                'lt': lambda a, b: a < b, 'ge': lambda a, b: a >= b,
+                'gt': lambda a, b: a > b, 'le': lambda a, b: a <= b }
+    inputs = list(inputs)
+    output = []
+    locals = {}
+    stack = []
+    count = 0
+    index = 0
+    while True:
+        instruction = code[index]
+        op = instruction[0]
+        count += 1
+        index += 1
+        if op == 'return':
+            return output, count
+        if op.startswith('iconst_'):
+            stack.append(-1 if op == 'iconst_m1' else int(op[7:]))
+        elif op in ('bipush', 'sipush', 'ldc'):
+            stack.append(instruction[1])
+        elif op in ('iload', 'aload'):
+            stack.append(locals[instruction[1]])
+        elif op in ('istore', 'astore'):
+            locals[instruction[1]] = stack.pop()
+        elif op == 'iinc':
+            locals[instruction[1]] = int32(locals[instruction[1]] + instruction[2])
+        elif op in ('iadd', 'isub', 'imul', 'idiv'):
+            right, left = stack.pop(), stack.pop()
+            if op == 'iadd':
+                stack.append(int32(left + right))
+            elif op == 'isub':
+                stack.append(int32(left - right))
+            elif op == 'imul':
+                stack.append(int32(left * right))
+            else:
+                quotient = abs(left) // abs(right)
+                stack.append(int32(quotient if (left < 0) == (right < 0)
+                                   else -quotient))
+        elif op == 'dup':
+            stack.append(stack[-1])
+        elif op == 'pop':
+            stack.pop()
+        elif op.startswith('if_icmp'):
+            right, left = stack.pop(), stack.pop()
+            if compare[op[7:]](left, right):
+                index = labels[instruction[1]]
+        elif op.startswith('if'):
+            if compare[op[2:]](stack.pop(), 0):
+                index = labels[instruction[1]]
+        elif op == 'goto':
+            index = labels[instruction[1]]
+        elif op == 'invokevirtual' and instruction[1].endswith('nextInt()I'):
+            stack.pop()
+            stack.append(inputs.pop(0))
+        elif op == 'invokevirtual' and 'println' in instruction[1]:
+            output.append(stack.pop())
+            stack.pop()
+        elif op in ('new', 'getstatic'):
+            stack.append(None)
+        elif op == 'invokespecial':
+            stack.pop()
+        elif op != 'invokestatic': # String.valueOf leaves the number
+            raise ValueError('cannot execute ' + op)
+
+def benchmark_loops(iterations):
+    '''Counts the JVM instructions executed by LOOP without optimisation,
+       with all but the loop optimisations, and with all of them.'''
+    print('%12s %14s %14s %14s' % ('iterations', 'unoptimised',
+                                   'no loop opts', 'optimised'))
+    settings = [{ 'optimise': False },
+                { 'optimise_loops': False },
+                {}]
+    for n in iterations:
+        counts = []
+        for options in settings:
+            output = Code_List()
+            generate(LOOP, output, **options)
+            counts.append(execute(output.instructions, [n, 3, 4, 5])[1])
+        print('%12d %14d %14d %14d' % ((n,) + tuple(counts)))
+
+def time_best(function, repeat):
+    '''Returns the shortest time function takes of repeat calls.'''
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+# The phases benchmark_phases times. Parsing pulls the tokens from the
+# scanner, so its time includes scanning.
+PHASES = ['scan', 'parse', 'code', 'compile']
+
+def benchmark_phases(sizes, repeat=3, **options):
+    '''Times each phase of the compiler on random programs of the given
+       numbers of statements, made by random_program with options: the
+       scanner, the parser, the code generator without optimisation on the
+       parsed tree, and the whole optimised compilation. Returns a record
+       for each phase and size.'''
+    results = []
+    print('%8s %10s %10s %10s %10s' % ('phase', 'statements', 'tokens',
+                                       'seconds', 'us/token'))
+    for statements in sizes:
+        source = random_program(statements, **options)
+        tokens = scan(source)
+        def parsed():
+            return parse(Context(io.StringIO(source), None))
+        def code():
+            context = Context(io.StringIO(source), Code_List())
+            ast = parse(context)
+            start = time.perf_counter()
+            ast.code(context)
+            return time.perf_counter() - start
+        times = { 'scan': time_best(lambda: scan(source), repeat),
+                  'parse': time_best(parsed, repeat),
+                  'code': min(code() for i in range(repeat)),
+                  'compile': time_best(lambda: generate(source, Code_List()), repeat) }
+        for phase in PHASES:
+            results.append({ 'phase': phase, 'statements': statements,
+                             'characters': len(source), 'tokens': tokens,
+                             'seconds': times[phase] })
+            print('%8s %10d %10d %10.3f %10.3f' % (phase, statements, tokens,
+                                                  times[phase], times[phase] / tokens * 1e6))
+    return results
+
+# Times shorter than this, in seconds, vary too much to be compared.
+NOISE = 0.01
+
+def growth(results, phase):
+    '''Returns the exponent k for which the time of phase grows as the
+       number of tokens to the power k, from the smallest to the largest
+       program in results that takes NOISE or longer, or None if there are
+       not two such sizes.'''
+    records = sorted((r['tokens'], r['seconds']) for r in results
+                     if r['phase'] == phase and r['seconds'] >= NOISE)
+    if len(records) < 2 or records[0][0] == records[-1][0]:
+        return None
+    (first_tokens, first_seconds), (last_tokens, last_seconds) = records[0], records[-1]
+    return math.log(last_seconds / first_seconds) / math.log(last_tokens / first_tokens)
+
+def compare(results, baseline, tolerance=1.5, exponent=0.2):
+    '''Returns a message for each regression of results from the baseline
+       results: a phase that takes more than tolerance times as long on a
+       program of the same number of statements, or whose time grows with a
+       larger exponent (see growth) by more than exponent. Times shorter
+       than NOISE are not compared. The baseline is only comparable if it
+       was made on the same machine with the same options.'''
+    messages = []
+    before = dict(((r['phase'], r['statements']), r) for r in baseline)
+    for record in results:
+        old = before.get((record['phase'], record['statements']))
+        if old and old['seconds'] >= NOISE and \
+           record['seconds'] > tolerance * old['seconds']:
+            messages.append('%s on %d statements: %.3fs, was %.3fs' %
+                            (record['phase'], record['statements'],
+                             record['seconds'], old['seconds']))
+    for phase in PHASES:
+        (new, old) = (growth(results, phase), growth(baseline, phase))
+        if new is not None and old is not None and new > old + exponent:
+            messages.append('%s grows as tokens^%.2f, was tokens^%.2f' %
+                            (phase, new, old))
+    return messages
+
+def nested_program(kind, depth):
+    '''Returns a program that nests depth levels of kind: 'parentheses',
+       'if', 'while' or 'not'.'''
+    if kind == 'parentheses':
+        return 'read x; write ' + 'x + (' * depth + '1' + ')' * depth
+    if kind == 'not':
+        return 'read x; if ' + 'not ' * depth + 'x < 5 then write x end'
+    return 'read x; ' + (kind + ' x < 5 ' + ('then ' if kind == 'if' else 'do ')) * depth + \
+           'x := x + 1' + ' end' * depth + '; write x'
+
+NESTING = ['parentheses', 'if', 'while', 'not']
+
+# The largest growth exponent of the compile time with the depth that counts
+# as linear, allowing for the garbage collector.
+LINEAR = 1.25
+
+def benchmark_nesting(depths, repeat=1):
+    '''Times the optimised and the streamed compilation of programs nested
+       to each of depths (see nested_program). Returns a message for each
+       kind and mode whose time grows faster than depth to the power
+       LINEAR.'''
+    messages = []
+    print('%12s %8s %10s %10s %10s' % ('nesting', 'mode', 'depth', 'seconds',
+                                       'us/level'))
+    for kind in NESTING:
+        for (mode, options) in [('tree', {}), ('stream', { 'stream': True })]:
+            times = []
+            for depth in depths:
+                source = nested_program(kind, depth)
+                seconds = time_best(lambda: generate(source, Code_List(), **options),
+                                    repeat)
+                times.append(seconds)
+                print('%12s %8s %10d %10.3f %10.3f' % (kind, mode, depth, seconds,
+                                                       seconds / depth * 1e6))
+            exponent = math.log(times[-1] / times[0]) / math.log(depths[-1] / depths[0])
+            if exponent > LINEAR:
+                messages.append('%s nested in %s mode grows as depth^%.2f' %
+                                (kind, mode, exponent))
+    return messages
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the phases of the compiler on random programs.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='the numbers of statements of the programs')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='how deeply if and while statements nest')
+    parser.add_argument('--expression-size', type=int, default=3,
+                        help='the number of operators in each expression')
+    parser.add_argument('--comparisons', type=int, default=2,
+                        help='the number of comparisons in each condition')
+    parser.add_argument('--boolean-mix', type=float, nargs=3, default=[1, 1, 1],
+                        metavar=('AND', 'OR', 'NOT'),
+                        help='how often the comparisons are joined by and, '
+                             'by or, and negated')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='time each phase this many times and keep the '
+                             'best')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--baseline',
+                        help='compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='the slowdown from the baseline that counts as '
+                             'a regression (default 1.5)')
+    parser.add_argument('--classic', action='store_true',
+                        help='run the benchmarks of the scanner, memory, '
+                             'streaming and loop optimisations instead')
+    parser.add_argument('--nesting', type=int, nargs='*', metavar='DEPTH',
+                        help='time deeply nested programs instead, by '
+                             'default 10000 and 100000 levels deep, and '
+                             'exit with status 1 if a time grows faster '
+                             'than linearly')
+    args = parser.parse_args()
+    if args.nesting is not None:
+        messages = benchmark_nesting(args.nesting or [10000, 100000])
+        for message in messages:
+            print('regression: ' + message, file=sys.stderr)
+        sys.exit(1 if messages else 0)
+    if args.classic:
+        benchmark_scanner([10**4, 10**5, 10**6, 4 * 10**6])
+        benchmark_memory([10**5, 10**6])
+        benchmark_streaming([10**5, 10**6])
+        benchmark_loops([10, 1000, 100000])
+        return
+    options = { 'depth': args.depth, 'expression_size': args.expression_size,
+                'comparisons': args.comparisons,
+                'boolean_mix': tuple(args.boolean_mix), 'seed': args.seed }
+    results = benchmark_phases(args.sizes, args.repeat, **options)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({ 'options': options, 'results': results }, output_file,
+                      indent=1)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['options'] != json.loads(json.dumps(options)):
+            sys.exit('the baseline was made with other options')
+        messages = compare(results, baseline['results'], args.tolerance)
+        for message in messages:
+            print('regression: ' + message, file=sys.stderr)
+        if messages:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+'''An on-disk cache of compiled programs.
+
+The output of a compilation is stored under the SHA-256 hash of the source
+text, the output format, the options and the version of the compiler, so a
+program that has been compiled before is not scanned or parsed again. The
+version is a hash of the compiler's own modules, so changing the compiler
+invalidates the entries it made.
+
+Each entry is a file, written to a temporary file first and then renamed,
+so several processes can share a cache directory: a reader sees either the
+whole entry or none. Reading an entry updates its modification time, and
+when the entries take more than max_bytes the least recently used ones are
+removed. A Compilation_Cache adds up the sizes of the entries once, when it
+is made, and then keeps the total as it stores entries, so the directory is
+only walked again when the total is over max_bytes. The entries other
+processes store are counted then.
+'''
+
+import hashlib
+import os
+import tempfile
+
+import compiler
+
+# the modules whose code determines the output of the compiler
+modules = ['compiler.py', 'ir.py', 'peephole.py', 'classfile.py']
+
+# the options of compiler.generate that can be part of a key; the others,
+# peephole and stats, are objects that the compilation itself uses
+key_options = ['optimise', 'optimise_loops', 'fast_io', 'method_size', 'stream']
+
+_version = None
+
+def compiler_version():
+    '''Returns a hash of the source of the compiler modules.'''
+    global _version
+    if _version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(compiler.__file__))
+        for name in modules:
+            with open(os.path.join(directory, name), 'rb') as module:
+                digest.update(module.read())
+        _version = digest.hexdigest()
+    return _version
+
+def compile_output(source, format, options):
+    '''Returns the bytes of the output of compiling source.'''
+    if format == 'class':
+        return compiler.compile_class(source, **options)
+    return compiler.compile(source, **options).encode('utf-8')
+
+class Compilation_Cache:
+    '''A cache of compiled programs in directory, of at most max_bytes.
+       hits, misses and evictions count the lookups that found an entry,
+       those that did not, and the entries removed to make room, by this
+       object. total is the number of bytes the entries are known to
+       take.'''
+    def __init__(self, directory, max_bytes=64 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.total = sum(size for (used, size, path) in self.entries())
+
+    def key(self, source, format='jasmin', **options):
+        '''Returns the key of the output of compiling source, with options
+           from key_options.'''
+        for option in options:
+            if option not in key_options:
+                raise ValueError('option ' + option + ' cannot be cached')
+        digest = hashlib.sha256()
+        for part in [compiler_version(), format, repr(sorted(options.items())),
+                     source]:
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        '''Returns the bytes stored under key, or None.'''
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as entry:
+                data = entry.read()
+            os.utime(path)
+        except OSError:
+            # missing, or removed by another process since
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        '''Stores the bytes data under key and evicts entries if the cache
+           is then too large.'''
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path),
+                                             prefix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as entry:
+                entry.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.total += len(data) - replaced
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        '''Returns (last use, size, path) for each entry.'''
+        result = []
+        for (directory, subdirectories, names) in os.walk(self.directory):
+            for name in names:
+                if not name.startswith('.tmp'):
+                    path = os.path.join(directory, name)
+                    try:
+                        status = os.stat(path)
+                    except OSError:
+                        continue
+                    result.append((status.st_mtime, status.st_size, path))
+        return result
+
+    def evict(self):
+        '''Removes the least recently used entries until the rest fit in
+           max_bytes, and counts the total again.'''
+        entries = sorted(self.entries())
+        total = sum(size for (used, size, path) in entries)
+        for (used, size, path) in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+        self.total = total
+
+    def compile(self, source, format='jasmin', **options):
+        '''Returns what compiler.compile (for format 'jasmin') or
+           compiler.compile_class (for 'class') returns for source and
+           options, from the cache if it is there. Options that are not in
+           key_options are passed on, but the compilation is then neither
+           looked up nor stored. Raises Compile_Error like them; errors are
+           not cached.'''
+        if any(option not in key_options for option in options):
+            data = compile_output(source, format, options)
+        else:
+            key = self.key(source, format, **options)
+            data = self.get(key)
+            if data is None:
+                data = compile_output(source, format, options)
+                self.put(key, data)
+        return data if format == 'class' else data.decode('utf-8')
+
+    def stats(self):
+        '''Returns the counts of hits, misses and evictions and the ratio of
+           hits to lookups.'''
+        lookups = self.hits + self.misses
+        return { 'hits': self.hits, 'misses': self.misses,
+                 'evictions': self.evictions,
+                 'hit_ratio': self.hits / lookups if lookups else 0.0 }
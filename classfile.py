@@ -0,0 +1,873 @@
+'''Assembles the instructions emitted by the code generator into a class
+file, so the compiler does not need Jasmin.
+
+The input is a list of instructions as collected by compiler.Code_List.
+Each instruction is a tuple of a Jasmin opcode or directive and its
+operands, e.g. ('istore', 1) or ('.limit', 'stack', 1024), and a label is
+defined by a tuple (label + ':',). The directives .class, .super, .field,
+.method, .limit, .catch and .end method have the same meaning as in Jasmin.
+'''
+
+import struct
+
+class Assembly_Error(Exception):
+    '''Raised if the instructions do not make up a valid class.'''
+
+# Kinds of operands.
+NONE, LOCAL, BYTE, SHORT, CONSTANT, BRANCH, FIELD, METHOD, CLASS, IINC, \
+    ARRAY_TYPE, TABLE_SWITCH, LOOKUP_SWITCH = range(13)
+
+# The opcode and the kind of operand of each instruction.
+opcodes = {
+    'nop': (0x00, NONE), 'aconst_null': (0x01, NONE),
+    'iconst_m1': (0x02, NONE), 'iconst_0': (0x03, NONE),
+    'iconst_1': (0x04, NONE), 'iconst_2': (0x05, NONE),
+    'iconst_3': (0x06, NONE), 'iconst_4': (0x07, NONE),
+    'iconst_5': (0x08, NONE),
+    'bipush': (0x10, BYTE), 'sipush': (0x11, SHORT),
+    'ldc': (0x12, CONSTANT), 'ldc_w': (0x12, CONSTANT),
+    'iload': (0x15, LOCAL), 'aload': (0x19, LOCAL),
+    'iaload': (0x2e, NONE), 'baload': (0x33, NONE), 'caload': (0x34, NONE),
+    'istore': (0x36, LOCAL), 'astore': (0x3a, LOCAL),
+    'iastore': (0x4f, NONE), 'bastore': (0x54, NONE), 'castore': (0x55, NONE),
+    'pop': (0x57, NONE), 'dup': (0x59, NONE), 'dup_x1': (0x5a, NONE),
+    'swap': (0x5f, NONE),
+    'iadd': (0x60, NONE), 'isub': (0x64, NONE), 'imul': (0x68, NONE),
+    'idiv': (0x6c, NONE), 'irem': (0x70, NONE), 'ineg': (0x74, NONE),
+    'ishl': (0x78, NONE), 'ishr': (0x7a, NONE), 'iushr': (0x7c, NONE),
+    'iand': (0x7e, NONE), 'ior': (0x80, NONE), 'ixor': (0x82, NONE),
+    'iinc': (0x84, IINC),
+    'i2b': (0x91, NONE), 'i2c': (0x92, NONE), 'i2s': (0x93, NONE),
+    'ifeq': (0x99, BRANCH), 'ifne': (0x9a, BRANCH), 'iflt': (0x9b, BRANCH),
+    'ifge': (0x9c, BRANCH), 'ifgt': (0x9d, BRANCH), 'ifle': (0x9e, BRANCH),
+    'if_icmpeq': (0x9f, BRANCH), 'if_icmpne': (0xa0, BRANCH),
+    'if_icmplt': (0xa1, BRANCH), 'if_icmpge': (0xa2, BRANCH),
+    'if_icmpgt': (0xa3, BRANCH), 'if_icmple': (0xa4, BRANCH),
+    'if_acmpeq': (0xa5, BRANCH), 'if_acmpne': (0xa6, BRANCH),
+    'goto': (0xa7, BRANCH),
+    'tableswitch': (0xaa, TABLE_SWITCH), 'lookupswitch': (0xab, LOOKUP_SWITCH),
+    'ireturn': (0xac, NONE), 'areturn': (0xb0, NONE), 'return': (0xb1, NONE),
+    'getstatic': (0xb2, FIELD), 'putstatic': (0xb3, FIELD),
+    'getfield': (0xb4, FIELD), 'putfield': (0xb5, FIELD),
+    'invokevirtual': (0xb6, METHOD), 'invokespecial': (0xb7, METHOD),
+    'invokenonvirtual': (0xb7, METHOD), 'invokestatic': (0xb8, METHOD),
+    'new': (0xbb, CLASS), 'newarray': (0xbc, ARRAY_TYPE),
+    'anewarray': (0xbd, CLASS), 'arraylength': (0xbe, NONE),
+    'athrow': (0xbf, NONE), 'checkcast': (0xc0, CLASS),
+    'instanceof': (0xc1, CLASS),
+    'ifnull': (0xc6, BRANCH), 'ifnonnull': (0xc7, BRANCH),
+    'goto_w': (0xc8, BRANCH),
+}
+
+# Opcodes of the one-byte forms of loads and stores of locals 0 to 3.
+short_forms = { 'iload': 0x1a, 'aload': 0x2a, 'istore': 0x3b, 'astore': 0x4b }
+
+WIDE = 0xc4
+GOTO_W = 0xc8
+
+# Each conditional branch with the branch that jumps in the opposite case.
+negations = {
+    'ifeq': 'ifne', 'ifne': 'ifeq', 'iflt': 'ifge', 'ifge': 'iflt',
+    'ifgt': 'ifle', 'ifle': 'ifgt',
+    'if_icmpeq': 'if_icmpne', 'if_icmpne': 'if_icmpeq',
+    'if_icmplt': 'if_icmpge', 'if_icmpge': 'if_icmplt',
+    'if_icmpgt': 'if_icmple', 'if_icmple': 'if_icmpgt',
+    'if_acmpeq': 'if_acmpne', 'if_acmpne': 'if_acmpeq',
+    'ifnull': 'ifnonnull', 'ifnonnull': 'ifnull',
+}
+
+# Instructions after which execution never continues with the next one.
+unconditional = { 'goto', 'goto_w', 'tableswitch', 'lookupswitch',
+                  'ireturn', 'areturn', 'return', 'athrow' }
+
+# Verification types. Object types are pairs ('object', class name) and
+# objects created by new are ('uninitialized', index of the new).
+TOP = 'top'
+INT = 'int'
+NULL = 'null'
+UNINITIALIZED_THIS = 'uninitializedThis'
+THROWABLE = ('object', 'java/lang/Throwable')
+
+# The number of values each simple instruction pops and the types it pushes.
+stack_effects = {
+    'nop': (0, []), 'aconst_null': (0, [NULL]),
+    'iconst_m1': (0, [INT]), 'iconst_0': (0, [INT]), 'iconst_1': (0, [INT]),
+    'iconst_2': (0, [INT]), 'iconst_3': (0, [INT]), 'iconst_4': (0, [INT]),
+    'iconst_5': (0, [INT]), 'bipush': (0, [INT]), 'sipush': (0, [INT]),
+    'iaload': (2, [INT]), 'baload': (2, [INT]), 'caload': (2, [INT]),
+    'iastore': (3, []), 'bastore': (3, []), 'castore': (3, []),
+    'pop': (1, []),
+    'iadd': (2, [INT]), 'isub': (2, [INT]), 'imul': (2, [INT]),
+    'idiv': (2, [INT]), 'irem': (2, [INT]), 'ineg': (1, [INT]),
+    'ishl': (2, [INT]), 'ishr': (2, [INT]), 'iushr': (2, [INT]),
+    'iand': (2, [INT]), 'ior': (2, [INT]), 'ixor': (2, [INT]),
+    'iinc': (0, []), 'i2b': (1, [INT]), 'i2c': (1, [INT]), 'i2s': (1, [INT]),
+    'ifeq': (1, []), 'ifne': (1, []), 'iflt': (1, []), 'ifge': (1, []),
+    'ifgt': (1, []), 'ifle': (1, []),
+    'if_icmpeq': (2, []), 'if_icmpne': (2, []), 'if_icmplt': (2, []),
+    'if_icmpge': (2, []), 'if_icmpgt': (2, []), 'if_icmple': (2, []),
+    'if_acmpeq': (2, []), 'if_acmpne': (2, []),
+    'goto': (0, []), 'goto_w': (0, []),
+    'tableswitch': (1, []), 'lookupswitch': (1, []),
+    'ireturn': (1, []), 'areturn': (1, []), 'return': (0, []),
+    'arraylength': (1, [INT]), 'athrow': (1, []),
+    'instanceof': (1, [INT]), 'ifnull': (1, []), 'ifnonnull': (1, []),
+}
+
+# The codes and descriptors of the element types of newarray.
+array_types = { 'boolean': 4, 'char': 5, 'byte': 8, 'short': 9, 'int': 10 }
+array_descriptors = { 'boolean': '[Z', 'char': '[C', 'byte': '[B',
+                      'short': '[S', 'int': '[I' }
+
+access_flags = { 'public': 0x0001, 'private': 0x0002, 'protected': 0x0004,
+                 'static': 0x0008, 'final': 0x0010, 'synchronized': 0x0020,
+                 'super': 0x0020 }
+
+def is_label(instruction):
+    '''Returns True if instruction defines a label.'''
+    return instruction[0][-1] == ':'
+
+def field_type(descriptor):
+    '''Returns the verification type of a value of the field descriptor.'''
+    if descriptor in ('I', 'Z', 'B', 'C', 'S'):
+        return INT
+    if descriptor[0] == 'L':
+        return ('object', descriptor[1:-1])
+    if descriptor[0] == '[':
+        return ('object', descriptor)
+    raise Assembly_Error('unsupported type ' + descriptor)
+
+def method_types(descriptor):
+    '''Returns the verification types of the arguments of the method
+       descriptor and of its result (None for void).'''
+    arguments, index = [], 1
+    while descriptor[index] != ')':
+        start = index
+        while descriptor[index] == '[':
+            index += 1
+        if descriptor[index] == 'L':
+            index = descriptor.index(';', index)
+        index += 1
+        arguments.append(field_type(descriptor[start:index]))
+    result = descriptor[index + 1:]
+    return arguments, None if result == 'V' else field_type(result)
+
+def split_member(reference):
+    '''Splits a Jasmin field or method reference such as
+       java/lang/System/out or java/util/Scanner.nextInt()I into the class,
+       the name and the rest (the method descriptor, if any).'''
+    paren = reference.find('(')
+    if paren < 0:
+        paren = len(reference)
+    separator = max(reference.rfind('/', 0, paren), reference.rfind('.', 0, paren))
+    return (reference[:separator].replace('.', '/'),
+            reference[separator + 1:paren], reference[paren:])
+
+class Constant_Pool:
+    '''The constant pool of a class file. Each add method returns the index
+       of an entry, adding the entry if it is not in the pool yet.'''
+    def __init__(self):
+        self.entries = []
+        self.index = {}
+    def add(self, key, data):
+        if key not in self.index:
+            self.entries.append(data)
+            self.index[key] = len(self.entries)
+        return self.index[key]
+    def utf8(self, text):
+        encoded = text.encode('utf-8')
+        return self.add(('Utf8', text),
+                        struct.pack('>BH', 1, len(encoded)) + encoded)
+    def integer(self, value):
+        return self.add(('Integer', value), struct.pack('>Bi', 3, value))
+    def string(self, text):
+        return self.add(('String', text), struct.pack('>BH', 8, self.utf8(text)))
+    def class_(self, name):
+        return self.add(('Class', name), struct.pack('>BH', 7, self.utf8(name)))
+    def name_and_type(self, name, descriptor):
+        return self.add(('NameAndType', name, descriptor),
+                        struct.pack('>BHH', 12, self.utf8(name),
+                                    self.utf8(descriptor)))
+    def field(self, class_name, name, descriptor):
+        return self.add(('Fieldref', class_name, name, descriptor),
+                        struct.pack('>BHH', 9, self.class_(class_name),
+                                    self.name_and_type(name, descriptor)))
+    def method(self, class_name, name, descriptor):
+        return self.add(('Methodref', class_name, name, descriptor),
+                        struct.pack('>BHH', 10, self.class_(class_name),
+                                    self.name_and_type(name, descriptor)))
+    def constant(self, value):
+        '''Returns the index of an int or string constant for ldc.'''
+        if isinstance(value, int):
+            return self.integer(value)
+        return self.string(value)
+    def count(self):
+        return len(self.entries) + 1
+    def data(self):
+        return b''.join(self.entries)
+
+class Method:
+    '''A method being assembled: its instructions without the labels, and
+       the index of the instruction each label stands before.'''
+    def __init__(self, class_name, access, name, descriptor):
+        self.class_name = class_name
+        self.access = access
+        self.name = name
+        self.descriptor = descriptor
+        self.max_stack = None
+        self.max_locals = None
+        self.instructions = []
+        self.labels = {}
+        self.catches = []
+
+    def initial_locals(self):
+        '''Returns the types of the locals on entry to the method.'''
+        arguments, result = method_types(self.descriptor)
+        if self.access & access_flags['static']:
+            return arguments
+        if self.name == '<init>':
+            return [UNINITIALIZED_THIS] + arguments
+        return [('object', self.class_name)] + arguments
+
+    def target(self, label):
+        '''Returns the index of the instruction label stands before.'''
+        if label not in self.labels:
+            raise Assembly_Error('undefined label ' + label + ' in ' + self.name)
+        return self.labels[label]
+
+    def targets(self, instruction):
+        '''Returns the indices of the instructions a branch or switch can
+           jump to.'''
+        kind = opcodes[instruction[0]][1]
+        if kind == BRANCH:
+            return [self.target(instruction[1])]
+        if kind == TABLE_SWITCH:
+            return [self.target(label) for label in instruction[2]] + \
+                   [self.target(instruction[3])]
+        if kind == LOOKUP_SWITCH:
+            return [self.target(label) for (key, label) in instruction[1]] + \
+                   [self.target(instruction[2])]
+        return []
+
+    def locals_needed(self):
+        '''Returns the number of locals the code needs.'''
+        max_locals = len(self.initial_locals())
+        for instruction in self.instructions:
+            if opcodes[instruction[0]][1] in (LOCAL, IINC):
+                max_locals = max(max_locals, instruction[1] + 1)
+        return max_locals
+
+    def max_height(self):
+        '''Returns the largest stack height of the code, as
+           Method_Assembler.limits does, but following only the height of
+           the stack along each path and not the types of its values, so
+           it takes time linear in the size of the code.'''
+        count = len(self.instructions)
+        heights = [None] * count
+        handlers = [(self.target(start), self.target(end), self.target(handler))
+                    for (class_name, start, end, handler) in self.catches]
+        work = []
+        def reach(index, height):
+            if index >= count:
+                raise Assembly_Error('execution falls off the end of ' + self.name)
+            if heights[index] is None:
+                heights[index] = height
+                work.append(index)
+            elif heights[index] != height:
+                raise Assembly_Error('stack heights differ where control flow merges')
+        max_stack = 0
+        if count:
+            reach(0, 0)
+        while work:
+            index = work.pop()
+            instruction = self.instructions[index]
+            popped, pushed = stack_change(instruction)
+            if popped > heights[index]:
+                raise Assembly_Error('stack underflow at ' + instruction[0] +
+                                     ' in ' + self.name)
+            after = heights[index] - popped + pushed
+            max_stack = max(max_stack, heights[index], after)
+            for (start, end, handler) in handlers:
+                if start <= index < end:
+                    reach(handler, 1)
+            for target in self.targets(instruction):
+                reach(target, after)
+            if instruction[0] not in unconditional:
+                reach(index + 1, after)
+        if None in heights:
+            max_stack = max(max_stack, 1) # for the athrow of unreachable code
+        return max_stack
+
+    def execute(self, index, locals, stack):
+        '''Returns the types of the locals and the stack after the
+           instruction at index, given the types before it.'''
+        instruction = self.instructions[index]
+        op = instruction[0]
+        locals, stack = list(locals), list(stack)
+        def pop(count):
+            if count > len(stack):
+                raise Assembly_Error('stack underflow at ' + op + ' in ' + self.name)
+            popped = stack[len(stack) - count:]
+            del stack[len(stack) - count:]
+            return popped
+        def store(local, value):
+            if local >= len(locals):
+                locals.extend([TOP] * (local + 1 - len(locals)))
+            locals[local] = value
+        if op in stack_effects:
+            count, pushed = stack_effects[op]
+            pop(count)
+            stack += pushed
+        elif op in ('iload', 'aload'):
+            local = instruction[1]
+            if local >= len(locals) or locals[local] == TOP:
+                raise Assembly_Error('local ' + str(local) +
+                                     ' may be used before it is set in ' + self.name)
+            stack.append(locals[local])
+        elif op in ('istore', 'astore'):
+            store(instruction[1], pop(1)[0])
+        elif op in ('ldc', 'ldc_w'):
+            stack.append(INT if isinstance(instruction[1], int)
+                         else ('object', 'java/lang/String'))
+        elif op == 'dup':
+            stack += pop(1) * 2
+        elif op == 'dup_x1':
+            a, b = pop(2)
+            stack += [b, a, b]
+        elif op == 'swap':
+            a, b = pop(2)
+            stack += [b, a]
+        elif op in ('getstatic', 'putstatic', 'getfield', 'putfield'):
+            pop({ 'getstatic': 0, 'putstatic': 1,
+                  'getfield': 1, 'putfield': 2 }[op])
+            if op in ('getstatic', 'getfield'):
+                stack.append(field_type(instruction[2]))
+        elif opcodes[op][1] == METHOD:
+            class_name, name, descriptor = split_member(instruction[1])
+            arguments, result = method_types(descriptor)
+            pop(len(arguments))
+            if op != 'invokestatic':
+                receiver = pop(1)[0]
+                if name == '<init>':
+                    # the constructor initialises every copy of the object
+                    if receiver == UNINITIALIZED_THIS:
+                        initialised = ('object', self.class_name)
+                    else:
+                        initialised = ('object', self.instructions[receiver[1]][1])
+                    locals = [initialised if t == receiver else t for t in locals]
+                    stack = [initialised if t == receiver else t for t in stack]
+            if result:
+                stack.append(result)
+        elif op == 'new':
+            stack.append(('uninitialized', index))
+        elif op == 'newarray':
+            pop(1)
+            stack.append(('object', array_descriptors[instruction[1]]))
+        elif op == 'anewarray':
+            pop(1)
+            name = instruction[1]
+            stack.append(('object', '[' + (name if name[0] == '['
+                                           else 'L' + name + ';')))
+        elif op == 'checkcast':
+            pop(1)
+            stack.append(('object', instruction[1]))
+        else:
+            raise Assembly_Error('unsupported instruction ' + op)
+        return locals, stack
+
+def merge_types(a, b):
+    '''Returns the type of a value that may have type a or type b.'''
+    if a == b:
+        return a
+    if a == NULL and b[0] == 'object':
+        return b
+    if b == NULL and a[0] == 'object':
+        return a
+    return TOP
+
+def merge(state, other):
+    '''Merges two pairs (types of locals, types of the stack).'''
+    locals, stack = state
+    other_locals, other_stack = other
+    if len(stack) != len(other_stack):
+        raise Assembly_Error('stack heights differ where control flow merges')
+    size = max(len(locals), len(other_locals))
+    locals = locals + [TOP] * (size - len(locals))
+    other_locals = other_locals + [TOP] * (size - len(other_locals))
+    merged_locals = [merge_types(a, b) for (a, b) in zip(locals, other_locals)]
+    while merged_locals and merged_locals[-1] == TOP:
+        merged_locals.pop()
+    merged_stack = []
+    for (a, b) in zip(stack, other_stack):
+        t = merge_types(a, b)
+        if t == TOP:
+            if a[0] == 'object' and b[0] == 'object':
+                t = ('object', 'java/lang/Object')
+            else:
+                raise Assembly_Error('stack types differ where control flow merges')
+        merged_stack.append(t)
+    return merged_locals, merged_stack
+
+class Method_Assembler:
+    '''Lays out, verifies and encodes the code of one method.'''
+    def __init__(self, method, pool):
+        self.method = method
+        self.pool = pool
+        self.instructions = method.instructions
+        # conditional branches and gotos that need a 32 bit offset
+        self.wide = set()
+
+    def flow(self):
+        '''Computes the types of the locals and the stack before each
+           instruction, as the verifier does. Unreachable instructions get
+           None. Returns the largest stack height.'''
+        method = self.method
+        count = len(self.instructions)
+        self.states = [None] * count
+        handlers = []
+        for (class_name, start, end, handler) in method.catches:
+            handlers.append((method.target(start), method.target(end),
+                             method.target(handler),
+                             THROWABLE if class_name == 'all'
+                             else ('object', class_name)))
+        max_stack = 0
+        work = []
+        def reach(index, state):
+            if index >= count:
+                raise Assembly_Error('execution falls off the end of ' + method.name)
+            old = self.states[index]
+            new = state if old is None else merge(old, state)
+            if new != old:
+                self.states[index] = new
+                work.append(index)
+        reach(0, (method.initial_locals(), []))
+        while work:
+            index = work.pop()
+            locals, stack = self.states[index]
+            max_stack = max(max_stack, len(stack))
+            after = self.method.execute(index, locals, stack)
+            max_stack = max(max_stack, len(after[1]))
+            for (start, end, handler, exception) in handlers:
+                if start <= index < end:
+                    reach(handler, (locals, [exception]))
+                    reach(handler, (after[0], [exception]))
+            op = self.instructions[index][0]
+            for target in self.method.targets(self.instructions[index]):
+                reach(target, after)
+            if op not in unconditional:
+                reach(index + 1, after)
+        return max_stack
+
+    def size(self, index, offset):
+        '''Returns the number of bytes of the instruction at index when it
+           starts at offset.'''
+        instruction = self.instructions[index]
+        op = instruction[0]
+        kind = opcodes[op][1]
+        if kind == NONE:
+            return 1
+        if kind == LOCAL:
+            local = instruction[1]
+            return 1 if local <= 3 else 2 if local <= 255 else 4
+        if kind == BYTE or kind == ARRAY_TYPE:
+            return 2
+        if kind == CONSTANT:
+            return 2 if self.pool.constant(instruction[1]) <= 255 else 3
+        if kind == IINC:
+            local, increment = instruction[1], instruction[2]
+            return 3 if local <= 255 and -128 <= increment <= 127 else 6
+        if kind == BRANCH:
+            if op == 'goto_w':
+                return 5
+            if index in self.wide:
+                return 5 if op == 'goto' else 8
+            return 3
+        padding = (3 - offset) % 4
+        if kind == TABLE_SWITCH:
+            return 1 + padding + 12 + 4 * len(instruction[2])
+        if kind == LOOKUP_SWITCH:
+            return 1 + padding + 8 + 8 * len(instruction[1])
+        return 3 # SHORT, FIELD, METHOD, CLASS
+
+    def layout(self):
+        '''Computes the offset of each instruction. Branches whose target is
+           out of reach of a 16 bit offset are made wide, which moves later
+           instructions, so this is repeated until nothing changes.'''
+        while True:
+            self.offsets = []
+            offset = 0
+            for index in range(len(self.instructions)):
+                self.offsets.append(offset)
+                offset += self.size(index, offset)
+            self.offsets.append(offset)
+            changed = False
+            for (index, instruction) in enumerate(self.instructions):
+                if opcodes[instruction[0]][1] == BRANCH and index not in self.wide:
+                    distance = self.offsets[self.method.target(instruction[1])] - \
+                               self.offsets[index]
+                    if not -32768 <= distance <= 32767:
+                        self.wide.add(index)
+                        changed = True
+            if not changed:
+                return offset
+
+    def encode(self, index):
+        '''Returns the bytes of the instruction at index.'''
+        instruction = self.instructions[index]
+        op = instruction[0]
+        opcode, kind = opcodes[op]
+        offset = self.offsets[index]
+        if self.states[index] is None:
+            size = self.offsets[index + 1] - offset
+            return bytes(size - 1) + bytes([opcodes['athrow'][0]]) \
+                   if self.last_of_dead_range(index) else bytes(size)
+        def relative(label):
+            return self.offsets[self.method.target(label)] - offset
+        if kind == NONE:
+            return bytes([opcode])
+        if kind == LOCAL:
+            local = instruction[1]
+            if local <= 3:
+                return bytes([short_forms[op] + local])
+            if local <= 255:
+                return bytes([opcode, local])
+            return struct.pack('>BBH', WIDE, opcode, local)
+        if kind == BYTE or kind == SHORT:
+            value, bits = instruction[1], 8 if kind == BYTE else 16
+            if not -2**(bits - 1) <= value < 2**(bits - 1):
+                raise Assembly_Error(op + ' ' + str(value) + ' is out of range')
+            return struct.pack('>Bb' if kind == BYTE else '>Bh', opcode, value)
+        if kind == ARRAY_TYPE:
+            return bytes([opcode, array_types[instruction[1]]])
+        if kind == CONSTANT:
+            constant = self.pool.constant(instruction[1])
+            if constant <= 255:
+                return bytes([opcodes['ldc'][0], constant])
+            return struct.pack('>BH', 0x13, constant)
+        if kind == IINC:
+            local, increment = instruction[1], instruction[2]
+            if local <= 255 and -128 <= increment <= 127:
+                return struct.pack('>BBb', opcode, local, increment)
+            return struct.pack('>BBHh', WIDE, opcode, local, increment)
+        if kind == BRANCH:
+            if op == 'goto_w':
+                return struct.pack('>Bi', GOTO_W, relative(instruction[1]))
+            if index in self.wide:
+                if op == 'goto':
+                    return struct.pack('>Bi', GOTO_W, relative(instruction[1]))
+                # jump over a goto_w if the condition does not hold
+                return struct.pack('>BhBi', opcodes[negations[op]][0], 8,
+                                   GOTO_W, relative(instruction[1]) - 3)
+            return struct.pack('>Bh', opcode, relative(instruction[1]))
+        if kind == FIELD:
+            class_name, name, rest = split_member(instruction[1])
+            return struct.pack('>BH', opcode,
+                               self.pool.field(class_name, name, instruction[2]))
+        if kind == METHOD:
+            class_name, name, descriptor = split_member(instruction[1])
+            return struct.pack('>BH', opcode,
+                               self.pool.method(class_name, name, descriptor))
+        if kind == CLASS:
+            return struct.pack('>BH', opcode, self.pool.class_(instruction[1]))
+        padding = bytes((3 - offset) % 4)
+        if kind == TABLE_SWITCH:
+            low, labels, default = instruction[1], instruction[2], instruction[3]
+            return bytes([opcode]) + padding + \
+                   struct.pack('>iii', relative(default), low, low + len(labels) - 1) + \
+                   b''.join(struct.pack('>i', relative(label)) for label in labels)
+        pairs, default = instruction[1], instruction[2]
+        return bytes([opcode]) + padding + \
+               struct.pack('>ii', relative(default), len(pairs)) + \
+               b''.join(struct.pack('>ii', key, relative(label))
+                        for (key, label) in sorted(pairs))
+
+    def last_of_dead_range(self, index):
+        '''Returns True if the unreachable instruction at index is the last
+           of a run of unreachable instructions.'''
+        return index + 1 == len(self.instructions) or \
+               self.states[index + 1] is not None
+
+    def frame_indices(self):
+        '''Returns the indices of the instructions that need a stack map
+           frame: jump targets, exception handlers, instructions after a
+           widened conditional branch and the starts of unreachable code.'''
+        indices = set()
+        for (index, instruction) in enumerate(self.instructions):
+            if self.states[index] is None:
+                if index == 0 or self.states[index - 1] is not None:
+                    indices.add(index)
+                continue
+            indices.update(self.method.targets(instruction))
+            if index in self.wide and instruction[0] != 'goto':
+                indices.add(index + 1)
+        for (class_name, start, end, handler) in self.method.catches:
+            indices.add(self.method.target(handler))
+        indices.discard(len(self.instructions))
+        return sorted(indices)
+
+    def verification_type(self, t):
+        if t == TOP:
+            return b'\x00'
+        if t == INT:
+            return b'\x01'
+        if t == NULL:
+            return b'\x05'
+        if t == UNINITIALIZED_THIS:
+            return b'\x06'
+        if t[0] == 'object':
+            return struct.pack('>BH', 7, self.pool.class_(t[1]))
+        return struct.pack('>BH', 8, self.offsets[t[1]])
+
+    def stack_map_table(self):
+        '''Returns the StackMapTable attribute, or None if no instruction
+           needs a frame. Every frame is a full frame.'''
+        frames = []
+        previous = -1
+        for index in self.frame_indices():
+            if self.states[index] is None:
+                locals, stack = [], [THROWABLE]
+            else:
+                locals, stack = self.states[index]
+                locals = list(locals)
+                while locals and locals[-1] == TOP:
+                    locals.pop()
+            offset = self.offsets[index]
+            frames.append(struct.pack('>BHH', 255, offset - previous - 1, len(locals)) +
+                          b''.join(self.verification_type(t) for t in locals) +
+                          struct.pack('>H', len(stack)) +
+                          b''.join(self.verification_type(t) for t in stack))
+            previous = offset
+        if not frames:
+            return None
+        data = struct.pack('>H', len(frames)) + b''.join(frames)
+        return struct.pack('>HI', self.pool.utf8('StackMapTable'), len(data)) + data
+
+    def limits(self):
+        '''Returns the largest stack height and the number of locals the
+           code needs. The types are computed as a side effect.'''
+        max_stack = self.flow()
+        if None in self.states:
+            max_stack = max(max_stack, 1) # for the athrow of unreachable code
+        return max_stack, self.method.locals_needed()
+
+    def code_attribute(self):
+        '''Returns the Code attribute of the method.'''
+        method = self.method
+        if not self.instructions:
+            raise Assembly_Error('method ' + method.name + ' has no code')
+        max_stack, max_locals = self.limits()
+        length = self.layout()
+        if length > 65535:
+            raise Assembly_Error('method ' + method.name + ' is larger than 64KB')
+        code = b''.join(self.encode(index) for index in range(len(self.instructions)))
+        if method.max_stack is not None:
+            max_stack = method.max_stack
+        if method.max_locals is not None:
+            max_locals = method.max_locals
+        exceptions = b''
+        for (class_name, start, end, handler) in method.catches:
+            exceptions += struct.pack('>HHHH',
+                self.offsets[method.target(start)],
+                self.offsets[method.target(end)],
+                self.offsets[method.target(handler)],
+                0 if class_name == 'all' else self.pool.class_(class_name))
+        attributes = []
+        stack_map_table = self.stack_map_table()
+        if stack_map_table:
+            attributes.append(stack_map_table)
+        data = struct.pack('>HHI', max_stack, max_locals, len(code)) + code + \
+               struct.pack('>H', len(method.catches)) + exceptions + \
+               struct.pack('>H', len(attributes)) + b''.join(attributes)
+        return struct.pack('>HI', self.pool.utf8('Code'), len(data)) + data
+
+def flags(words):
+    '''Returns the access flags named by words.'''
+    result = 0
+    for word in words:
+        if word not in access_flags:
+            raise Assembly_Error('unknown access flag ' + word)
+        result |= access_flags[word]
+    return result
+
+def read_class(instructions):
+    '''Returns the name, superclass, access flags, fields and Methods of the
+       class defined by instructions. Each Method also records the indices
+       of its .method and .end directives in instructions.'''
+    class_name, super_name, class_access = None, 'java/lang/Object', 0
+    fields, methods = [], []
+    method = None
+    for (index, instruction) in enumerate(instructions):
+        op = instruction[0]
+        if is_label(instruction):
+            if method is None:
+                raise Assembly_Error('label ' + op + ' outside of a method')
+            method.labels[op[:-1]] = len(method.instructions)
+        elif op == '.class':
+            class_name = instruction[-1]
+            class_access = flags(instruction[1:-1]) | access_flags['super']
+        elif op == '.super':
+            super_name = instruction[1]
+        elif op == '.field':
+            # .field access... name descriptor
+            fields.append((flags(instruction[1:-2]), instruction[-2], instruction[-1]))
+        elif op == '.method':
+            signature = instruction[-1]
+            paren = signature.index('(')
+            method = Method(class_name, flags(instruction[1:-1]),
+                            signature[:paren], signature[paren:])
+            method.start = index
+        elif op == '.limit':
+            if instruction[1] == 'stack':
+                method.max_stack = instruction[2]
+            else:
+                method.max_locals = instruction[2]
+        elif op == '.catch':
+            # .catch class from start to end using handler
+            method.catches.append((instruction[1], instruction[3],
+                                   instruction[5], instruction[7]))
+        elif op == '.end':
+            if method is None:
+                raise Assembly_Error('.end method outside of a method')
+            method.end = index
+            methods.append(method)
+            method = None
+        elif op in opcodes or op[:-2] in short_forms:
+            if method is None:
+                raise Assembly_Error('instruction ' + op + ' outside of a method')
+            # the one-byte forms are chosen when the code is encoded
+            if op not in opcodes:
+                instruction = (op[:-2], int(op[-1]))
+            method.instructions.append(instruction)
+        else:
+            raise Assembly_Error('unknown instruction ' + op)
+    if class_name is None:
+        raise Assembly_Error('missing .class directive')
+    return class_name, super_name, class_access, fields, methods
+
+def with_limits(instructions):
+    '''Returns instructions with the .limit directives of each method
+       replaced by the exact stack height and number of locals its code
+       needs, for assemblers such as Jasmin that do not compute them. Only
+       the stack height is followed, not the types, so as with those
+       assemblers it is left to the verifier to reject code that may load a
+       local before it is set.'''
+    methods = read_class(instructions)[-1]
+    result = []
+    start = 0
+    for method in methods:
+        result += instructions[start:method.start + 1]
+        result.append(('.limit', 'stack', method.max_height()))
+        result.append(('.limit', 'locals', method.locals_needed()))
+        result += [instruction for instruction in instructions[method.start + 1:method.end]
+                   if instruction[0] != '.limit']
+        start = method.end
+    return result + instructions[start:]
+
+def stack_change(instruction):
+    '''Returns the number of values instruction pops from the stack and the
+       number it pushes.'''
+    op = instruction[0]
+    if op in stack_effects:
+        count, pushed = stack_effects[op]
+        return count, len(pushed)
+    if op in ('iload', 'aload', 'ldc', 'ldc_w', 'new') or op[:-2] in ('iload', 'aload'):
+        return 0, 1
+    if op in ('istore', 'astore') or op[:-2] in ('istore', 'astore'):
+        return 1, 0
+    if op in ('newarray', 'anewarray', 'checkcast'):
+        return 1, 1
+    if op in ('dup', 'dup_x1', 'swap'):
+        return { 'dup': (1, 2), 'dup_x1': (2, 3), 'swap': (2, 2) }[op]
+    if op in ('getstatic', 'putstatic', 'getfield', 'putfield'):
+        return { 'getstatic': (0, 1), 'putstatic': (1, 0),
+                 'getfield': (1, 1), 'putfield': (2, 0) }[op]
+    if op in opcodes and opcodes[op][1] == METHOD:
+        arguments, result = method_types(split_member(instruction[1])[2])
+        return len(arguments) + (op != 'invokestatic'), 0 if result is None else 1
+    raise Assembly_Error('unsupported instruction ' + op)
+
+class Streamed_Limits:
+    '''An instruction sink that passes the instructions on to the sink
+       output as they come, and gives each method the .limit directives
+       with_limits would, but just before its .end, when they are known.
+       The stack height is followed in the order of the code rather than
+       along every path: after an instruction that does not fall through, a
+       label has the height of the jumps to it seen before, or an empty
+       stack if there are none, as at the start of each statement the
+       compiler generates. Only the heights that are not zero are kept, so
+       the code can be of any size.'''
+    def __init__(self, output):
+        self.output = output
+        # the height of the stack at the labels jumped to with values on it
+        self.heights = {}
+
+    def emit(self, *instruction):
+        op = instruction[0]
+        if op == '.limit':
+            return
+        if op == '.method':
+            signature = instruction[-1]
+            arguments, result = method_types(signature[signature.index('('):])
+            self.locals = len(arguments) + ('static' not in instruction)
+            self.height = self.max_stack = 0
+        elif op == '.catch':
+            # the handler starts with the exception on the stack
+            self.heights[instruction[7]] = 1
+        elif op == '.end':
+            self.output.emit('.limit', 'stack', self.max_stack)
+            self.output.emit('.limit', 'locals', self.locals)
+        elif op[0] != '.':
+            if self.height is None:
+                self.height = 0 # unreachable
+            count, pushed = stack_change(instruction)
+            self.height -= count
+            kind = opcodes[op][1] if op in opcodes else LOCAL
+            if kind == BRANCH:
+                self.jump(instruction[1])
+            elif kind == TABLE_SWITCH:
+                for label in instruction[2] + [instruction[3]]:
+                    self.jump(label)
+            elif kind == LOOKUP_SWITCH:
+                for (key, label) in instruction[1] + [(None, instruction[2])]:
+                    self.jump(label)
+            elif kind in (LOCAL, IINC):
+                local = instruction[1] if op in opcodes else int(op[-1])
+                self.locals = max(self.locals, local + 1)
+            self.height += pushed
+            self.max_stack = max(self.max_stack, self.height)
+            if op in unconditional:
+                self.height = None
+        self.output.emit(*instruction)
+
+    def jump(self, label):
+        if self.height:
+            self.heights[label] = self.height
+
+    def label(self, label):
+        height = self.heights.pop(label, None)
+        if self.height is None:
+            self.height = height or 0
+        self.output.label(label)
+
+def assemble(instructions):
+    '''Returns the bytes of the class file for instructions.'''
+    class_name, super_name, class_access, fields, methods = read_class(instructions)
+    pool = Constant_Pool()
+    this_class = pool.class_(class_name)
+    super_class = pool.class_(super_name)
+    field_data = b''.join(struct.pack('>HHHH', access, pool.utf8(name),
+                                      pool.utf8(descriptor), 0)
+                          for (access, name, descriptor) in fields)
+    method_data = b''
+    for method in methods:
+        code = Method_Assembler(method, pool).code_attribute()
+        method_data += struct.pack('>HHHH', method.access, pool.utf8(method.name),
+                                   pool.utf8(method.descriptor), 1) + code
+    if pool.count() > 65535:
+        raise Assembly_Error('too many constants')
+    # version 50 is the first with StackMapTable attributes
+    return struct.pack('>IHHH', 0xCAFEBABE, 0, 50, pool.count()) + pool.data() + \
+           struct.pack('>HHHH', class_access, this_class, super_class, 0) + \
+           struct.pack('>H', len(fields)) + field_data + \
+           struct.pack('>H', len(methods)) + method_data + \
+           struct.pack('>H', 0)
@@ -0,0 +1,138 @@
+'''Compiles a program through a running compile server (see server.py).
+
+Usage: python client.py [--socket PATH] [the options of compiler.py]
+                        [program.txt] > Program.j
+
+It takes the program in the file given or on standard input and writes the
+bytecode or the error report on standard output, and the reports of
+--peephole-stats and --profile on standard error, as compiler.py does, but
+only imports the standard library, so it starts much faster. The program
+is sent to the server whole, so it is not mapped into memory as
+compiler.py maps it.
+
+The client and the server exchange messages over a Unix socket. Each
+message is a line of JSON, the header, followed by as many bytes as its
+'length' says. A request has the source as its bytes and may give the
+'format' ('jasmin' or 'class'), the 'options' of compiler.generate,
+'peephole_stats', 'profile' and 'profile_memory'. The response has the
+status 'ok' with the Jasmin assembly or class file as its bytes, the
+peephole rule counts in 'peephole' and the measurements of
+compiler.Compile_Stats.as_dict in 'profile' if they were asked for, or the
+status 'error' with the error report. Several requests may be sent over
+one connection.
+'''
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+def default_socket():
+    '''Returns the path of the socket the server listens on by default.'''
+    directory = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(directory, 'compiler-%d.sock' % os.getuid())
+
+def encode_message(header, payload):
+    '''Returns the bytes of a message with the dict header and the bytes
+       payload.'''
+    header = dict(header, length=len(payload))
+    return json.dumps(header).encode('utf-8') + b'\n' + payload
+
+def read_message(stream):
+    '''Reads a message from the binary file stream and returns its header
+       and payload, or None at the end of the stream.'''
+    line = stream.readline()
+    if not line:
+        return None
+    header = json.loads(line)
+    payload = stream.read(header['length'])
+    if len(payload) < header['length']:
+        raise ConnectionError('the connection ended in a message')
+    return header, payload
+
+def request(source, format='jasmin', options={}, peephole_stats=False,
+            path=None, profile=False, profile_memory=False):
+    '''Has the server at path compile source, a string or UTF-8 bytes, and
+       returns the header and payload of its response. Raises OSError if no
+       server is listening.'''
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path or default_socket())
+        header = { 'format': format, 'options': options,
+                   'peephole_stats': peephole_stats, 'profile': profile,
+                   'profile_memory': profile_memory }
+        connection.sendall(encode_message(header, source))
+        with connection.makefile('rb') as stream:
+            response = read_message(stream)
+    if response is None:
+        raise ConnectionError('the server closed the connection')
+    return response
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compile the program on standard input to JVM bytecode '
+                    'on standard output, through a compile server.')
+    parser.add_argument('program', nargs='?',
+                        help='compile the program in this file instead')
+    parser.add_argument('--socket', default=None,
+                        help='the socket of the server (default %s)' % default_socket())
+    parser.add_argument('--format', choices=['jasmin', 'class'],
+                        default='jasmin',
+                        help='write Jasmin assembly (the default) or the '
+                             'binary Program.class')
+    parser.add_argument('--no-optimise', dest='optimise', action='store_false',
+                        help='translate the program as it is written')
+    parser.add_argument('--fast-io', action='store_true',
+                        help='read and write numbers through buffers in the '
+                             'generated program')
+    parser.add_argument('--method-size', type=int, default=8000,
+                        help='split programs into methods of about this '
+                             'many bytes of code at most (default 8000)')
+    parser.add_argument('--stream', action='store_true',
+                        help='translate each statement as soon as it is '
+                             'parsed, without building the syntax tree or '
+                             'optimising')
+    parser.add_argument('--profile', action='store_true',
+                        help='report the time of each phase and other '
+                             'measurements of the compilation as JSON on '
+                             'standard error')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='report the peak memory too, which makes the '
+                             'compilation slower')
+    parser.add_argument('--peephole-stats', action='store_true',
+                        help='report how often each peephole rule matched '
+                             'on standard error')
+    args = parser.parse_args()
+    options = { 'optimise': args.optimise, 'fast_io': args.fast_io,
+                'method_size': args.method_size, 'stream': args.stream }
+    if args.program:
+        with open(args.program, 'rb') as program_file:
+            source = program_file.read()
+    else:
+        source = sys.stdin.buffer.read()
+    try:
+        header, payload = request(source, args.format, options,
+                                  args.peephole_stats, args.socket,
+                                  args.profile or args.profile_memory,
+                                  args.profile_memory)
+    except OSError as error:
+        print('cannot reach the compile server: ' + str(error) +
+              ' (start it with python server.py)', file=sys.stderr)
+        sys.exit(1)
+    if header['status'] != 'ok':
+        print(payload.decode('utf-8'))
+        sys.exit()
+    if args.format == 'class':
+        sys.stdout.buffer.write(payload)
+    else:
+        sys.stdout.write(payload.decode('utf-8'))
+    if args.peephole_stats:
+        for (rule, hits) in header['peephole'].items():
+            print('%-20s %d' % (rule, hits), file=sys.stderr)
+    if 'profile' in header:
+        print(json.dumps(header['profile'], indent=1), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
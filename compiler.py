@@ -1,14 +1,34 @@
+import argparse
+import contextlib
+import io
+import json
+import mmap
+import os
 import re
+import stat
 import sys
+import time
+import tracemalloc
+from collections import Counter
+from functools import partial
+
+import classfile
+import ir
+from peephole import Peephole_Optimiser
 
 # Restrictions:
-# Integer constants must be short.
-# Stack size must not exceed 1024.
 # Integer is the only type.
 # Logical operators cannot be nested.
 
+# The most characters of the program an error report quotes.
+EXCERPT = 40
+
+class Compile_Error(Exception):
+    '''Raised for a lexical or syntax error in the program being compiled.
+       The message is the error report for the user.'''
+
 class Scanner:
-    '''The interface comprises the methods lookahead and consume.
+    '''The interface comprises the methods lookahead, consume and where.
        Other methods should not be called from outside of this class.'''
 
     def __init__(self, input_file):
@@ -29,14 +49,29 @@ class Scanner:
     def skip_white_space(self):
         '''Consumes all characters in input_string up to the next
            non-white-space character.'''
-        while self.current_char_index <= self.max_char_index and self.input_string[self.current_char_index].isspace():
-            self.current_char_index += 1
+        self.current_char_index = Token.white_space.match(
+            self.input_string, self.current_char_index).end()
 
     def no_token(self):
-        '''Stop execution if the input cannot be matched to a token.'''
-        print('lexical error: no token found at the start of ' +
-              self.input_string[self.current_char_index:])
-        exit()
+        '''Stop compilation if the input cannot be matched to a token.'''
+        raise Compile_Error('lexical error: no token found at ' +
+                            self.where(self.current_char_index) +
+                            ', at the start of ' + self.excerpt())
+
+    def excerpt(self):
+        '''Returns the rest of the line from current_char_index on, cut to
+           EXCERPT characters, for an error report.'''
+        index = self.current_char_index
+        return self.input_string[index:index + EXCERPT].split('\n')[0]
+
+    def where(self, index=None):
+        '''Returns where index of input_string is, or the next token if
+           index is None, as 'line l, column c' for an error report.'''
+        if index is None:
+            index = self.current_char_index - len(self.current_token[1])
+        line = self.input_string.count('\n', 0, index) + 1
+        column = index - self.input_string.rfind('\n', 0, index)
+        return 'line %d, column %d' % (line, column)
 
     def get_token(self):
         '''Returns the next token and the part of input_string it matched.
@@ -47,14 +82,18 @@ class Scanner:
         token, longest = None, ''
         # find the longest prefix of input_string that matches a token
         # if there is input remaining
-        if self.input_string[self.current_char_index:]:
-            for (t, r) in Token.token_regexp: # Token is in global namespace
-                match = re.match(r, self.input_string[self.current_char_index:])
-                if match and match.end() > len(longest):
-                    token, longest = t, match.group()
+        if self.current_char_index <= self.max_char_index:
+            # matching at an index avoids copying the rest of input_string
+            match = Token.token_pattern.match(self.input_string,
+                                              self.current_char_index)
+            # the groups hold what each token matches ('' for no match), in
+            # the order of token_regexp; max picks the first longest match
+            matches = match.groups('')
+            longest = max(matches, key=len)
             # error if input contains non-white-space characters that fail to match any token
-            if not token:
+            if not longest:
                 self.no_token()
+            token = Token.tokens[matches.index(longest)]
         # consume the token by moving the index to the end of the matched part
         self.current_char_index += len(longest)
         return (token, longest)
@@ -65,12 +104,13 @@ class Scanner:
         return self.current_token[0]
 
     def unexpected_token(self, found_token, expected_tokens):
-        '''Stop execution because an unexpected token was found.
+        '''Stop compilation because an unexpected token was found.
            found_token contains just the token, not its value.
            expected_tokens is a sequence of tokens.'''
-        print('syntax error: token in ' + repr(sorted(expected_tokens)) +
-              ' expected but ' + repr(found_token) + ' found')
-        exit()
+        raise Compile_Error('syntax error: token in ' +
+                            repr(sorted(expected_tokens)) +
+                            ' expected but ' + repr(found_token) +
+                            ' found at ' + self.where())
 
     def consume(self, *expected_tokens):
         '''Returns the next token and consumes it, if it is in
@@ -154,6 +194,150 @@ class Token:
         (ID,    '[a-z]+')
     ]
 
+    # The tokens in the order of token_regexp.
+    tokens = [t for (t, r) in token_regexp]
+
+    # A single pattern that tries every regular expression of token_regexp
+    # at once. Each one sits in an optional lookahead, so a match consumes
+    # nothing and group i holds what the i-th token matches (or None).
+    token_pattern = re.compile(''.join(['(?:(?=(' + r + ')))?'
+                                        for (t, r) in token_regexp]))
+
+    # White space between tokens.
+    white_space = re.compile(r'\s*')
+
+# The bytes that may end a token or white space that goes on after them:
+# an operator of two characters, or a white space character in UTF-8.
+MARGIN = 4
+
+# The bytes that continue a character in UTF-8.
+CONTINUATION = bytes(range(0x80, 0xc0))
+
+def count_lines(data, lines, column):
+    '''Returns the number of lines and of characters in the last line
+       after the bytes data, if lines lines and column characters come
+       before them.'''
+    newline = data.rfind(b'\n')
+    if newline >= 0:
+        lines += data.count(b'\n')
+        column = 0
+        data = data[newline + 1:]
+    return lines, column + len(data.translate(None, CONTINUATION))
+
+def mapped(input_file):
+    '''Returns the binary input_file mapped into memory, or None if it is
+       not a whole regular file, as a pipe is not.'''
+    try:
+        descriptor = input_file.fileno()
+        status = os.fstat(descriptor)
+        if not stat.S_ISREG(status.st_mode) or input_file.tell() != 0:
+            return None
+    except (OSError, ValueError):
+        return None
+    if status.st_size == 0:
+        return b'' # an empty file cannot be mapped
+    return mmap.mmap(descriptor, 0, access=mmap.ACCESS_READ)
+
+def utf8_white_space():
+    '''Returns a pattern that matches in UTF-8 what Token.white_space
+       matches in a string. No character after U+3000 is white space.'''
+    spaces = [chr(c) for c in range(0x3001) if Token.white_space.fullmatch(chr(c))]
+    # the characters of one byte are in a class, for speed
+    one_byte = b'[' + re.escape(''.join(c for c in spaces if c < '\x80').encode('ascii')) + b']*'
+    longer = b'|'.join(re.escape(c.encode('utf-8')) for c in spaces if c >= '\x80')
+    return re.compile(one_byte + b'(?:(?:' + longer + b')' + one_byte + b')*')
+
+class Byte_Scanner(Scanner):
+    '''A Scanner of a program in UTF-8 that is never read into a string:
+       the file at the path source, or the binary file source, is mapped
+       into memory and scanned in place if it can be, and any other stream,
+       such as a pipe, in a buffer that slides along it chunk_size bytes at
+       a time. Where a token or white space reaches the end of the buffer it
+       might go on, so it is scanned again once the next chunk has been
+       read. The lines before the buffer are only counted, for where.'''
+
+    # the patterns of Token for bytes
+    token_pattern = re.compile(Token.token_pattern.pattern.encode('ascii'))
+    white_space = utf8_white_space()
+
+    def __init__(self, source, chunk_size=2**20):
+        self.chunk_size = chunk_size
+        # the stream the rest of the input is read from, if it is not all
+        # in buffer, and whether it was opened here, to be closed at its end
+        self.stream = None
+        self.opened = isinstance(source, (str, os.PathLike))
+        if self.opened:
+            source = open(source, 'rb')
+        self.buffer = mapped(source)
+        if self.buffer is None:
+            self.buffer = b''
+            self.stream = source
+        elif self.opened:
+            source.close()
+        self.current_char_index = 0
+        # the newlines before buffer, and the characters of the line it
+        # starts in that are before it
+        self.lines = self.column = 0
+        self.current_token = self.get_token()
+
+    def refill(self):
+        '''Drops the part of buffer before current_char_index and reads
+           the next chunk of the stream after the rest.'''
+        index = self.current_char_index
+        self.lines, self.column = count_lines(self.buffer[:index], self.lines,
+                                              self.column)
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            if self.opened:
+                self.stream.close()
+            self.stream = None
+        self.buffer = self.buffer[index:] + chunk
+        self.current_char_index = 0
+
+    def skip_white_space(self):
+        while True:
+            self.current_char_index = self.white_space.match(
+                self.buffer, self.current_char_index).end()
+            if self.stream is None or \
+               self.current_char_index + MARGIN < len(self.buffer):
+                return
+            self.refill()
+
+    def get_token(self):
+        self.skip_white_space()
+        while True:
+            index = self.current_char_index
+            matches = self.token_pattern.match(self.buffer, index).groups(b'')
+            longest = max(matches, key=len)
+            if self.stream is None or index + len(longest) + MARGIN < len(self.buffer):
+                break
+            self.refill()
+        if index == len(self.buffer):
+            return (None, '')
+        if not longest:
+            self.no_token()
+        self.current_char_index += len(longest)
+        return (Token.tokens[matches.index(longest)], longest.decode('ascii'))
+
+    def excerpt(self):
+        # no character takes more than four bytes
+        while self.stream is not None and \
+              self.current_char_index + 4 * EXCERPT > len(self.buffer):
+            self.refill()
+        index = self.current_char_index
+        text = self.buffer[index:index + 4 * EXCERPT].decode('utf-8', 'replace')
+        return text[:EXCERPT].split('\n')[0]
+
+    def where(self, index=None):
+        if index is None:
+            index = self.current_char_index - len(self.current_token[1])
+        # counted a chunk at a time, as a mapped file may be large
+        lines, column = self.lines, self.column
+        for start in range(0, index, self.chunk_size):
+            lines, column = count_lines(
+                self.buffer[start:min(start + self.chunk_size, index)], lines, column)
+        return 'line %d, column %d' % (lines + 1, column + 1)
+
 class Symbol_Table:
     '''A symbol table maps identifiers to locations.'''
     def __init__(self):
@@ -179,438 +363,1717 @@ class Label:
         self.current_label += 1
         return 'l' + str(self.current_label)
 
+class Code_Writer:
+    '''An instruction sink that writes each instruction to output_file, as
+       a line of assembly for Jasmin, as soon as it is emitted. Nothing is
+       kept, so code can be streamed to a file of any size.'''
+    def __init__(self, output_file):
+        self.output_file = output_file
+    def emit(self, *instruction):
+        '''Writes an instruction or directive given as its opcode followed
+           by its operands, e.g. emit('istore', 1). The switches are given
+           as in classfile.py and written with one case per line.'''
+        if instruction[0] == 'tableswitch':
+            (op, low, labels, default) = instruction
+            cases = ['    ' + label for label in labels]
+            self.output_file.write('\n'.join(['tableswitch ' + str(low)] + cases +
+                                             ['    default : ' + default]) + '\n')
+        elif instruction[0] == 'lookupswitch':
+            (op, cases, default) = instruction
+            cases = ['    %d : %s' % case for case in cases]
+            self.output_file.write('\n'.join(['lookupswitch'] + cases +
+                                             ['    default : ' + default]) + '\n')
+        else:
+            self.output_file.write(' '.join(map(str, instruction)) + '\n')
+    def label(self, label):
+        '''Writes the definition of label.'''
+        self.output_file.write(label + ':\n')
+
+class Code_List:
+    '''An instruction sink that keeps the instructions in a list, for the
+       passes that need to see the whole program. Each instruction is the
+       tuple of its opcode and operands given to emit; a label definition
+       is the tuple (label + ':',).'''
+    def __init__(self):
+        self.instructions = []
+    def emit(self, *instruction):
+        self.instructions.append(instruction)
+    def label(self, label):
+        self.instructions.append((label + ':',))
+
 def indent(s, level):
     return '    '*level + s + '\n'
 
+def int32(value):
+    '''Returns value wrapped around to a 32 bit signed integer, as the JVM
+       does on overflow.'''
+    return (value + 2**31) % 2**32 - 2**31
+
+def evaluate(op, left, right):
+    '''Returns the result of the arithmetic operator op on two integers
+       with the semantics of the JVM, or None for a division by zero, which
+       must be left to raise its exception at run time.'''
+    if op == Token.ADD:
+        return int32(left + right)
+    if op == Token.SUB:
+        return int32(left - right)
+    if op == Token.MUL:
+        return int32(left * right)
+    if right == 0:
+        return None
+    # idiv rounds towards zero
+    quotient = abs(left) // abs(right)
+    return int32(quotient if (left < 0) == (right < 0) else -quotient)
+
 # Each of the following classes is a kind of node in the abstract syntax tree.
 # indented(level) returns a string that shows the tree levels by indentation.
-# code() returns a string with JVM bytecode implementing the tree fragment.
-# true_code/false_code(label) jumps to label if the condition is/is not true.
+# code(context) emits JVM bytecode implementing the tree fragment into
+# context.output, using the symbol table and label generator of context.
+# For a condition, code(context, E_true, E_false) jumps to E_true if the
+# condition is true and to E_false if it is not. One of the labels may be
+# None, which means execution falls through to the code that follows.
+# fold() returns the tree with constant expressions evaluated and the
+# operations that leave their operand unchanged (such as x*1) removed.
+# lower(graph) adds a statement to the ir.Flow_Graph graph; the other methods
+# used by the optimiser in ir.py are described there.
+# size() estimates the number of bytes of code for a node. For a statement,
+# uses() and assigned() return the variables it reads and writes and calls()
+# the Call_ASTs in it, and split(limit, methods) returns the statement with
+# the parts of it that are larger than limit bytes moved to new methods,
+# which are appended to methods.
 # Execution of the generated code leaves the value of expressions on the stack.
+#
+# Programs can be nested far deeper than the Python stack allows, so these
+# methods are defined once, in Node, and walk the tree with an explicit stack
+# instead of recursion. Each class gives the parts of it that differ:
+# children() and rebuild(children) list the nodes below it and make a copy
+# with other ones, show() and heading() give its text for repr() and
+# indented(), own_size is its own part of size(), and code_steps and
+# lower_steps do its part of code and lower, returning the steps for the
+# nodes below it (see run).
+# The nodes are not changed once they are made, apart from the slots that
+# remember size() and uses() and the variables a Call_AST passes, so one node
+# can be in several places of a tree: the parser makes one for all the
+# occurrences of a name or a number.
+
+def nodes(tree):
+    '''Returns the nodes of tree, each before the nodes below it.'''
+    result = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        result.append(node)
+        stack.extend(reversed(node.children()))
+    return result
+
+def transform(tree, leave, enter=None):
+    '''Returns leave(node, results) for the root of tree, where results are
+       the results for the children of node. If enter(node) is not None, it
+       is the result for node instead, and the nodes below it are skipped.'''
+    results = []
+    # the nodes still to visit, and (node, number of children) for the
+    # nodes whose children are being visited
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if type(node) is tuple:
+            (node, count) = node
+            start = len(results) - count
+            result = leave(node, results[start:])
+            del results[start:]
+            results.append(result)
+            continue
+        if enter is not None:
+            result = enter(node)
+            if result is not None:
+                results.append(result)
+                continue
+        children = node.children()
+        if children:
+            stack.append((node, len(children)))
+            stack.extend(reversed(children))
+        else:
+            results.append(leave(node, children))
+    return results[0]
+
+def run(step):
+    '''Calls step, a function that returns a list of further steps or None,
+       and then the steps it returns, each with the steps it returns in turn
+       before the next.'''
+    stack = [step]
+    while stack:
+        steps = stack.pop()()
+        if steps:
+            stack.extend(reversed(steps))
+
+def known(node, slot):
+    '''Returns what is in a slot of node, or None if it is empty.'''
+    return getattr(node, slot, None)
+
+class Node:
+    '''The methods common to all nodes, which walk the tree below a node.'''
+    # size() and the variables in uses(), once they are known; the slots
+    # are left empty until then
+    __slots__ = ('known_size', 'known_uses')
+    own_size = 0
+    def children(self):
+        return ()
+    def rebuild(self, children):
+        return self
+    def with_children(self, children):
+        '''Returns the node with children below it, itself if they are its
+           own.'''
+        for (child, own) in zip(children, self.children()):
+            if child is not own:
+                return self.rebuild(children)
+        return self
+    def heading(self):
+        return repr(self)
+    def parts(self):
+        '''Returns the nodes below this one that indented() shows.'''
+        return self.children()
+    def __repr__(self):
+        text = []
+        stack = [self]
+        while stack:
+            part = stack.pop()
+            if isinstance(part, str):
+                text.append(part)
+            else:
+                stack.extend(reversed(part.show()))
+        return ''.join(text)
+    def indented(self, level):
+        result = []
+        stack = [(self, level)]
+        while stack:
+            (node, level) = stack.pop()
+            result.append(indent(node.heading(), level))
+            stack.extend((part, level+1) for part in reversed(node.parts()))
+        return ''.join(result)
+    def code(self, context, *labels):
+        run(partial(self.code_steps, context, *labels))
+    def lower(self, graph):
+        run(partial(self.lower_steps, graph))
+    def folded(self):
+        '''Returns the node folded, if the nodes below it are.'''
+        return self
+    def fold(self):
+        return transform(self, lambda node, children:
+                                   node.with_children(children).folded())
+    def substitute(self, values):
+        # the optimiser only substitutes into folded trees, which stay the
+        # same if none of their variables have values
+        if self.used().isdisjoint(values):
+            return self
+        def value(node):
+            if isinstance(node, Identifier_AST):
+                return values.get(node.identifier)
+        return transform(self, lambda node, children:
+                                   node.with_children(children).folded(), value)
+    def replace(self, function):
+        def replacement(node):
+            if isinstance(node, Arithmetic):
+                return function(node)
+        return transform(self, Node.with_children, replacement)
+    def size(self):
+        if known(self, 'known_size') is None:
+            def add(node, sizes):
+                node.known_size = node.own_size + sum(sizes)
+                return node.known_size
+            transform(self, add, lambda node: known(node, 'known_size'))
+        return self.known_size
+    def used(self):
+        '''Returns the variables of uses(), as a frozenset that is worked
+           out once per node.'''
+        if known(self, 'known_uses') is None:
+            def add(node, uses):
+                if isinstance(node, Identifier_AST):
+                    node.known_uses = frozenset([node.identifier])
+                else:
+                    node.known_uses = frozenset().union(*uses)
+                return node.known_uses
+            transform(self, add, lambda node: known(node, 'known_uses'))
+        return self.known_uses
+    def uses(self):
+        return set(self.used())
+    def defines(self):
+        return None
+    def has_effect(self):
+        return False
+    def increment(self):
+        return None
+    def assigned(self):
+        return set(node.defines() for node in nodes(self)) - set([None])
+    def mentions(self):
+        '''Returns the variables the statement reads or writes.'''
+        return self.uses() | self.assigned()
+    def calls(self):
+        return [node for node in nodes(self) if isinstance(node, Call_AST)]
+    def split(self, limit, methods):
+        def small(node):
+            if node.size() <= limit:
+                return node
+        return transform(self, lambda node, children:
+                                   node.split_node(children, limit, methods),
+                         small)
+    def split_node(self, children, limit, methods):
+        '''Returns the node split, if the nodes below it, children, are.'''
+        return self.with_children(children)
+    def evaluate(self, values):
+        '''Returns the value() of a condition, given the values of the nodes
+           below it.'''
+        return None
+    def value(self):
+        return transform(self, lambda node, values: node.evaluate(values))
+    def equality(self):
+        return None
 
 class Program_AST:
-    def __init__(self, program):
+    def __init__(self, program, methods=None, fields=None):
         self.program = program
+        # the Method_ASTs split from the program, and the variables they
+        # share through static fields
+        self.methods = [] if methods is None else methods
+        self.fields = [] if fields is None else fields
     def __repr__(self):
         return repr(self.program)
     def indented(self, level):
         return self.program.indented(level)
-    def code(self):
-        program = self.program.code()
-        local = symbol_table.size()
-        java_scanner = symbol_table.location('Java Scanner')
-        return '.class public Program\n' + \
-               '.super java/lang/Object\n' + \
-               '.method public <init>()V\n' + \
-               'aload_0\n' + \
-               'invokenonvirtual java/lang/Object/<init>()V\n' + \
-               'return\n' + \
-               '.end method\n' + \
-               '.method public static main([Ljava/lang/String;)V\n' + \
-               '.limit locals ' + str(local) + '\n' + \
-               '.limit stack 1024\n' + \
-               'new java/util/Scanner\n' + \
-               'dup\n' + \
-               'getstatic java/lang/System.in Ljava/io/InputStream;\n' + \
-               'invokespecial java/util/Scanner.<init>(Ljava/io/InputStream;)V\n' + \
-               'astore ' + str(java_scanner) + '\n' + \
-               program + \
-               'return\n' + \
-               '.end method\n'
-
-class Statements_AST:
-    def __init__(self, statements):
-        self.statements = statements
+    def code(self, context):
+        java_scanner = context.symbol_table.location('Java Scanner')
+        out = context.output
+        out.emit('.class', 'public', 'Program')
+        out.emit('.super', 'java/lang/Object')
+        for variable in self.fields:
+            out.emit('.field', 'private', 'static', 'var_' + variable, 'I')
+        if self.methods and not context.fast_io:
+            # the methods all read through one Scanner
+            context.scanner_field = True
+            out.emit('.field', 'private', 'static', 'scanner', 'Ljava/util/Scanner;')
+        if context.fast_io:
+            out.emit('.field', 'private', 'static', 'buffer', '[B')
+            out.emit('.field', 'private', 'static', 'length', 'I')
+            out.emit('.field', 'private', 'static', 'position', 'I')
+            out.emit('.field', 'private', 'static', 'out', 'Ljava/io/PrintWriter;')
+        out.emit('.method', 'public', '<init>()V')
+        out.emit('aload_0')
+        out.emit('invokenonvirtual', 'java/lang/Object/<init>()V')
+        out.emit('return')
+        out.emit('.end', 'method')
+        out.emit('.method', 'public', 'static', 'main([Ljava/lang/String;)V')
+        if context.fast_io:
+            # the output is flushed at the end, also if an exception ends
+            # the program, so it is the same as with println
+            S_start = context.label_generator.next()
+            S_end = context.label_generator.next()
+            S_failed = context.label_generator.next()
+            out.emit('.catch', 'all', 'from', S_start, 'to', S_end, 'using', S_failed)
+            out.emit('ldc', 65536)
+            out.emit('newarray', 'byte')
+            out.emit('putstatic', 'Program/buffer', '[B')
+            out.emit('new', 'java/io/PrintWriter')
+            out.emit('dup')
+            out.emit('getstatic', 'java/lang/System/out', 'Ljava/io/PrintStream;')
+            out.emit('invokespecial', 'java/io/PrintWriter/<init>(Ljava/io/OutputStream;)V')
+            out.emit('putstatic', 'Program/out', 'Ljava/io/PrintWriter;')
+            out.label(S_start)
+            self.program.code(context)
+            out.emit('getstatic', 'Program/out', 'Ljava/io/PrintWriter;')
+            out.emit('invokevirtual', 'java/io/PrintWriter/flush()V')
+            out.label(S_end)
+            out.emit('return')
+            out.label(S_failed)
+            out.emit('getstatic', 'Program/out', 'Ljava/io/PrintWriter;')
+            out.emit('invokevirtual', 'java/io/PrintWriter/flush()V')
+            out.emit('athrow')
+            out.emit('.end', 'method')
+            runtime_code(context)
+        else:
+            out.emit('new', 'java/util/Scanner')
+            out.emit('dup')
+            out.emit('getstatic', 'java/lang/System.in', 'Ljava/io/InputStream;')
+            out.emit('invokespecial', 'java/util/Scanner.<init>(Ljava/io/InputStream;)V')
+            if context.scanner_field:
+                out.emit('putstatic', 'Program/scanner', 'Ljava/util/Scanner;')
+            else:
+                out.emit('astore', java_scanner)
+            self.program.code(context)
+            out.emit('return')
+            out.emit('.end', 'method')
+        for method in self.methods:
+            method.code(context)
+    def fold(self):
+        return Program_AST(self.program.fold())
+    def split(self, limit):
+        '''Returns the program with its code split into methods of about
+           limit bytes at most, if it is larger.'''
+        if self.program.size() <= limit:
+            return self
+        methods = []
+        program = self.program.split(limit, methods)
+        shared = shared_variables(program, methods)
+        # the variables used in more than one method are kept in static
+        # fields, and copied to and from locals where a method starts and
+        # ends and around each call
+        for body in [program] + [method.body for method in methods]:
+            passed = body.mentions() & shared
+            for call in body.calls():
+                call.share(passed)
+        for method in methods:
+            method.body = Statements_AST(
+                [Field_Load_AST(v) for v in sorted(method.body.mentions() & shared)] +
+                method.body.statements +
+                [Field_Store_AST(v) for v in sorted(method.body.assigned() & shared)])
+        return Program_AST(program, methods, sorted(shared))
+
+class Method_AST:
+    '''A static method split from the program, without arguments or result.
+       symbol_table gives the locals of body, if it is not the table of the
+       main method.'''
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body
+        self.symbol_table = None
+        self.known_variables = self.known_changes = None
     def __repr__(self):
-        result = repr(self.statements[0])
-        for st in self.statements[1:]:
-            result += '; ' + repr(st)
-        return result
+        return self.name + ': ' + repr(self.body)
     def indented(self, level):
-        result = indent('Statements', level)
-        for st in self.statements:
-            result += st.indented(level+1)
-        return result
-    def code(self):
-        result = ''
+        return indent('Method ' + self.name, level) + self.body.indented(level+1)
+    def code(self, context):
+        if self.symbol_table:
+            context.symbol_table = self.symbol_table
+        else:
+            context.symbol_table = Symbol_Table()
+            context.symbol_table.location('Java Scanner')
+        out = context.output
+        out.emit('.method', 'private', 'static', self.name + '()V')
+        self.body.code(context)
+        out.emit('return')
+        out.emit('.end', 'method')
+    def variables(self):
+        '''Returns the variables the method and the methods it calls use.
+           The methods are made before the methods that call them, so this
+           is worked out once per method, from the ones it calls.'''
+        if self.known_variables is None:
+            self.known_variables = self.body.mentions()
+            for call in self.body.calls():
+                self.known_variables |= call.method.variables()
+        return self.known_variables
+    def changes(self):
+        '''Returns the variables the method and the methods it calls
+           assign, like variables.'''
+        if self.known_changes is None:
+            self.known_changes = self.body.assigned()
+            for call in self.body.calls():
+                self.known_changes |= call.method.changes()
+        return self.known_changes
+
+def shared_variables(program, methods):
+    '''Returns the variables that are used in more than one of the
+       statements program of the main method and the methods.'''
+    seen = set()
+    result = set()
+    for body in [program] + [method.body for method in methods]:
+        mentions = body.mentions()
+        result |= seen & mentions
+        seen |= mentions
+    return result
+
+class Statements_AST(Node):
+    __slots__ = ('statements',)
+    def __init__(self, statements):
+        self.statements = statements
+    def children(self):
+        return self.statements
+    def rebuild(self, children):
+        return Statements_AST(children)
+    def show(self):
+        result = []
         for st in self.statements:
-            result += st.code()
-        return result
+            result += [st, '; ']
+        return result[:-1]
+    def heading(self):
+        return 'Statements'
+    def code_steps(self, context):
+        return [partial(st.code_steps, context) for st in self.statements]
+    def lower_steps(self, graph):
+        return [partial(st.lower_steps, graph) for st in self.statements]
+    def split_node(self, statements, limit, methods):
+        while sum(st.size() for st in statements) > limit:
+            # cut the statements into runs that fit, each run a method
+            runs = [[]]
+            size = 0
+            for st in statements:
+                if runs[-1] and size + st.size() > limit:
+                    runs.append([])
+                    size = 0
+                runs[-1].append(st)
+                size += st.size()
+            if len(runs) == len(statements) and \
+               all(isinstance(st, Call_AST) for st in statements):
+                break # the calls cannot be grouped
+            statements = [Call_AST(new_method(Statements_AST(run), methods))
+                          for run in runs]
+        return Statements_AST(statements)
+
+def new_method(body, methods):
+    '''Returns a new Method_AST with the statements body, appended to
+       methods.'''
+    method = Method_AST('part' + str(len(methods) + 1), body)
+    methods.append(method)
+    return method
 
-class If_AST:
+def outline(body, limit, methods):
+    '''Returns the statements body of an if or while statement, moved to a
+       method of their own if they are larger than half of limit, to keep
+       loops small.'''
+    if body.size() > limit // 2 and not \
+       (len(body.statements) == 1 and isinstance(body.statements[0], Call_AST)):
+        body = Statements_AST([Call_AST(new_method(body, methods))])
+    return body
+
+class If_AST(Node):
+    __slots__ = ('condition', 'then')
     def __init__(self, condition, then):
         self.condition = condition
         self.then = then
-    def __repr__(self):
-        return 'if ' + repr(self.condition) + ' then ' + \
-                       repr(self.then) + ' end'
-    def indented(self, level):
-        return indent('If', level) + \
-               self.condition.indented(level+1) + \
-               self.then.indented(level+1)
-    def code(self):
-        E_true = label_generator.next()
-        E_false = label_generator.next()        
-        return self.condition.code(E_true, E_false) + \
-               E_true + ':\n' + \
-               self.then.code() + \
-               E_false + ':\n' 
-
-class If_Else_AST:
+    def children(self):
+        return [self.condition, self.then]
+    def rebuild(self, children):
+        return If_AST(*children)
+    def show(self):
+        return ['if ', self.condition, ' then ', self.then, ' end']
+    def heading(self):
+        return 'If'
+    def code_steps(self, context):
+        E_false = context.label_generator.next()
+        return [partial(self.condition.code_steps, context, None, E_false),
+                partial(self.then.code_steps, context),
+                partial(context.output.label, E_false)]
+    def lower_steps(self, graph):
+        then = graph.new_block()
+        S_next = graph.new_block()
+        graph.branch(self.condition, then, S_next)
+        graph.start(then)
+        return [partial(self.then.lower_steps, graph),
+                partial(graph.jump, S_next),
+                partial(graph.start, S_next)]
+    def split_node(self, children, limit, methods):
+        condition, then = children
+        return If_AST(condition, outline(then, limit, methods))
+
+class If_Else_AST(Node):
+    own_size = 3
+    __slots__ = ('condition', 'then', 'else_part')
     def __init__(self, condition, then, else_part):
         self.condition = condition
         self.then = then
         self.else_part = else_part
-    def __repr__(self):
-        return 'if' + repr(self.condition) + ' then ' + \
-                      repr(self.then) + ' else ' + \
-                      repr(self.else_part) # + ' end' !!
-    def indented(self, level):
-        return indent('If-Else', level) + \
-               self.condition.indented(level+1) + \
-               self.then.indented(level+1) + \
-               self.else_part.indented(level+1)
-    def code(self):
-        E_true = label_generator.next()
-        E_false = label_generator.next()
-        S_next = label_generator.next()
-        return self.condition.code(E_true, E_false) + \
-               E_true + ':\n' + self.then.code() + \
-               'goto ' + S_next + '\n' + \
-               E_false + ':\n' + self.else_part.code() + \
-               S_next + ':\n'
-
-class While_AST:
+    def children(self):
+        return [self.condition, self.then, self.else_part]
+    def rebuild(self, children):
+        return If_Else_AST(*children)
+    def show(self):
+        return ['if', self.condition, ' then ', self.then, ' else ',
+                self.else_part] # + ' end' !!
+    def heading(self):
+        return 'If-Else'
+    def code_steps(self, context):
+        E_false = context.label_generator.next()
+        S_next = context.label_generator.next()
+        return [partial(self.condition.code_steps, context, None, E_false),
+                partial(self.then.code_steps, context),
+                partial(context.output.emit, 'goto', S_next),
+                partial(context.output.label, E_false),
+                partial(self.else_part.code_steps, context),
+                partial(context.output.label, S_next)]
+    def lower_steps(self, graph):
+        then = graph.new_block()
+        else_part = graph.new_block()
+        S_next = graph.new_block()
+        graph.branch(self.condition, then, else_part)
+        graph.start(then)
+        return [partial(self.then.lower_steps, graph),
+                partial(graph.jump, S_next),
+                partial(graph.start, else_part),
+                partial(self.else_part.lower_steps, graph),
+                partial(graph.jump, S_next),
+                partial(graph.start, S_next)]
+    def split_node(self, children, limit, methods):
+        condition, then, else_part = children
+        return If_Else_AST(condition, outline(then, limit, methods),
+                           outline(else_part, limit, methods))
+
+class While_AST(Node):
+    own_size = 3
+    __slots__ = ('condition', 'body')
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
-    def __repr__(self):
-        return 'while ' + repr(self.condition) + ' do ' + \
-                          repr(self.body) + ' end'
-    def indented(self, level):
-        return indent('While', level) + \
-               self.condition.indented(level+1) + \
-               self.body.indented(level+1)
-    def code(self):
-        S_begin = label_generator.next()
-        E_true = label_generator.next()
-        E_false = label_generator.next()
-        return S_begin + ':\n' + \
-               self.condition.code(E_true, E_false) + \
-               E_true + ':\n' + self.body.code() + \
-               'goto ' + S_begin + '\n' + \
-               E_false + ':\n'
-
-class Assign_AST:
+    def children(self):
+        return [self.condition, self.body]
+    def rebuild(self, children):
+        return While_AST(*children)
+    def show(self):
+        return ['while ', self.condition, ' do ', self.body, ' end']
+    def heading(self):
+        return 'While'
+    def code_steps(self, context):
+        # The condition is tested at the end of the loop, so each iteration
+        # takes a single conditional jump back to the body.
+        S_body = context.label_generator.next()
+        S_test = context.label_generator.next()
+        context.output.emit('goto', S_test)
+        context.output.label(S_body)
+        return [partial(self.body.code_steps, context),
+                partial(context.output.label, S_test),
+                partial(self.condition.code_steps, context, S_body, None)]
+    def lower_steps(self, graph):
+        # the test follows the body, as in code()
+        S_body = graph.new_block()
+        S_test = graph.new_block()
+        S_next = graph.new_block()
+        preheader = graph.current
+        graph.jump(S_test)
+        graph.start(S_body)
+        def test():
+            graph.jump(S_test)
+            graph.start(S_test)
+            graph.branch(self.condition, S_body, S_next)
+            graph.loop(preheader, S_body)
+            graph.start(S_next)
+        return [partial(self.body.lower_steps, graph), test]
+    def split_node(self, children, limit, methods):
+        condition, body = children
+        return While_AST(condition, outline(body, limit, methods))
+
+class Assign_AST(Node):
+    own_size = 2
+    __slots__ = ('identifier', 'expression')
     def __init__(self, identifier, expression):
         self.identifier = identifier
         self.expression = expression
-    def __repr__(self):
-        return repr(self.identifier) + ':=' + repr(self.expression)
-    def indented(self, level):
-        return indent('Assign', level) + \
-               self.identifier.indented(level+1) + \
-               self.expression.indented(level+1)
-    def code(self):
-        loc = symbol_table.location(self.identifier.identifier)
-        return self.expression.code() + \
-               'istore ' + str(loc) + '\n'
-
-class Write_AST:
+    def children(self):
+        return [self.expression]
+    def rebuild(self, children):
+        return Assign_AST(self.identifier, *children)
+    def show(self):
+        return [self.identifier.identifier, ':=', self.expression]
+    def heading(self):
+        return 'Assign'
+    def parts(self):
+        return [self.identifier, self.expression]
+    def code_steps(self, context):
+        loc = context.symbol_table.location(self.identifier.identifier)
+        return [partial(self.expression.code_steps, context),
+                partial(context.output.emit, 'istore', loc)]
+    def lower_steps(self, graph):
+        graph.add(self)
+    def defines(self):
+        return self.identifier.identifier
+    def has_effect(self):
+        return self.expression.may_fail()
+    def increment(self):
+        e = self.expression
+        if not isinstance(e, Expression_AST) or e.op not in (Token.ADD, Token.SUB):
+            return None
+        if isinstance(e.right, Number_AST) and \
+           isinstance(e.left, Identifier_AST) and e.left.identifier == self.identifier.identifier:
+            if e.op == Token.ADD:
+                return e.right
+            return Number_AST(int32(-e.right.number))
+        if e.op == Token.ADD and isinstance(e.left, Number_AST) and \
+           isinstance(e.right, Identifier_AST) and e.right.identifier == self.identifier.identifier:
+            return e.left
+        return None
+
+class Write_AST(Node):
+    own_size = 9
+    __slots__ = ('expression',)
     def __init__(self, expression):
         self.expression = expression
-    def __repr__(self):
-        return 'write ' + repr(self.expression)
-    def indented(self, level):
-        return indent('Write', level) + self.expression.indented(level+1)
-    def code(self):
-        return 'getstatic java/lang/System/out Ljava/io/PrintStream;\n' + \
-               self.expression.code() + \
-               'invokestatic java/lang/String/valueOf(I)Ljava/lang/String;\n' + \
-               'invokevirtual java/io/PrintStream/println(Ljava/lang/String;)V\n'
-
-class Read_AST:
+    def children(self):
+        return [self.expression]
+    def rebuild(self, children):
+        return Write_AST(*children)
+    def show(self):
+        return ['write ', self.expression]
+    def heading(self):
+        return 'Write'
+    def code_steps(self, context):
+        out = context.output
+        if context.fast_io:
+            out.emit('getstatic', 'Program/out', 'Ljava/io/PrintWriter;')
+            return [partial(self.expression.code_steps, context),
+                    partial(out.emit, 'invokevirtual', 'java/io/PrintWriter/println(I)V')]
+        out.emit('getstatic', 'java/lang/System/out', 'Ljava/io/PrintStream;')
+        return [partial(self.expression.code_steps, context),
+                partial(out.emit, 'invokestatic', 'java/lang/String/valueOf(I)Ljava/lang/String;'),
+                partial(out.emit, 'invokevirtual', 'java/io/PrintStream/println(Ljava/lang/String;)V')]
+    def lower_steps(self, graph):
+        graph.add(self)
+    def has_effect(self):
+        return True
+
+class Read_AST(Node):
+    own_size = 7
+    __slots__ = ('identifier',)
     def __init__(self, identifier):
         self.identifier = identifier
-    def __repr__(self):
-        return 'read ' + repr(self.identifier)
-    def indented(self, level):
-        return indent('Read', level) + self.identifier.indented(level+1)
-    def code(self):
-        java_scanner = symbol_table.location('Java Scanner')
-        loc = symbol_table.location(self.identifier.identifier)
-        return 'aload ' + str(java_scanner) + '\n' + \
-               'invokevirtual java/util/Scanner.nextInt()I\n' + \
-               'istore ' + str(loc) + '\n'
-    
-class Bool_Expression_AST:
+    def show(self):
+        return ['read ', self.identifier.identifier]
+    def heading(self):
+        return 'Read'
+    def parts(self):
+        return [self.identifier]
+    def code_steps(self, context):
+        java_scanner = context.symbol_table.location('Java Scanner')
+        loc = context.symbol_table.location(self.identifier.identifier)
+        if context.fast_io:
+            context.output.emit('invokestatic', 'Program/readInt()I')
+        elif context.scanner_field:
+            context.output.emit('getstatic', 'Program/scanner', 'Ljava/util/Scanner;')
+            context.output.emit('invokevirtual', 'java/util/Scanner.nextInt()I')
+        else:
+            context.output.emit('aload', java_scanner)
+            context.output.emit('invokevirtual', 'java/util/Scanner.nextInt()I')
+        context.output.emit('istore', loc)
+    def lower_steps(self, graph):
+        graph.add(self)
+    def defines(self):
+        return self.identifier.identifier
+    def has_effect(self):
+        return True
+
+class Call_AST(Node):
+    '''A call of a method split from the program. Before the call, the
+       variables in stores are copied to their fields, and after it the
+       variables in loads are copied back from theirs. The variables of the
+       method are not those of the caller, so they are not among the uses()
+       or assigned() of the call.'''
+    __slots__ = ('method', 'stores', 'loads', 'own_size')
+    def __init__(self, method):
+        self.method = method
+        self.stores = self.loads = set()
+        self.own_size = 3 + 4 * len(method.variables())
+    def show(self):
+        return ['call ' + self.method.name]
+    def heading(self):
+        return 'Call ' + self.method.name
+    def share(self, variables):
+        '''Passes the variables of the caller that are in fields.'''
+        self.stores = variables & self.method.variables()
+        self.loads = variables & self.method.changes()
+    def statements(self):
+        return [Field_Store_AST(v) for v in sorted(self.stores)] + \
+               [Invoke_AST(self.method.name)] + \
+               [Field_Load_AST(v) for v in sorted(self.loads)]
+    def code_steps(self, context):
+        return [partial(st.code_steps, context) for st in self.statements()]
+    def lower_steps(self, graph):
+        for st in self.statements():
+            graph.add(st)
+
+class Invoke_AST(Node):
+    '''The invocation of a method, inside a Call_AST.'''
+    __slots__ = ('name',)
+    def __init__(self, name):
+        self.name = name
+    def show(self):
+        return ['invoke ' + self.name]
+    def code_steps(self, context):
+        context.output.emit('invokestatic', 'Program/' + self.name + '()V')
+    def lower_steps(self, graph):
+        graph.add(self)
+    def has_effect(self):
+        return True
+
+class Field_Load_AST(Node):
+    '''Copies the field of a variable to its local.'''
+    __slots__ = ('variable',)
+    def __init__(self, variable):
+        self.variable = variable
+    def show(self):
+        return [self.variable + ' := var_' + self.variable]
+    def code_steps(self, context):
+        context.output.emit('getstatic', 'Program/var_' + self.variable, 'I')
+        context.output.emit('istore', context.symbol_table.location(self.variable))
+    def lower_steps(self, graph):
+        graph.add(self)
+    def defines(self):
+        return self.variable
+
+class Field_Store_AST(Node):
+    '''Copies the value of expression, at first the local of a variable,
+       to the field of the variable.'''
+    __slots__ = ('variable', 'expression')
+    def __init__(self, variable, expression=None):
+        self.variable = variable
+        self.expression = expression or Identifier_AST(variable)
+    def children(self):
+        return [self.expression]
+    def rebuild(self, children):
+        return Field_Store_AST(self.variable, *children)
+    def show(self):
+        return ['var_' + self.variable + ' := ', self.expression]
+    def code_steps(self, context):
+        return [partial(self.expression.code_steps, context),
+                partial(context.output.emit, 'putstatic',
+                        'Program/var_' + self.variable, 'I')]
+    def lower_steps(self, graph):
+        graph.add(self)
+    def has_effect(self):
+        return True
+
+class Bool_Expression_AST(Node):
+    __slots__ = ('left', 'right')
     def __init__(self, left, right):
         self.left = left
         self.right = right
-    def __repr__(self):
-        return repr(self.left) + 'or' + repr(self.right) # parentheses??
-    def indented(self, level):
-        return indent(Token.OR, level) + \
-               self.left.indented(level+1) + \
-               self.right.indented(level+1)
-    def code(self, E_true, E_false):
-        left_true = E_true
-        left_false = label_generator.next()
-        right_true = E_true
-        right_false = E_false
-        return self.left.code(left_true, left_false) + \
-               left_false + ':\n'+ \
-               self.right.code(right_true, right_false)
-    
-class Bool_Term_AST:
+    def children(self):
+        return [self.left, self.right]
+    def rebuild(self, children):
+        return Bool_Expression_AST(*children)
+    def show(self):
+        return [self.left, 'or', self.right] # parentheses??
+    def heading(self):
+        return Token.OR
+    def code_steps(self, context, E_true, E_false):
+        # if left is false, fall through to right
+        left_true = E_true or context.label_generator.next()
+        steps = [partial(self.left.code_steps, context, left_true, None),
+                 partial(self.right.code_steps, context, E_true, E_false)]
+        if not E_true:
+            steps.append(partial(context.output.label, left_true))
+        return steps
+    def evaluate(self, values):
+        # right is only evaluated if left is false
+        left, right = values
+        return True if left else (None if left is None else right)
+
+class Bool_Term_AST(Node):
+    __slots__ = ('left', 'right')
     def __init__(self, left, right):
         self.left = left
         self.right = right
-    def __repr__(self):
-        return repr(self.left) + 'and' + repr(self.right)
-    def indented(self, level):
-        return indent(Token.AND, level) + \
-               self.left.indented(level+1) + \
-               self.right.indented(level+1)
-    def code(self, E_true, E_false):
-        left_true = label_generator.next()
-        left_false = E_false
-        right_true = E_true
-        right_false = E_false
-        return self.left.code(left_true, left_false) + \
-               left_true + ':\n' + \
-               self.right.code(right_true, right_false)
-
-class Bool_Factor_AST:
+    def children(self):
+        return [self.left, self.right]
+    def rebuild(self, children):
+        return Bool_Term_AST(*children)
+    def show(self):
+        return [self.left, 'and', self.right]
+    def heading(self):
+        return Token.AND
+    def code_steps(self, context, E_true, E_false):
+        # if left is true, fall through to right
+        left_false = E_false or context.label_generator.next()
+        steps = [partial(self.left.code_steps, context, None, left_false),
+                 partial(self.right.code_steps, context, E_true, E_false)]
+        if not E_false:
+            steps.append(partial(context.output.label, left_false))
+        return steps
+    def evaluate(self, values):
+        # right is only evaluated if left is true
+        left, right = values
+        return False if left is False else (None if left is None else right)
+
+class Bool_Factor_AST(Node):
+    __slots__ = ('factor',)
     def __init__(self, factor):
         self.factor = factor
-    def __repr__(self):
-        return 'not' + repr(self.factor)
-    def indented(self, level):
-        return indent(Token.NOT, level) + \
-               self.factor.indented(level+1)
-    def code(self, E_true, E_false):
+    def children(self):
+        return [self.factor]
+    def rebuild(self, children):
+        return Bool_Factor_AST(*children)
+    def show(self):
+        return ['not', self.factor]
+    def heading(self):
+        return Token.NOT
+    def code_steps(self, context, E_true, E_false):
         factor_true = E_false
         factor_false = E_true
-        return self.factor.code(factor_true, factor_false)
+        return [partial(self.factor.code_steps, context, factor_true, factor_false)]
+    def evaluate(self, values):
+        return None if values[0] is None else not values[0]
 
-class Comparison_AST:
+class Comparison_AST(Node):
+    # a conditional jump and a goto
+    own_size = 6
+    __slots__ = ('left', 'op', 'right')
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
-    def __repr__(self):
+    def children(self):
+        return [self.left, self.right]
+    def rebuild(self, children):
+        return Comparison_AST(children[0], self.op, children[1])
+    def show(self):
         op = { Token.LESS:'<', Token.EQ:'=', Token.GRTR:'>',
                Token.LEQ:'<=', Token.NEQ:'!=', Token.GEQ:'>=' }
-        return repr(self.left) + op[self.op] + repr(self.right)
-    def indented(self, level):
-        return indent(self.op, level) + \
-               self.left.indented(level+1) + \
-               self.right.indented(level+1)
-    def code(self, E_true, E_false):
-        return self.true_code(E_true) + self.false_code(E_false)
-    def true_code(self, label):
-        op = { Token.LESS:'if_icmplt', Token.EQ:'if_icmpeq',
-               Token.GRTR:'if_icmpgt', Token.LEQ:'if_icmple',
-               Token.NEQ:'if_icmpne', Token.GEQ:'if_icmpge' }
-        return self.left.code() + \
-               self.right.code() + \
-               op[self.op] + ' ' + label + '\n'
-    def false_code(self, label):
-        # Negate each comparison because of jump to "false" label.
-        op = { Token.LESS:'if_icmpge', Token.EQ:'if_icmpne',
-               Token.GRTR:'if_icmple', Token.LEQ:'if_icmpgt',
-               Token.NEQ:'if_icmpeq', Token.GEQ:'if_icmplt' }
-        return self.left.code() + \
-               self.right.code() + \
-               op[self.op] + ' ' + label + '\n'
-
-class Expression_AST:
+        return [self.left, op[self.op], self.right]
+    def heading(self):
+        return self.op
+    # the jump taken if the comparison is true
+    true_op = { Token.LESS:'if_icmplt', Token.EQ:'if_icmpeq',
+                Token.GRTR:'if_icmpgt', Token.LEQ:'if_icmple',
+                Token.NEQ:'if_icmpne', Token.GEQ:'if_icmpge' }
+    # Negate each comparison because of jump to "false" label.
+    false_op = { Token.LESS:'if_icmpge', Token.EQ:'if_icmpne',
+                 Token.GRTR:'if_icmple', Token.LEQ:'if_icmpgt',
+                 Token.NEQ:'if_icmpeq', Token.GEQ:'if_icmplt' }
+    def code_steps(self, context, E_true, E_false):
+        # the operands are evaluated once, for a single conditional jump
+        return [partial(self.left.code_steps, context),
+                partial(self.right.code_steps, context),
+                partial(self.jump, context, E_true, E_false)]
+    def jump(self, context, E_true, E_false):
+        if E_true and E_false:
+            context.output.emit(self.true_op[self.op], E_true)
+            context.output.emit('goto', E_false)
+        elif E_true:
+            context.output.emit(self.true_op[self.op], E_true)
+        elif E_false:
+            context.output.emit(self.false_op[self.op], E_false)
+        else:
+            # both ways lead to the next instruction
+            context.output.emit('pop')
+            context.output.emit('pop')
+    def equality(self):
+        if self.op == Token.EQ:
+            for (variable, key) in ((self.left, self.right), (self.right, self.left)):
+                if isinstance(variable, Identifier_AST) and isinstance(key, Number_AST):
+                    return variable, key.number
+        return None
+    def evaluate(self, values):
+        if not (isinstance(self.left, Number_AST) and
+                isinstance(self.right, Number_AST)):
+            return None
+        left, right = self.left.number, self.right.number
+        return { Token.LESS: left < right, Token.EQ: left == right,
+                 Token.GRTR: left > right, Token.LEQ: left <= right,
+                 Token.NEQ: left != right, Token.GEQ: left >= right }[self.op]
+
+class Arithmetic(Node):
+    '''The methods that the loop optimisations of ir.py use to build new
+       code from the nodes of arithmetic expressions.'''
+    __slots__ = ()
+    def assign(self, variable):
+        return Assign_AST(Identifier_AST(variable), self)
+    def plus(self, other):
+        return Expression_AST(self, Token.ADD, other).fold()
+    def times(self, other):
+        return Expression_AST(self, Token.MUL, other).fold()
+    def may_fail(self):
+        # only a division by zero raises an exception
+        return any(isinstance(node, Expression_AST) and node.op == Token.DIV and
+                   not (isinstance(node.right, Number_AST) and node.right.number != 0)
+                   for node in nodes(self))
+    def product(self):
+        return None
+
+class Expression_AST(Arithmetic):
+    own_size = 1
+    __slots__ = ('left', 'op', 'right')
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
-    def __repr__(self):
+    def children(self):
+        return [self.left, self.right]
+    def rebuild(self, children):
+        return Expression_AST(children[0], self.op, children[1])
+    def show(self):
         op = { Token.ADD:'+', Token.SUB:'-', Token.MUL:'*', Token.DIV:'/' }
-        return '(' + repr(self.left) + op[self.op] + repr(self.right) + ')'
-    def indented(self, level):
-        return indent(self.op, level) + \
-               self.left.indented(level+1) + \
-               self.right.indented(level+1)
-    def code(self):
+        return ['(', self.left, op[self.op], self.right, ')']
+    def heading(self):
+        return self.op
+    def code_steps(self, context):
         op = { Token.ADD:'iadd', Token.SUB:'isub',
                Token.MUL:'imul', Token.DIV:'idiv' }
-        return self.left.code() + \
-               self.right.code() + \
-               op[self.op] + '\n'
+        return [partial(self.left.code_steps, context),
+                partial(self.right.code_steps, context),
+                partial(context.output.emit, op[self.op])]
+    def folded(self):
+        left, right = self.left, self.right
+        if isinstance(left, Number_AST) and isinstance(right, Number_AST):
+            value = evaluate(self.op, left.number, right.number)
+            if value != None:
+                return Number_AST(value)
+        # x+0, x-0, x*1 and x/1 are x; 0+x and 1*x are x
+        if isinstance(right, Number_AST) and \
+           (right.number == 0 and self.op in (Token.ADD, Token.SUB) or
+            right.number == 1 and self.op in (Token.MUL, Token.DIV)):
+            return left
+        if isinstance(left, Number_AST) and \
+           (left.number == 0 and self.op == Token.ADD or
+            left.number == 1 and self.op == Token.MUL):
+            return right
+        return self
+    simple = False
+    def product(self):
+        return (self.left, self.right) if self.op == Token.MUL else None
 
-class Number_AST:
+class Number_AST(Arithmetic):
+    own_size = 3
+    __slots__ = ('number',)
     def __init__(self, number):
         self.number = number
-    def __repr__(self):
-        return self.number
-    def indented(self, level):
-        return indent(self.number, level)
-    def code(self): # works only for short numbers
-        return 'sipush ' + self.number + '\n'
+    def show(self):
+        return [str(self.number)]
+    def heading(self):
+        return str(self.number)
+    def code_steps(self, context):
+        # use the shortest instruction that can load the value
+        value = self.number
+        if -1 <= value <= 5:
+            context.output.emit('iconst_' + ('m1' if value == -1 else str(value)))
+        elif -128 <= value <= 127:
+            context.output.emit('bipush', value)
+        elif -32768 <= value <= 32767:
+            context.output.emit('sipush', value)
+        else:
+            context.output.emit('ldc', value)
+    simple = True
+    def uses(self):
+        return set()
+    def may_fail(self):
+        return False
 
-class Identifier_AST:
+class Identifier_AST(Arithmetic):
+    own_size = 2
+    __slots__ = ('identifier',)
     def __init__(self, identifier):
         self.identifier = identifier
-    def __repr__(self):
+    def show(self):
+        return [self.identifier]
+    def heading(self):
         return self.identifier
-    def indented(self, level):
-        return indent(self.identifier, level)
-    def code(self):
-        loc = symbol_table.location(self.identifier)
-        return 'iload ' + str(loc) + '\n'
+    def code_steps(self, context):
+        loc = context.symbol_table.location(self.identifier)
+        context.output.emit('iload', loc)
+    simple = True
+    def uses(self):
+        return set([self.identifier])
+    def may_fail(self):
+        return False
 
-# The following methods comprise the recursive-descent parser.
+def runtime_code(context):
+    '''Emits the methods that the code for fast input and output calls.
+       readInt() reads the next integer from System.in, through buffer. It
+       throws NoSuchElementException at the end of the input, as
+       Scanner.nextInt does, but unlike it stops at the first character that
+       is not a digit and lets a number that is too large wrap around.'''
+    out = context.output
+    R_filled = context.label_generator.next()
+    R_next = context.label_generator.next()
+    out.emit('.method', 'private', 'static', 'readByte()I')
+    # returns the next byte of the input, or -1 at its end
+    out.emit('getstatic', 'Program/position', 'I')
+    out.emit('getstatic', 'Program/length', 'I')
+    out.emit('if_icmplt', R_next)
+    out.emit('getstatic', 'java/lang/System/in', 'Ljava/io/InputStream;')
+    out.emit('getstatic', 'Program/buffer', '[B')
+    out.emit('invokevirtual', 'java/io/InputStream/read([B)I')
+    out.emit('dup')
+    out.emit('putstatic', 'Program/length', 'I')
+    out.emit('ifgt', R_filled)
+    out.emit('iconst_m1')
+    out.emit('ireturn')
+    out.label(R_filled)
+    out.emit('iconst_0')
+    out.emit('putstatic', 'Program/position', 'I')
+    out.label(R_next)
+    out.emit('getstatic', 'Program/buffer', '[B')
+    out.emit('getstatic', 'Program/position', 'I')
+    out.emit('dup')
+    out.emit('iconst_1')
+    out.emit('iadd')
+    out.emit('putstatic', 'Program/position', 'I')
+    out.emit('baload')
+    out.emit('ireturn')
+    out.emit('.end', 'method')
+    R_skip = context.label_generator.next()
+    R_found = context.label_generator.next()
+    R_sign = context.label_generator.next()
+    R_digits = context.label_generator.next()
+    R_loop = context.label_generator.next()
+    R_done = context.label_generator.next()
+    R_negative = context.label_generator.next()
+    # local 0 is the character, 1 is 1 if there is a minus sign and 2 is
+    # the value, kept negative so that -2147483648 can be read
+    out.emit('.method', 'private', 'static', 'readInt()I')
+    out.label(R_skip)
+    out.emit('invokestatic', 'Program/readByte()I')
+    out.emit('dup')
+    out.emit('istore', 0)
+    out.emit('bipush', ord(' '))
+    out.emit('if_icmpgt', R_found)
+    out.emit('iload', 0)
+    out.emit('ifge', R_skip)
+    out.emit('new', 'java/util/NoSuchElementException')
+    out.emit('dup')
+    out.emit('invokespecial', 'java/util/NoSuchElementException/<init>()V')
+    out.emit('athrow')
+    out.label(R_found)
+    out.emit('iconst_0')
+    out.emit('istore', 1)
+    out.emit('iload', 0)
+    out.emit('bipush', ord('-'))
+    out.emit('if_icmpne', R_sign)
+    out.emit('iconst_1')
+    out.emit('istore', 1)
+    out.emit('invokestatic', 'Program/readByte()I')
+    out.emit('istore', 0)
+    out.emit('goto', R_digits)
+    out.label(R_sign)
+    out.emit('iload', 0)
+    out.emit('bipush', ord('+'))
+    out.emit('if_icmpne', R_digits)
+    out.emit('invokestatic', 'Program/readByte()I')
+    out.emit('istore', 0)
+    out.label(R_digits)
+    out.emit('iconst_0')
+    out.emit('istore', 2)
+    out.label(R_loop)
+    out.emit('iload', 0)
+    out.emit('bipush', ord('0'))
+    out.emit('if_icmplt', R_done)
+    out.emit('iload', 0)
+    out.emit('bipush', ord('9'))
+    out.emit('if_icmpgt', R_done)
+    out.emit('iload', 2)
+    out.emit('bipush', 10)
+    out.emit('imul')
+    out.emit('iload', 0)
+    out.emit('isub')
+    out.emit('bipush', ord('0'))
+    out.emit('iadd')
+    out.emit('istore', 2)
+    out.emit('invokestatic', 'Program/readByte()I')
+    out.emit('istore', 0)
+    out.emit('goto', R_loop)
+    out.label(R_done)
+    out.emit('iload', 1)
+    out.emit('ifne', R_negative)
+    out.emit('iload', 2)
+    out.emit('ineg')
+    out.emit('ireturn')
+    out.label(R_negative)
+    out.emit('iload', 2)
+    out.emit('ireturn')
+    out.emit('.end', 'method')
 
-def program():
-    sts = statements()
+# The following methods comprise the parser. The nesting of statements and
+# of parentheses is kept on explicit stacks rather than by recursion, so
+# programs nested to any depth are parsed in time linear in their length.
+
+def program(context):
+    sts = statements(context)
     return Program_AST(sts)
 
-def statements():
-    result = []
-    if scanner.lookahead() != None:
-        result = [statement()]
-        while scanner.lookahead() == Token.SEM:
+def statements(context, builder=None):
+    '''Parses the statements of the whole program, with the statements
+       nested in them, and returns builder.result(). The builder is given
+       the statements as they are parsed; a Tree_Builder, the default,
+       makes their Statements_AST.'''
+    builder = builder or Tree_Builder()
+    scanner = context.scanner
+    if scanner.lookahead() == None:
+        return builder.result()
+    while True:
+        statement(context, builder)
+        if scanner.lookahead() != Token.SEM:
+            return builder.result()
+        scanner.consume(Token.SEM)
+
+def statement(context, builder):
+    '''Parses one statement, with the statements nested in it, and gives
+       them to builder. The semicolon after it is left to the caller.'''
+    scanner = context.scanner
+    # the statements opened before this one
+    depth = len(builder.open_statements)
+    while True:
+        token = scanner.lookahead()
+        if token == Token.IF:
+            scanner.consume(Token.IF)
+            condition = bool_expr(context)
+            scanner.consume(Token.THEN)
+            builder.open(Token.IF, condition)
+            continue
+        elif token == Token.WHILE:
+            scanner.consume(Token.WHILE)
+            condition = bool_expr(context)
+            scanner.consume(Token.DO)
+            builder.open(Token.WHILE, condition)
+            continue
+        elif token == Token.ID:
+            builder.add(assignment(context))
+        elif token == Token.WRITE:
+            builder.add(write(context))
+        elif token == Token.READ:
+            builder.add(read(context))
+        elif token == None and len(builder.open_statements) > depth and \
+             builder.empty():
+            pass # the input ends in an if or while statement
+        else: # error
+            scanner.consume(Token.IF, Token.WHILE, Token.ID, Token.WRITE, Token.READ)
+        # close the statements that end after this one
+        while scanner.lookahead() != Token.SEM:
+            if len(builder.open_statements) == depth:
+                return
+            if builder.open_statements[-1][0] == Token.IF and \
+               scanner.lookahead() == Token.ELSE:
+                scanner.consume(Token.ELSE)
+                builder.begin_else()
+                break
+            scanner.consume(Token.END)
+            builder.close()
+        else:
+            if len(builder.open_statements) == depth:
+                return
             scanner.consume(Token.SEM)
-            st = statement()
-            result.append(st)
-    return Statements_AST(result)
-
-def statement():
-    if scanner.lookahead() == Token.IF:
-        return if_statement()
-    elif scanner.lookahead() == Token.WHILE:
-        return while_statement()
-    elif scanner.lookahead() == Token.ID:
-        return assignment()
-    elif scanner.lookahead() == Token.WRITE:
-        return write()
-    elif scanner.lookahead() == Token.READ:
-        return read()
-    else: # error
-        return scanner.consume(Token.IF, Token.WHILE, Token.ID, Token.WRITE, Token.READ)
-
-def if_statement():
-    scanner.consume(Token.IF)
-    condition = bool_expr()
-    scanner.consume(Token.THEN)
-    then = statements()
-    else_part = None
-    if scanner.lookahead() == Token.ELSE:
-        scanner.consume(Token.ELSE)
-        else_part = statements()
-    scanner.consume(Token.END)
-    if else_part:
-        return If_Else_AST(condition, then, else_part)
-    else:
-        return If_AST(condition, then)
-
-def while_statement():
-    scanner.consume(Token.WHILE)
-    condition = bool_expr()
-    scanner.consume(Token.DO)
-    body = statements()
-    scanner.consume(Token.END)
-    return While_AST(condition, body)
-
-def assignment():
-    ident = identifier()
-    scanner.consume(Token.BEC)
-    expr = expression()
+
+class Tree_Builder:
+    '''Builds the syntax tree of the statements found by statements().
+       open(token, condition) begins an if or while statement, begin_else()
+       the else part of the innermost one, and close() ends it; add(st)
+       adds a simple statement; empty() tells whether the part of the
+       innermost statement begun last has no statements yet.'''
+    def __init__(self):
+        # the if and while statements that are still open: the token that
+        # opened them (ELSE once the else part has begun), their condition,
+        # the statements of their then part if the else part has begun, and
+        # the statements around them
+        self.open_statements = []
+        self.current = []
+    def open(self, token, condition):
+        self.open_statements.append([token, condition, None, self.current])
+        self.current = []
+    def begin_else(self):
+        opened = self.open_statements[-1]
+        opened[0] = Token.ELSE
+        opened[2] = self.current
+        self.current = []
+    def close(self):
+        (token, condition, then, outer) = self.open_statements.pop()
+        if token == Token.WHILE:
+            st = While_AST(condition, Statements_AST(self.current))
+        elif token == Token.IF:
+            st = If_AST(condition, Statements_AST(self.current))
+        else:
+            st = If_Else_AST(condition, Statements_AST(then),
+                             Statements_AST(self.current))
+        self.current = outer
+        self.current.append(st)
+    def add(self, st):
+        self.current.append(st)
+    def empty(self):
+        return not self.current
+    def result(self):
+        return Statements_AST(self.current)
+
+class Code_Builder:
+    '''Emits the code of the statements found by statements() as soon as
+       it can, the same code that the code() of their syntax tree emits.
+       Only the labels of the if and while statements that are still open
+       and the conditions of the while loops, which are tested after their
+       body, are kept. The methods are those of Tree_Builder.'''
+    def __init__(self, context):
+        self.context = context
+        # the token that opened each open statement, as in Tree_Builder,
+        # the condition of a while loop, and the labels its code ends with
+        self.open_statements = []
+        self.begun = True
+    def open(self, token, condition):
+        context = self.context
+        if token == Token.IF:
+            E_false = context.label_generator.next()
+            condition.code(context, None, E_false)
+            self.open_statements.append([token, None, E_false, None])
+        else:
+            S_body = context.label_generator.next()
+            S_test = context.label_generator.next()
+            context.output.emit('goto', S_test)
+            context.output.label(S_body)
+            self.open_statements.append([token, condition, S_body, S_test])
+        self.begun = True
+    def begin_else(self):
+        opened = self.open_statements[-1]
+        S_next = self.context.label_generator.next()
+        self.context.output.emit('goto', S_next)
+        self.context.output.label(opened[2])
+        opened[0] = Token.ELSE
+        opened[3] = S_next
+        self.begun = True
+    def close(self):
+        (token, condition, S_first, S_last) = self.open_statements.pop()
+        output = self.context.output
+        if token == Token.WHILE:
+            output.label(S_last)
+            condition.code(self.context, S_first, None)
+        else:
+            output.label(S_last or S_first)
+        self.begun = False
+    def add(self, st):
+        st.code(self.context)
+        self.begun = False
+    def empty(self):
+        return self.begun
+    def result(self):
+        return None
+
+def assignment(context):
+    ident = identifier(context)
+    context.scanner.consume(Token.BEC)
+    expr = expression(context)
     return Assign_AST(ident, expr)
 
-def write():
-    scanner.consume(Token.WRITE)
-    expr = expression()
+def write(context):
+    context.scanner.consume(Token.WRITE)
+    expr = expression(context)
     return Write_AST(expr)
 
-def read():
-    scanner.consume(Token.READ)
-    ident = identifier()
+def read(context):
+    context.scanner.consume(Token.READ)
+    ident = identifier(context)
     return Read_AST(ident)
 
-def bool_expr():
-    result = bool_term()
-    while scanner.lookahead() == Token.OR:
-        op = scanner.consume(Token.OR)
-        tree = bool_term()
+def bool_expr(context):
+    result = bool_term(context)
+    while context.scanner.lookahead() == Token.OR:
+        op = context.scanner.consume(Token.OR)
+        tree = bool_term(context)
         result = Bool_Expression_AST(result, tree)
     return result
 
-def bool_term():
-    result = bool_factor()
-    while scanner.lookahead() == Token.AND:
-        op = scanner.consume(Token.AND)
-        tree = bool_factor()
+def bool_term(context):
+    result = bool_factor(context)
+    while context.scanner.lookahead() == Token.AND:
+        op = context.scanner.consume(Token.AND)
+        tree = bool_factor(context)
         result = Bool_Term_AST(result, tree)
     return result
 
-def bool_factor():
-    if scanner.lookahead() == Token.NOT:
-        op = scanner.consume(Token.NOT)
-        tree = bool_factor()
-        result = Bool_Factor_AST(tree)
-    else:
-        result = comparison()
-    return result   
-
-def comparison():
-    left = expression()
-    op = scanner.consume(Token.LESS, Token.EQ, Token.GRTR,
+def bool_factor(context):
+    nots = 0
+    while context.scanner.lookahead() == Token.NOT:
+        context.scanner.consume(Token.NOT)
+        nots += 1
+    result = comparison(context)
+    for i in range(nots):
+        result = Bool_Factor_AST(result)
+    return result
+
+def comparison(context):
+    left = expression(context)
+    op = context.scanner.consume(Token.LESS, Token.EQ, Token.GRTR,
                          Token.LEQ, Token.NEQ, Token.GEQ)
-    right = expression()
+    right = expression(context)
     return Comparison_AST(left, op, right)
 
-def expression():
-    result = term()
-    while scanner.lookahead() in [Token.ADD, Token.SUB]:
-        op = scanner.consume(Token.ADD, Token.SUB)
-        tree = term()
-        result = Expression_AST(result, op, tree)
-    return result
+# how tightly each arithmetic operator binds
+precedence = { Token.ADD: 1, Token.SUB: 1, Token.MUL: 2, Token.DIV: 2 }
 
-def term():
-    result = factor()
-    while scanner.lookahead() in [Token.MUL, Token.DIV]:
-        op = scanner.consume(Token.MUL, Token.DIV)
-        tree = factor()
-        result = Expression_AST(result, op, tree)
-    return result
+def expression(context):
+    '''Parses an expression by operator precedence: the operands and the
+       operators and open parentheses that are not yet applied are kept on
+       stacks.'''
+    scanner = context.scanner
+    operands = []
+    operators = []
+    def apply():
+        right = operands.pop()
+        left = operands.pop()
+        operands.append(Expression_AST(left, operators.pop(), right))
+    while True:
+        while scanner.lookahead() == Token.LPAR:
+            operators.append(scanner.consume(Token.LPAR))
+        operands.append(factor(context))
+        # apply the operators that bind more tightly than the next one,
+        # and close the parentheses that end here
+        while True:
+            token = scanner.lookahead()
+            while operators and operators[-1] != Token.LPAR and \
+                  (token not in precedence or
+                   precedence[operators[-1]] >= precedence[token]):
+                apply()
+            if token in precedence:
+                operators.append(scanner.consume(token))
+                break
+            if not operators:
+                return operands[0]
+            scanner.consume(Token.RPAR)
+            operators.pop()
 
-def factor():
-    if scanner.lookahead() == Token.LPAR:
-        scanner.consume(Token.LPAR)
-        result = expression()
-        scanner.consume(Token.RPAR)
-        return result
-    elif scanner.lookahead() == Token.NUM:
-        value = scanner.consume(Token.NUM)[1]
-        return Number_AST(value)
-    elif scanner.lookahead() == Token.ID:
-        return identifier()
+def factor(context):
+    '''Parses a number or an identifier; parentheses are left to
+       expression.'''
+    if context.scanner.lookahead() == Token.NUM:
+        value = context.scanner.current_token[1]
+        if value not in context.leaves:
+            if int(value) > 2**31 - 1:
+                raise Compile_Error('syntax error: integer constant ' + value +
+                                    ' is too large at ' + context.scanner.where())
+            context.leaves[value] = Number_AST(int(value))
+        context.scanner.consume(Token.NUM)
+        return context.leaves[value]
+    elif context.scanner.lookahead() == Token.ID:
+        return identifier(context)
     else: # error
-        return scanner.consume(Token.LPAR, Token.NUM, Token.ID)
+        return context.scanner.consume(Token.LPAR, Token.NUM, Token.ID)
+
+def identifier(context):
+    value = context.scanner.consume(Token.ID)[1]
+    if value not in context.leaves:
+        # enter the identifier now, so its location is known before any
+        # code is emitted
+        context.symbol_table.location(value)
+        context.leaves[value] = Identifier_AST(value)
+    return context.leaves[value]
+
+def parse(context):
+    '''Parses the whole program read by context.scanner and returns its
+       abstract syntax tree.'''
+    ast = program(context)
+    end_of_input(context)
+    return ast
+
+def end_of_input(context):
+    if context.scanner.lookahead() != None:
+        raise Compile_Error('syntax error: end of input expected but token ' +
+                            repr(context.scanner.lookahead()) + ' found at ' +
+                            context.scanner.where())
+
+class Streamed_Statements:
+    '''Stands for the statements of the program in a Program_AST that is
+       translated in one pass: code(context) parses the statements and emits
+       their code as it goes, through a Code_Builder, so their syntax tree
+       is never built.'''
+    def code(self, context):
+        statements(context, Code_Builder(context))
+        end_of_input(context)
+
+class Context:
+    '''The state of one compilation: the scanner reading the program, the
+       symbol table, the label generator and the output, which is the sink
+       for the generated instructions. The parser functions and the code()
+       methods get the context as an argument, so several programs can be
+       compiled at the same time without sharing any state. A binary
+       input_file is scanned by a Byte_Scanner, without reading it into a
+       string.'''
+    def __init__(self, input_file, output, fast_io=False):
+        if isinstance(input_file, (io.RawIOBase, io.BufferedIOBase)):
+            self.scanner = Byte_Scanner(input_file)
+        else:
+            self.scanner = Scanner(input_file)
+        self.output = output
+        # read and write through the buffers of runtime_code
+        self.fast_io = fast_io
+        # keep the Scanner in a static field, for the methods split from
+        # the program
+        self.scanner_field = False
+        # the Number_AST and Identifier_AST nodes by their text: the parser
+        # makes one node for all the occurrences of a number or a name
+        self.leaves = {}
+        self.symbol_table = Symbol_Table()
+        self.symbol_table.location('Java Scanner') # fix a location for the Java Scanner
+        self.label_generator = Label()
+
+class Compile_Stats:
+    '''What generate measures of a compilation when it is given one: phases
+       maps the name of each phase, in the order they ran, to its wall-clock
+       and CPU time in seconds, without the time of the phases that ran
+       inside it (scan, in parse); tokens counts the tokens of the program
+       and nodes the nodes of its syntax tree by class, before any
+       optimisation (none if it is streamed); labels, symbols and
+       instructions count the labels generated, the entries of the symbol
+       table made by the parser and the instructions emitted, without the
+       labels and directives; and peak_memory is the most memory the
+       compilation took at a time, in bytes, if memory is True. Tracing the
+       memory makes the compilation several times slower, so the times are
+       only comparable with the same setting. The scanner is timed token by
+       token, which adds a little to its time.'''
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.phases = {}
+        self.tokens = 0
+        self.nodes = {}
+        self.labels = self.symbols = self.instructions = 0
+        self.peak_memory = None
+        # the time spent in the phases inside each phase that is running
+        self.running = []
+
+    def add(self, name, wall, cpu):
+        '''Adds wall and cpu seconds to the phase name.'''
+        times = self.phases.setdefault(name, { 'wall': 0.0, 'cpu': 0.0 })
+        times['wall'] += wall
+        times['cpu'] += cpu
+        if self.running:
+            self.running[-1][0] += wall
+            self.running[-1][1] += cpu
 
-def identifier():
-    value = scanner.consume(Token.ID)[1]
-    return Identifier_AST(value)
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''Adds the time taken by the body of a with statement to the phase
+           name.'''
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.running.append([0.0, 0.0])
+        try:
+            yield
+        finally:
+            (inner_wall, inner_cpu) = self.running.pop()
+            self.add(name, time.perf_counter() - wall - inner_wall,
+                     time.process_time() - cpu - inner_cpu)
+            if self.running:
+                self.running[-1][0] += inner_wall
+                self.running[-1][1] += inner_cpu
 
-# Initialise scanner, symbol table and label generator.
+    @contextlib.contextmanager
+    def measure(self):
+        '''Traces the memory taken in the body of a with statement, if
+           memory is True.'''
+        if not self.memory:
+            yield
+            return
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            self.peak_memory = tracemalloc.get_traced_memory()[1] - before
+            if not tracing:
+                tracemalloc.stop()
 
-scanner = Scanner(sys.stdin)
-#scanner = Scanner(open('text20.txt'))
-symbol_table = Symbol_Table()
-symbol_table.location('Java Scanner') # fix a location for the Java Scanner
-label_generator = Label()
+    def watch(self, scanner):
+        '''Counts the tokens that scanner has found and times and counts
+           those it finds from now on, as the phase scan.'''
+        get_token = scanner.get_token
+        def timed_get_token():
+            wall, cpu = time.perf_counter(), time.process_time()
+            token = get_token()
+            self.add('scan', time.perf_counter() - wall, time.process_time() - cpu)
+            if token[0] != None:
+                self.tokens += 1
+            return token
+        scanner.get_token = timed_get_token
+        if scanner.current_token[0] != None:
+            self.tokens += 1
 
-# Uncomment the following to test the scanner without the parser.
-# Show all tokens in the input.
+    def as_dict(self):
+        '''Returns the measurements as a dict, which can be written as
+           JSON.'''
+        return { 'phases': self.phases, 'tokens': self.tokens,
+                 'nodes': self.nodes, 'labels': self.labels,
+                 'symbols': self.symbols, 'instructions': self.instructions,
+                 'peak_memory': self.peak_memory }
+
+class Instruction_Counter:
+    '''An instruction sink that counts the instructions, without the labels
+       and directives, and passes them on to output.'''
+    def __init__(self, output):
+        self.output = output
+        self.count = 0
+    def emit(self, *instruction):
+        if instruction[0][0] != '.':
+            self.count += 1
+        self.output.emit(*instruction)
+    def label(self, label):
+        self.output.label(label)
+
+def generate(source, output, optimise=True, optimise_loops=True, fast_io=False,
+             peephole=None, method_size=8000, stream=False, stats=None):
+    '''Compiles the program in source, a string or a binary file, emitting
+       the instructions into the sink output. The optimisations are skipped if optimise is
+       False, the loop optimisations if optimise_loops is False. If fast_io
+       is True, the program reads and writes through buffers instead of a
+       Scanner and println, which flush on every number. Programs of more
+       than about method_size bytes of code are split into several methods,
+       so that the JIT compiler does not skip them as huge methods. The
+       instructions then go through the peephole.Peephole_Optimiser
+       peephole, or a new one, and get .limit directives with the exact stack
+       height and number of locals before they reach output. Raises
+       Compile_Error if the program has a lexical or syntax error; nothing is
+       emitted then.
+       If stream is True, the program is translated in a single pass: the
+       code of each statement reaches output as soon as the statement is
+       parsed, and the .limit directives of a method come at its end. Only
+       the statements that are still open are kept, so the memory used
+       depends on how deeply they nest rather than on the size of the
+       program. The program is then neither optimised nor split, and
+       Compile_Error may be raised after some of the code is emitted.
+       If stats is a Compile_Stats, the measurements of the compilation are
+       recorded in it.'''
+    profiling = stats is not None
+    stats = stats or Compile_Stats(memory=False)
+    if profiling:
+        output = Instruction_Counter(output)
+    with stats.measure():
+        if stream:
+            with stats.phase('translate'):
+                context = Context(program_file(source),
+                                  classfile.Streamed_Limits(output), fast_io)
+                if profiling:
+                    stats.watch(context.scanner)
+                Program_AST(Streamed_Statements()).code(context)
+            stats.symbols = context.symbol_table.size()
+        else:
+            context = Context(program_file(source), Code_List(), fast_io)
+            if profiling:
+                stats.watch(context.scanner)
+            ast = prepare(context, optimise, optimise_loops, method_size, stats,
+                          profiling)
+            with stats.phase('code'):
+                ast.code(context)
+            instructions = context.output.instructions
+            if optimise:
+                with stats.phase('peephole'):
+                    peephole = peephole or Peephole_Optimiser()
+                    instructions = peephole.optimise(instructions)
+            with stats.phase('limits'):
+                for instruction in classfile.with_limits(instructions):
+                    output.emit(*instruction)
+    stats.labels = context.label_generator.current_label
+    if profiling:
+        stats.instructions = output.count
+
+def program_file(source):
+    '''Returns the file to read the program in source from: a string
+       holds the program itself, and a binary file is read as it is.'''
+    return io.StringIO(source) if isinstance(source, str) else source
+
+def prepare(context, optimise=True, optimise_loops=True, method_size=8000,
+            stats=None, count_nodes=False):
+    '''Parses the program read by context.scanner and returns its Program_AST
+       as generate emits its code: folded, split into methods and optimised,
+       with the options of generate. The phases are timed in stats, if it is
+       given, which also gets the size of the symbol table made by the parser
+       and, if count_nodes is True, the nodes of the syntax tree.'''
+    stats = stats or Compile_Stats()
+    with stats.phase('parse'):
+        ast = parse(context)
+    stats.symbols = context.symbol_table.size()
+    if count_nodes:
+        stats.nodes = dict(Counter(type(node).__name__ for node in nodes(ast.program)))
+    if optimise:
+        with stats.phase('fold'):
+            ast = ast.fold()
+    with stats.phase('split'):
+        ast = ast.split(method_size)
+    if optimise:
+        with stats.phase('optimise'):
+            ast = optimise_methods(ast, context, optimise_loops)
+    return ast
+
+def optimise_methods(ast, context, optimise_loops=True):
+    '''Returns the Program_AST ast with the statements of each method
+       replaced by their optimised flow graph, with the variables in as few
+       locals as possible.'''
+    tables = []
+    for method in [ast] + ast.methods:
+        graph = ir.lower(method.program if method is ast else method.body)
+        graph.optimise(optimise_loops)
+        symbol_table = Symbol_Table()
+        symbol_table.location('Java Scanner')
+        symbol_table.symbol_table.update(graph.allocate_locals(first=1))
+        tables.append((symbol_table, graph))
+    context.symbol_table = tables[0][0]
+    for (method, (symbol_table, graph)) in zip(ast.methods, tables[1:]):
+        method.symbol_table = symbol_table
+        method.body = graph
+    return Program_AST(tables[0][1], ast.methods, ast.fields)
+
+def compile_to(source, output_file, **options):
+    '''Compiles the program in source, a string or a binary file, and
+       writes JVM bytecode for it to output_file. The bytecode can be
+       assembled to a class file by Jasmin: http://jasmin.sourceforge.net/
+       Raises Compile_Error like generate.'''
+    generate(source, Code_Writer(output_file), **options)
+
+def compile(source, **options):
+    '''Compiles the program in the string source and returns JVM bytecode
+       for it as a string. The options are those of generate. Raises
+       Compile_Error like compile_to.'''
+    output_file = io.StringIO()
+    compile_to(source, output_file, **options)
+    return output_file.getvalue()
+
+def compile_class(source, **options):
+    '''Compiles the program in source, a string or a binary file, and
+       returns the contents of Program.class, without going through Jasmin.
+       The options are those of generate. Raises Compile_Error like generate
+       and classfile.Assembly_Error if the code cannot be assembled.'''
+    output = Code_List()
+    generate(source, output, **options)
+    return classfile.assemble(output.instructions)
+
+def main():
+    '''Compiles the program in the file given or on standard input and
+       prints the bytecode, or the error report if the program has an
+       error.'''
+    parser = argparse.ArgumentParser(
+        description='Compile the program on standard input to JVM bytecode '
+                    'on standard output.')
+    parser.add_argument('program', nargs='?',
+                        help='compile the program in this file instead, '
+                             'without reading it all into memory')
+    parser.add_argument('--format', choices=['jasmin', 'class'],
+                        default='jasmin',
+                        help='write Jasmin assembly (the default) or the '
+                             'binary Program.class')
+    parser.add_argument('--no-optimise', dest='optimise', action='store_false',
+                        help='translate the program as it is written')
+    parser.add_argument('--fast-io', action='store_true',
+                        help='read and write numbers through buffers in the '
+                             'generated program')
+    parser.add_argument('--method-size', type=int, default=8000,
+                        help='split programs into methods of about this '
+                             'many bytes of code at most (default 8000)')
+    parser.add_argument('--stream', action='store_true',
+                        help='translate each statement as soon as it is '
+                             'parsed, without building the syntax tree or '
+                             'optimising')
+    parser.add_argument('--profile', action='store_true',
+                        help='report the time of each phase and other '
+                             'measurements of the compilation as JSON on '
+                             'standard error')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='report the peak memory too, which makes the '
+                             'compilation slower')
+    parser.add_argument('--peephole-stats', action='store_true',
+                        help='report how often each peephole rule matched '
+                             'on standard error')
+    args = parser.parse_args()
+    options = { 'optimise': args.optimise, 'fast_io': args.fast_io,
+                'method_size': args.method_size, 'stream': args.stream,
+                'peephole': Peephole_Optimiser(),
+                'stats': Compile_Stats(args.profile_memory)
+                         if args.profile or args.profile_memory else None }
+    # read as bytes, so a large program is mapped into memory or read a
+    # chunk at a time
+    source = open(args.program, 'rb') if args.program else \
+             contextlib.nullcontext(sys.stdin.buffer)
+    try:
+        with source as input_file:
+            if args.format == 'class':
+                sys.stdout.buffer.write(compile_class(input_file, **options))
+            else:
+                compile_to(input_file, sys.stdout, **options)
+    except (Compile_Error, classfile.Assembly_Error) as error:
+        print(error)
+        sys.exit()
+    if args.peephole_stats:
+        for (rule, hits) in options['peephole'].hits.items():
+            print('%-20s %d' % (rule, hits), file=sys.stderr)
+    if options['stats']:
+        print(json.dumps(options['stats'].as_dict(), indent=1), file=sys.stderr)
+
+# To test the scanner without the parser, show all tokens in the input:
 #
+#scanner = Scanner(sys.stdin)
 #token = scanner.lookahead()
 #while token != None:
     #if token in [Token.NUM, Token.ID]:
@@ -619,25 +2082,11 @@ label_generator = Label()
     #else:
         #print(scanner.consume(token))
     #token = scanner.lookahead()
-#exit()
-
-# Call the parser.
-
-ast = program()
-if scanner.lookahead() != None:
-    print('syntax error: end of input expected but token ' +
-          repr(scanner.lookahead()) + ' found')
-    exit()
 
-# Uncomment the following to test the parser without the code generator.
-# Show the syntax tree with levels indicated by indentation.
-
-#print(ast.indented(0), end='')
-#exit()
-
-# Call the code generator.
-
-# Translate the abstract syntax tree to JVM bytecode.
-# It can be assembled to a class file by Jasmin: http://jasmin.sourceforge.net/
+# To test the parser without the code generator, show the syntax tree
+# with levels indicated by indentation:
+#
+#print(parse(Context(sys.stdin, None)).indented(0), end='')
 
-print(ast.code(), end='')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+'''Runs programs in the Python process, without a JVM.
+
+Usage: python executor.py [--no-optimise] PROGRAM < input
+
+An Executable is made from the Program_AST that compiler.prepare returns,
+optimised or not. The statements of each method are lowered to a flow graph
+(see ir.py), if they are not one already, and each basic block is compiled
+to Python closures: a function for each statement and expression, and one
+that runs the block and returns the next. Running a method calls the
+function of one block after another, so programs nested to any depth run
+without deep recursion, and expressions nested deeper than DEPTH are
+evaluated with an explicit stack.
+
+The arithmetic is that of the JVM: results wrap around to 32 bits, division
+rounds towards zero, and a division by zero raises Execution_Error where
+the JVM throws ArithmeticException. read takes the next number from an
+iterable, and reading past its end raises Execution_Error as
+Scanner.nextInt throws NoSuchElementException. Variables start at 0: a
+program that may read a variable before setting it is one the JVM refuses
+to load.
+
+    from executor import run
+    run('read n; write n * n', [7])     # [49]
+'''
+
+import argparse
+import io
+import operator
+import sys
+from collections import deque
+
+import ir
+from compiler import Assign_AST, Bool_Expression_AST, Bool_Factor_AST, \
+    Comparison_AST, Compile_Error, Context, Field_Load_AST, Field_Store_AST, \
+    Identifier_AST, Invoke_AST, Number_AST, Read_AST, Token, Write_AST, \
+    int32, prepare, transform
+
+class Execution_Error(Exception):
+    '''Raised when the program would end with an exception on the JVM. The
+       message names the exception, and output holds the numbers the
+       program wrote before it.'''
+    def __init__(self, message, output=None):
+        Exception.__init__(self, message)
+        self.output = output
+
+class Step_Limit_Error(Execution_Error):
+    '''Raised when a program runs more basic blocks than it is allowed, as a
+       program that does not end would.'''
+
+# Expressions nested deeper than this are evaluated with an explicit stack,
+# rather than by closures calling each other, to stay within the Python
+# stack.
+DEPTH = 100
+
+def add(a, b):
+    result = a + b
+    return result if -2**31 <= result < 2**31 else int32(result)
+
+def subtract(a, b):
+    result = a - b
+    return result if -2**31 <= result < 2**31 else int32(result)
+
+def multiply(a, b):
+    result = a * b
+    return result if -2**31 <= result < 2**31 else int32(result)
+
+def divide(a, b):
+    if b == 0:
+        raise Execution_Error('java.lang.ArithmeticException: / by zero')
+    # idiv rounds towards zero; only -2**31 / -1 overflows
+    quotient = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        return -quotient
+    return quotient if quotient < 2**31 else int32(quotient)
+
+operations = { Token.ADD: add, Token.SUB: subtract, Token.MUL: multiply,
+               Token.DIV: divide }
+
+comparisons = { Token.LESS: operator.lt, Token.EQ: operator.eq,
+                Token.GRTR: operator.gt, Token.LEQ: operator.le,
+                Token.NEQ: operator.ne, Token.GEQ: operator.ge }
+
+def evaluator(items):
+    '''Returns a function that evaluates the expression in postfix items:
+       (False, f) pushes f() and (True, operation) replaces the two values
+       on top of the stack by the result of operation.'''
+    def evaluate():
+        stack = []
+        for (operator, function) in items:
+            if operator:
+                right = stack.pop()
+                stack[-1] = function(stack[-1], right)
+            else:
+                stack.append(function())
+        return stack[0]
+    return evaluate
+
+def test(part):
+    '''Returns a function that evaluates a part of a condition made by
+       Compiled_Method.condition.'''
+    (kind, payload) = part
+    if kind == 'test':
+        return payload
+    if kind == 'not':
+        return lambda: not payload()
+    if kind == 'or':
+        def any_true():
+            for term in payload:
+                if term():
+                    return True
+            return False
+        return any_true
+    def all_true():
+        for term in payload:
+            if not term():
+                return False
+        return True
+    return all_true
+
+class Compiled_Method:
+    '''The closures of the blocks of one method of executable, whose
+       statements are body, a Statements_AST or a Flow_Graph. locals holds
+       the values of its variables, at the indices in names.'''
+    def __init__(self, body, executable):
+        self.executable = executable
+        self.locals = []
+        self.names = {}
+        graph = body if isinstance(body, ir.Flow_Graph) else ir.lower(body)
+        index = dict((block, i) for (i, block) in enumerate(graph.blocks))
+        self.blocks = []
+        for (i, block) in enumerate(graph.blocks):
+            # a block without successors falls through, as in ir.Flow_Graph.code
+            following = i + 1 if i + 1 < len(graph.blocks) else None
+            self.blocks.append(self.block(block, index, following))
+        self.locals.extend([0] * len(self.names))
+
+    def local(self, name):
+        '''Returns the index of the variable name in locals.'''
+        if name not in self.names:
+            self.names[name] = len(self.names)
+        return self.names[name]
+
+    def expression(self, tree):
+        '''Returns a function that evaluates the expression tree.'''
+        values = self.locals
+        def leave(node, operands):
+            # each result is a function and its depth, or None and the
+            # postfix items of an expression that is too deep
+            if isinstance(node, Number_AST):
+                value = node.number
+                return (lambda: value), 1
+            if isinstance(node, Identifier_AST):
+                index = self.local(node.identifier)
+                return (lambda: values[index]), 1
+            operation = operations[node.op]
+            ((left, left_depth), (right, right_depth)) = operands
+            if left is not None and right is not None and \
+               max(left_depth, right_depth) < DEPTH:
+                if isinstance(node.right, Number_AST):
+                    constant = node.right.number
+                    return (lambda: operation(left(), constant)), left_depth + 1
+                return (lambda: operation(left(), right())), \
+                       max(left_depth, right_depth) + 1
+            # the longer list takes the shorter, so building the items of a
+            # long chain takes linear time
+            left_items = left_depth if left is None else deque([(False, left)])
+            right_items = right_depth if right is None else deque([(False, right)])
+            if len(left_items) >= len(right_items):
+                left_items.extend(right_items)
+                items = left_items
+            else:
+                right_items.extendleft(reversed(left_items))
+                items = right_items
+            items.append((True, operation))
+            return None, items
+        (function, depth) = transform(tree, leave)
+        return function or evaluator(list(depth))
+
+    def condition(self, tree):
+        '''Returns a function that evaluates the condition tree. Chains of
+           and and or are tested in a loop, and not not is left out, so
+           long conditions do not nest closures deeply.'''
+        def enter(node):
+            if isinstance(node, Comparison_AST):
+                compare = comparisons[node.op]
+                left = self.expression(node.left)
+                right = self.expression(node.right)
+                return ('test', lambda: compare(left(), right()))
+        def leave(node, parts):
+            if isinstance(node, Bool_Factor_AST):
+                (part,) = parts
+                if part[0] == 'not':
+                    return ('test', part[1])
+                return ('not', test(part))
+            kind = 'or' if isinstance(node, Bool_Expression_AST) else 'and'
+            terms = []
+            for part in parts:
+                if part[0] == kind:
+                    # joined by the same operator: take over the terms
+                    if len(part[1]) > len(terms):
+                        part[1][:0] = terms
+                        terms = part[1]
+                    else:
+                        terms.extend(part[1])
+                else:
+                    terms.append(test(part))
+            return (kind, terms)
+        return test(transform(tree, leave, enter))
+
+    def statement(self, statement):
+        '''Returns a function that executes statement.'''
+        values = self.locals
+        executable = self.executable
+        if isinstance(statement, Assign_AST):
+            index = self.local(statement.identifier.identifier)
+            value = self.expression(statement.expression)
+            def assign():
+                values[index] = value()
+            return assign
+        if isinstance(statement, Read_AST):
+            index = self.local(statement.identifier.identifier)
+            def read():
+                values[index] = executable.read()
+            return read
+        if isinstance(statement, Write_AST):
+            value = self.expression(statement.expression)
+            def write():
+                executable.output.append(value())
+            return write
+        if isinstance(statement, Field_Load_AST):
+            index = self.local(statement.variable)
+            fields = executable.fields
+            name = statement.variable
+            def load():
+                values[index] = fields[name]
+            return load
+        if isinstance(statement, Field_Store_AST):
+            value = self.expression(statement.expression)
+            fields = executable.fields
+            name = statement.variable
+            def store():
+                fields[name] = value()
+            return store
+        if isinstance(statement, Invoke_AST):
+            methods = executable.methods
+            name = statement.name
+            return lambda: methods[name].run()
+        raise ValueError('cannot execute ' + repr(statement))
+
+    def block(self, block, index, following):
+        '''Returns a function that executes block and returns the index of
+           the block to go to next, or None at the end of the method. index
+           gives the index of each block, and following is that of the
+           next one.'''
+        statements = [self.statement(st) for st in block.statements]
+        successors = [index[successor] for successor in block.successors]
+        if isinstance(block.condition, ir.Switch):
+            selector = self.expression(block.condition.selector)
+            targets = dict(zip(block.condition.keys, successors))
+            default = successors[-1]
+            jump = lambda: targets.get(selector(), default)
+        elif len(successors) == 2 and successors[0] != successors[1]:
+            condition = self.condition(block.condition)
+            (true, false) = successors
+            jump = lambda: true if condition() else false
+        else:
+            target = successors[0] if successors else following
+            def run_block():
+                for st in statements:
+                    st()
+                return target
+            return run_block
+        def run_block():
+            for st in statements:
+                st()
+            return jump()
+        return run_block
+
+    def run(self):
+        blocks = self.blocks
+        executable = self.executable
+        index = 0
+        while index is not None:
+            executable.steps -= 1
+            if executable.steps < 0:
+                raise Step_Limit_Error('step limit exceeded')
+            index = blocks[index]()
+
+class Executable:
+    '''A program compiled to closures from its Program_AST, which can be run
+       many times, one run at a time.'''
+    def __init__(self, ast):
+        self.field_names = ast.fields
+        self.fields = {}
+        self.methods = {}
+        self.main = Compiled_Method(ast.program, self)
+        for method in ast.methods:
+            self.methods[method.name] = Compiled_Method(method.body, self)
+
+    def run(self, inputs=(), max_steps=None):
+        '''Runs the program with the numbers of the iterable inputs as its
+           input and returns the list of numbers it writes. Raises
+           Execution_Error if the program would end with an exception, and
+           Step_Limit_Error if it runs more than max_steps basic blocks.'''
+        self.inputs = iter(inputs)
+        self.output = []
+        self.steps = float('inf') if max_steps is None else max_steps
+        self.fields.clear()
+        self.fields.update(dict.fromkeys(self.field_names, 0))
+        for method in [self.main] + list(self.methods.values()):
+            method.locals[:] = [0] * len(method.locals)
+        try:
+            self.main.run()
+        except Execution_Error as error:
+            error.output = self.output
+            raise
+        return self.output
+
+    def read(self):
+        '''Returns the next number of the input.'''
+        try:
+            value = next(self.inputs)
+        except StopIteration:
+            raise Execution_Error('java.util.NoSuchElementException') from None
+        if not -2**31 <= value < 2**31:
+            raise Execution_Error('java.util.InputMismatchException')
+        return value
+
+def load(source, **options):
+    '''Returns the Executable of the program in the string source, compiled
+       as compiler.generate does with options: optimise, optimise_loops and
+       method_size. Raises Compile_Error like generate.'''
+    return Executable(prepare(Context(io.StringIO(source), None), **options))
+
+def run(source, inputs=(), max_steps=None, **options):
+    '''Runs the program in the string source with inputs, as
+       Executable.run does, and returns the numbers it writes. The options
+       are those of load.'''
+    return load(source, **options).run(inputs, max_steps)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run a program on the numbers on standard input and '
+                    'write the numbers it writes, without a JVM.')
+    parser.add_argument('program', help='the file of the program')
+    parser.add_argument('--no-optimise', dest='optimise', action='store_false',
+                        help='run the program as it is written')
+    args = parser.parse_args()
+    with open(args.program) as program_file:
+        source = program_file.read()
+    try:
+        executable = load(source, optimise=args.optimise)
+    except Compile_Error as error:
+        print(error)
+        sys.exit()
+    inputs = (int(word) for word in sys.stdin.read().split())
+    try:
+        output = executable.run(inputs)
+    except Execution_Error as error:
+        print('\n'.join(map(str, error.output)))
+        print('Exception in thread "main" ' + str(error), file=sys.stderr)
+        sys.exit(1)
+    for number in output:
+        print(number)
+
+if __name__ == '__main__':
+    main()
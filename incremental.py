@@ -0,0 +1,238 @@
+'''Recompiles a program that is edited again and again, as in an editor, by
+translating only the statements an edit touches.
+
+An Incremental_Compiler keeps the top-level statements of the program it
+compiled last: where each starts and ends in the source, its syntax tree and
+its code. update(source) finds the part of the source that changed, and
+scans and parses again from the start of the first statement it touches,
+until the statements parsed end where an old statement after the change
+begins; the statements from there on are the same as before and keep their
+code. An edit inside an if or while statement parses the whole of it again.
+
+Only the code of the statements parsed again is generated, so it must not
+depend on the rest of the program: the program is translated as compile
+does with optimise=False and is not split into methods, as with --stream.
+Each statement has labels of its own, named after the statement, and a
+variable keeps its local from the first time it is seen, even once it is no
+longer used, so an edit changes only the code of the statements it touches
+and the .limit directives of main.
+
+    compiler = Incremental_Compiler()
+    compiler.update('read n; write n')      # the Jasmin assembly
+    compiler.edit(14, 15, 'n * n')          # 'read n; write n * n'
+'''
+
+import bisect
+import io
+
+from classfile import Streamed_Limits, is_label, with_limits
+from compiler import Code_List, Code_Writer, Context, Label, Program_AST, \
+    Scanner, Token, Tree_Builder, end_of_input, statement
+
+class Text_Scanner(Scanner):
+    '''A Scanner of the string text from the index start on, which also
+       tells where the next token starts and where the last one consumed
+       ends.'''
+    def __init__(self, text, start=0):
+        self.input_string = text
+        self.current_char_index = start
+        self.max_char_index = len(text) - 1
+        self.current_token = self.get_token()
+
+    def get_token(self):
+        self.consumed_end = self.current_char_index
+        self.skip_white_space()
+        self.token_start = self.current_char_index
+        return Scanner.get_token(self)
+
+class Statement_Labels(Label):
+    '''Makes the labels of one statement, which begin with prefix.'''
+    def __init__(self, prefix):
+        Label.__init__(self)
+        self.prefix = prefix
+    def next(self):
+        return self.prefix + Label.next(self)
+
+class Body_Marker:
+    '''Stands for the statements in the Program_AST whose code is the code
+       around them: marks where theirs goes with the label body.'''
+    def code(self, context):
+        context.output.label('body')
+
+class Cached_Statement:
+    '''A top-level statement, from start to end in the source, with the
+       semicolon after it if there is one. instructions is its code and
+       text that code in Jasmin assembly; stack and locals are the stack
+       height and the number of locals it needs.'''
+    def __init__(self, start, end, ast, instructions, stack, locals):
+        self.start = start
+        self.end = end
+        self.ast = ast
+        self.instructions = instructions
+        self.stack = stack
+        self.locals = locals
+        self.text = jasmin(instructions)
+
+def jasmin(instructions):
+    '''Returns instructions as Jasmin assembly.'''
+    output_file = io.StringIO()
+    writer = Code_Writer(output_file)
+    for instruction in instructions:
+        writer.emit(*instruction)
+    return output_file.getvalue()
+
+def common_prefix(a, b):
+    '''Returns the length of the longest common prefix of the strings a and
+       b. The halves are compared as slices, which is much faster than
+       comparing one character at a time.'''
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def common_suffix(a, b, limit):
+    '''Returns the length, at most limit, of the longest common suffix of
+       the strings a and b.'''
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle:len(a) - low] == b[len(b) - middle:len(b) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+class Incremental_Compiler:
+    '''Compiles the successive versions of a program, with fast_io as in
+       compile. source is the last version that compiled and text the
+       last one given, which may have an error. reparsed and reused count
+       the statements parsed again and those kept by the last update.'''
+    def __init__(self, fast_io=False):
+        self.source = self.text = ''
+        self.statements = []
+        self.reparsed = self.reused = 0
+        # the parser's state, kept between the updates so that the tokens,
+        # leaves and locals stay the same
+        self.context = Context(io.StringIO(''), None, fast_io)
+        # numbers the statements, for the names of their labels
+        self.count = 0
+        # the code of the class around the statements, with the limits of
+        # main without them
+        context = Context(io.StringIO(''), Code_List(), fast_io)
+        Program_AST(Body_Marker()).code(context)
+        instructions = with_limits(context.output.instructions)
+        main = instructions.index(('.method', 'public', 'static',
+                                   'main([Ljava/lang/String;)V'))
+        body = instructions.index(('body:',))
+        self.head = instructions[:main + 1]
+        self.main_stack = instructions[main + 1][2]
+        self.main_locals = instructions[main + 2][2]
+        self.prologue = instructions[main + 3:body]
+        self.tail = instructions[body + 1:]
+        self.head_text, self.prologue_text, self.tail_text = \
+            jasmin(self.head), jasmin(self.prologue), jasmin(self.tail)
+
+    def edit(self, start, end, text):
+        '''Replaces the characters from start to end of the last version
+           given by text and compiles the result, as update does.'''
+        return self.update(self.text[:start] + text + self.text[end:])
+
+    def update(self, source):
+        '''Compiles source, the new version of the program, and returns its
+           Jasmin assembly. Raises Compile_Error if source has a lexical or
+           syntax error; the compiler then keeps the last version that
+           compiled, and the next version is compared with that.'''
+        self.text = source
+        old = self.source
+        prefix = common_prefix(old, source)
+        suffix = common_suffix(old, source, min(len(old), len(source)) - prefix)
+        # the characters from start to end of old became those from start
+        # to new_end of source
+        start, end, new_end = prefix, len(old) - suffix, len(source) - suffix
+        shift = new_end - end
+        statements = self.statements
+        # the first statement the change touches; a token that ends where
+        # the change starts may go on into it, and what follows the last
+        # statement continues it
+        first = bisect.bisect_left(statements, start, key=lambda st: st.end)
+        if first == len(statements) and statements:
+            first -= 1
+        position = min(statements[first].start, start) if statements else 0
+        # the first statement after the change, which may be kept
+        following = first
+        context = self.context
+        scanner = context.scanner = Text_Scanner(source, position)
+        parsed = []
+        if first == 0 and scanner.lookahead() == None:
+            following = len(statements) # an empty program
+        else:
+            while True:
+                while following < len(statements) and \
+                      statements[following].start + shift < scanner.token_start:
+                    following += 1
+                if scanner.token_start >= new_end and following < len(statements) and \
+                   statements[following].start + shift == scanner.token_start:
+                    break
+                parsed.append(self.parse(context))
+                if scanner.lookahead() != Token.SEM:
+                    end_of_input(context)
+                    following = len(statements)
+                    break
+                # a semicolon must be followed by a statement
+                scanner.consume(Token.SEM)
+                parsed[-1].end = scanner.consumed_end
+        kept = statements[following:]
+        for st in kept:
+            st.start += shift
+            st.end += shift
+        self.statements = statements[:first] + parsed + kept
+        self.source = source
+        self.reparsed, self.reused = len(parsed), len(self.statements) - len(parsed)
+        return self.code()
+
+    def parse(self, context):
+        '''Parses the statement that starts at the next token and returns it
+           with its code.'''
+        scanner = context.scanner
+        start = scanner.token_start
+        builder = Tree_Builder()
+        statement(context, builder)
+        ast = builder.current[0]
+        self.count += 1
+        context.output = Code_List()
+        context.label_generator = Statement_Labels('s' + str(self.count))
+        ast.code(context)
+        instructions = context.output.instructions
+        # statements start and end with an empty stack
+        limits = Streamed_Limits(Code_List())
+        limits.emit('.method', 'public', 'static', 'main([Ljava/lang/String;)V')
+        for instruction in instructions:
+            if is_label(instruction):
+                limits.label(instruction[0][:-1])
+            else:
+                limits.emit(*instruction)
+        return Cached_Statement(start, scanner.consumed_end, ast, instructions,
+                                limits.max_stack, limits.locals)
+
+    def limits(self):
+        '''Returns the .limit directives of main.'''
+        stack = max([self.main_stack] + [st.stack for st in self.statements])
+        locals = max([self.main_locals] + [st.locals for st in self.statements])
+        return [('.limit', 'stack', stack), ('.limit', 'locals', locals)]
+
+    def code(self):
+        '''Returns the Jasmin assembly of the last version that compiled.'''
+        return ''.join([self.head_text, jasmin(self.limits()), self.prologue_text] +
+                       [st.text for st in self.statements] + [self.tail_text])
+
+    def instructions(self):
+        '''Returns the instructions of the last version that compiled, as
+           generate emits them, for classfile.assemble.'''
+        result = self.head + self.limits() + self.prologue
+        for st in self.statements:
+            result += st.instructions
+        return result + self.tail
@@ -0,0 +1,585 @@
+'''The intermediate representation used by the optimiser: a flow graph of
+basic blocks.
+
+A basic block holds a list of simple statements (Assign_AST, Read_AST and
+Write_AST nodes of compiler.py) that are executed in order, followed by a
+jump: to no block at the end of the program, to a single block, or to one
+of two blocks depending on a condition. The statements of the program are
+lowered into a Flow_Graph by their lower(graph) methods; the graph can then
+be optimised and emits code in place of the statements of Program_AST.
+
+The passes only use these methods of the nodes:
+    uses() returns the set of variables a node reads,
+    defines() returns the variable a statement writes, or None,
+    has_effect() tells if a statement must be kept even if its variable is
+        never read (it reads input, writes output or may divide by zero),
+    substitute(values) returns the node with each variable that is a key of
+        values replaced by its value, a constant or another variable, and
+        the result folded,
+    replace(function) returns the node with each expression e in it for
+        which function(e) is not None replaced by function(e), trying the
+        larger expressions first,
+and the attribute simple, which is True for constants and variables. The
+loop optimisations also use these:
+    assign(variable) returns a statement that assigns an expression to a
+        variable; its identifier attribute is the expression that reads
+        the variable,
+    plus(other) and times(other) return the folded sum or product of two
+        expressions,
+    product() returns the two factors of a multiplication, or None,
+    increment() returns the constant c if a statement is x := x + c, the
+        constant -c if it is x := x - c, or None.
+Dead branch elimination uses value(), which returns True or False if the
+value of a condition is known without running the program, or None, and
+switches are made from conditions whose equality() is not None: the
+variable and the constant of a comparison variable = constant.
+'''
+
+class Switch:
+    '''The condition of a block that jumps to one of its successors by the
+       value of selector: to the i-th if it is keys[i], and to the last one
+       if it is none of the keys.'''
+    def __init__(self, selector, keys):
+        self.selector = selector
+        self.keys = keys
+    def __repr__(self):
+        return 'case ' + repr(self.selector) + ' of ' + repr(self.keys)
+    def uses(self):
+        return self.selector.uses()
+    def substitute(self, values):
+        return Switch(self.selector.substitute(values), self.keys)
+    def replace(self, function):
+        return Switch(self.selector.replace(function), self.keys)
+    def value(self):
+        return None
+    def code(self, context, labels):
+        '''Emits a tableswitch if the keys are dense enough for the table to
+           be small, else a lookupswitch. labels are those of the
+           successors.'''
+        self.selector.code(context)
+        cases = dict(zip(self.keys, labels))
+        default = labels[-1]
+        low, high = min(self.keys), max(self.keys)
+        # the choice javac makes, weighing size against the time of a search
+        table_cost = 4 + (high - low + 1) + 3 * 3
+        lookup_cost = 3 + 2 * len(self.keys) + 3 * len(self.keys)
+        if table_cost <= lookup_cost:
+            context.output.emit('tableswitch', low,
+                                [cases.get(key, default) for key in range(low, high + 1)],
+                                default)
+        else:
+            context.output.emit('lookupswitch', sorted(cases.items()), default)
+
+class Basic_Block:
+    '''Statements executed in sequence, and the blocks that may follow. If
+       there are two successors, condition chooses between them: the first
+       if it is true, the second if it is false.'''
+    def __init__(self):
+        self.statements = []
+        self.condition = None
+        self.successors = []
+        self.label = None
+    def __repr__(self):
+        return self.label or 'block %x' % id(self)
+    def uses_at_end(self):
+        '''Returns the variables read by the jump at the end of the block.'''
+        return self.condition.uses() if self.condition else set()
+
+class Loop:
+    '''A while loop: the blocks of its body and test, and the block before
+       it, which is executed once each time the loop is entered. body holds
+       the blocks of the loop that are not in a loop inside it, and those
+       inner Loops, in order, so that a loop can be looked at without the
+       loops inside it.'''
+    def __init__(self, preheader, body):
+        self.preheader = preheader
+        self.body = body
+    def blocks(self):
+        '''Returns the blocks of the loop, those of the inner loops
+           included, in order.'''
+        result = []
+        items = [iter(self.body)]
+        while items:
+            for item in items[-1]:
+                if isinstance(item, Loop):
+                    items.append(iter(item.body))
+                    break
+                result.append(item)
+            else:
+                items.pop()
+        return result
+    def first(self):
+        '''Returns the first block of the loop.'''
+        loop = self
+        while isinstance(loop.body[0], Loop):
+            loop = loop.body[0]
+        return loop.body[0]
+    def own_blocks(self):
+        '''Returns the blocks of the loop that are not in an inner loop.'''
+        return [item for item in self.body if not isinstance(item, Loop)]
+    def summarise(self):
+        '''Finds the variables that may change in the loop, and those of
+           them that change other than by adding a constant, from the
+           statements of its own blocks and those the inner loops found.'''
+        self.changed, self.irregular = set(), set()
+        for item in self.body:
+            if isinstance(item, Loop):
+                self.changed |= item.changed
+                self.irregular |= item.irregular
+            else:
+                for statement in item.statements:
+                    self.count(statement)
+    def count(self, statement):
+        '''Adds what statement changes to what summarise found.'''
+        variable = statement.defines()
+        if variable is not None:
+            self.changed.add(variable)
+            if statement.increment() is None:
+                self.irregular.add(variable)
+    def replace(self, function, blocks):
+        '''Replaces the expressions in blocks, some blocks of the loop, as
+           replace(function) does.'''
+        for block in blocks:
+            block.statements = [st.replace(function) for st in block.statements]
+            if block.condition:
+                block.condition = block.condition.replace(function)
+
+class Flow_Graph:
+    '''The basic blocks of a program, in the order their code is emitted.
+       The first block is entered at the start of the program and the last
+       one ends it.'''
+    def __init__(self):
+        self.blocks = []
+        self.current = self.new_block()
+        self.blocks.append(self.current)
+        # the loops, inner ones before the loops around them
+        self.loops = []
+        # the blocks placed and the loops recorded that are not yet known
+        # to be in a loop
+        self.outside = [self.current]
+        self.temporaries = 0
+
+    # Building the graph, used by the lower() methods.
+
+    def new_block(self):
+        '''Returns a new block, which is not placed until it is started.'''
+        return Basic_Block()
+    def add(self, statement):
+        '''Appends a simple statement to the current block.'''
+        self.current.statements.append(statement)
+    def jump(self, block):
+        '''Ends the current block with a jump to block.'''
+        self.current.successors = [block]
+    def branch(self, condition, true_block, false_block):
+        '''Ends the current block with a jump to true_block if condition is
+           true and to false_block if it is not.'''
+        self.current.condition = condition
+        self.current.successors = [true_block, false_block]
+    def start(self, block):
+        '''Places block after the blocks placed so far and makes it the
+           current block.'''
+        self.blocks.append(block)
+        self.outside.append(block)
+        self.current = block
+    def loop(self, preheader, first):
+        '''Records a loop made of the blocks from first to the current
+           block, entered from preheader.'''
+        start = len(self.outside) - 1
+        while self.outside[start] is not first:
+            start -= 1
+        loop = Loop(preheader, self.outside[start:])
+        del self.outside[start:]
+        self.outside.append(loop)
+        self.loops.append(loop)
+
+    def __repr__(self):
+        result = ''
+        for block in self.blocks:
+            result += repr(block) + ': ' + \
+                      '; '.join(repr(st) for st in block.statements)
+            if block.condition:
+                result += ' if ' + repr(block.condition)
+            result += ' -> ' + ', '.join(map(repr, block.successors)) + '\n'
+        return result
+
+    def predecessors(self):
+        '''Returns the blocks that can jump to each block.'''
+        result = dict((block, []) for block in self.blocks)
+        for block in self.blocks:
+            for successor in block.successors:
+                result[successor].append(block)
+        return result
+
+    # Copy and constant propagation.
+
+    def propagate(self):
+        '''Replaces each variable by the constant or variable that was last
+           assigned to it, on every path to where it is read, and folds the
+           expressions that become constant.'''
+        values_in = self.values()
+        for block in self.blocks:
+            if values_in[block] is None:
+                continue # unreachable
+            values = dict(values_in[block])
+            statements = []
+            for statement in block.statements:
+                statement = assign_values(statement, values)
+                if statement is not None:
+                    statements.append(statement)
+            block.statements = statements
+            if block.condition:
+                block.condition = block.condition.substitute(values)
+
+    def values(self):
+        '''Returns the values known at the start of each block: a dictionary
+           from variables to the constant or variable they are equal to on
+           every path to the block, or None for an unreachable block.'''
+        values_in = dict((block, None) for block in self.blocks)
+        values_in[self.blocks[0]] = {}
+        work = [self.blocks[0]]
+        while work:
+            block = work.pop()
+            values = dict(values_in[block])
+            for statement in block.statements:
+                assign_values(statement, values)
+            for successor in block.successors:
+                old = values_in[successor]
+                new = dict(values) if old is None else \
+                      dict((variable, value) for (variable, value) in old.items()
+                           if variable in values and
+                              repr(values[variable]) == repr(value))
+                if new != old:
+                    values_in[successor] = new
+                    work.append(successor)
+        return values_in
+
+    # Dead branch elimination.
+
+    def eliminate_dead_branches(self):
+        '''Replaces each condition whose value is known by a jump to the
+           block it selects, and removes the blocks that can no longer be
+           reached. Returns True if anything changed.'''
+        changed = False
+        for block in self.blocks:
+            if block.condition:
+                value = block.condition.value()
+                if value is not None:
+                    block.successors = [block.successors[0 if value else 1]]
+                    block.condition = None
+                    changed = True
+        return self.remove_unreachable() or changed
+
+    def remove_unreachable(self):
+        '''Removes the blocks that cannot be reached from the first one.
+           Returns True if there were any.'''
+        reached = set([self.blocks[0]])
+        work = [self.blocks[0]]
+        while work:
+            for successor in work.pop().successors:
+                if successor not in reached:
+                    reached.add(successor)
+                    work.append(successor)
+        if len(reached) < len(self.blocks):
+            self.blocks = [block for block in self.blocks if block in reached]
+            # a loop whose body cannot be reached no longer loops, and the
+            # loop around it takes what is left of it
+            first = [loop.first() for loop in self.loops]
+            kept, dropped = [], set()
+            for (loop, block) in zip(self.loops, first):
+                if block in reached:
+                    kept.append(loop)
+                else:
+                    dropped.add(loop)
+                body = []
+                for item in loop.body:
+                    if item in dropped:
+                        body += item.body
+                    elif isinstance(item, Loop) or item in reached:
+                        body.append(item)
+                loop.body = body
+            self.loops = kept
+            return True
+        return False
+
+    # Switches.
+
+    def make_switches(self, minimum=3):
+        '''Replaces each chain of at least minimum blocks that compare the
+           same variable with constants, where the only thing a block does
+           if its comparison is false is the next comparison, by a switch.'''
+        predecessors = self.predecessors()
+        removed = set()
+        for block in self.blocks:
+            if block in removed or not block.condition or \
+               len(block.successors) != 2 or not block.condition.equality():
+                continue
+            selector, key = block.condition.equality()
+            keys, targets, chain = [key], [block.successors[0]], []
+            test = block.successors[1]
+            while not test.statements and test.condition and \
+                  len(test.successors) == 2 and len(predecessors[test]) == 1 and \
+                  test.condition.equality() and \
+                  repr(test.condition.equality()[0]) == repr(selector):
+                key = test.condition.equality()[1]
+                # a key tested before never gets here
+                if key not in keys:
+                    keys.append(key)
+                    targets.append(test.successors[0])
+                chain.append(test)
+                test = test.successors[1]
+            if len(keys) >= minimum:
+                block.condition = Switch(selector, keys)
+                block.successors = targets + [test]
+                removed.update(chain)
+        if removed:
+            self.blocks = [block for block in self.blocks if block not in removed]
+            for loop in self.loops:
+                loop.body = [item for item in loop.body if item not in removed]
+            self.remove_unreachable()
+
+    # Liveness and dead store elimination.
+
+    def liveness(self):
+        '''Returns the variables that may be read before they are written
+           again, at the start and at the end of each block.'''
+        live_in = dict((block, set()) for block in self.blocks)
+        live_out = dict((block, set()) for block in self.blocks)
+        predecessors = self.predecessors()
+        work = list(self.blocks)
+        waiting = set(work)
+        while work:
+            block = work.pop()
+            waiting.discard(block)
+            live_out[block] = set().union(*[live_in[successor]
+                                            for successor in block.successors])
+            live = live_out[block] | block.uses_at_end()
+            for statement in reversed(block.statements):
+                live.discard(statement.defines())
+                live |= statement.uses()
+            if live != live_in[block]:
+                live_in[block] = live
+                for predecessor in predecessors[block]:
+                    if predecessor not in waiting:
+                        work.append(predecessor)
+                        waiting.add(predecessor)
+        return live_in, live_out
+
+    def eliminate_dead_stores(self):
+        '''Removes the assignments to variables that are not read
+           afterwards. Returns True if any was removed.'''
+        removed = False
+        live_in, live_out = self.liveness()
+        for block in self.blocks:
+            live = live_out[block] | block.uses_at_end()
+            statements = []
+            for statement in reversed(block.statements):
+                variable = statement.defines()
+                if variable not in live and not statement.has_effect():
+                    removed = True
+                    continue
+                live.discard(variable)
+                live |= statement.uses()
+                statements.append(statement)
+            block.statements = statements[::-1]
+        return removed
+
+    # Allocation of locals.
+
+    def interference(self):
+        '''Returns the variables that cannot share a local with each
+           variable, because both may hold a value that is still needed.'''
+        live_in, live_out = self.liveness()
+        graph = {}
+        def add(variable):
+            graph.setdefault(variable, set())
+        def interfere(variable, others):
+            add(variable)
+            for other in others:
+                if other != variable:
+                    graph[variable].add(other)
+                    add(other)
+                    graph[other].add(variable)
+        # variables read before they are set are all live at the start
+        for variable in live_in[self.blocks[0]]:
+            interfere(variable, live_in[self.blocks[0]])
+        for block in self.blocks:
+            live = live_out[block] | block.uses_at_end()
+            for variable in live:
+                add(variable)
+            for statement in reversed(block.statements):
+                variable = statement.defines()
+                if variable is not None:
+                    interfere(variable, live)
+                    live.discard(variable)
+                for used in statement.uses():
+                    add(used)
+                live |= statement.uses()
+        return graph
+
+    def allocate_locals(self, first=0):
+        '''Returns the local for each variable, numbered from first. Two
+           variables share a local if their values are never needed at the
+           same time. Each variable gets the lowest local that none of the
+           variables it interferes with has, in the order of the program.'''
+        graph = self.interference()
+        locations = {}
+        for variable in self.variables():
+            taken = set(locations[other] for other in graph.get(variable, ())
+                        if other in locations)
+            location = first
+            while location in taken:
+                location += 1
+            locations[variable] = location
+        return locations
+
+    def variables(self):
+        '''Returns the variables of the program in the order they appear.'''
+        result = {}
+        for block in self.blocks:
+            for statement in block.statements:
+                for variable in sorted(statement.uses()) + [statement.defines()]:
+                    if variable is not None:
+                        result[variable] = True
+            for variable in sorted(block.uses_at_end()):
+                result[variable] = True
+        return list(result)
+
+    # Loop optimisations.
+
+    def temporary(self):
+        '''Returns a new variable, which cannot clash with the variables of
+           the program.'''
+        self.temporaries += 1
+        return '$' + str(self.temporaries)
+
+    def reduce_strength(self, loop):
+        '''Replaces each product i*k in the loop, of an induction variable i
+           that only changes by i := i + c and an invariant k, by a new
+           variable that is set to i*k before the loop and increased by c*k
+           wherever i is increased. Returns the blocks of the loop it
+           changed.'''
+        variant = loop.changed
+        reduced = {}
+        def reduce(expression):
+            factors = expression.product()
+            if factors is None:
+                return None
+            for (i, k) in (factors, factors[::-1]):
+                if i.simple and i.uses() and repr(i) in variant and \
+                   repr(i) not in loop.irregular and \
+                   k.simple and not k.uses() & variant:
+                    key = (repr(i), repr(k))
+                    if key not in reduced:
+                        reduced[key] = (expression.assign(self.temporary()), k)
+                    return reduced[key][0].identifier
+            return None
+        blocks = loop.own_blocks()
+        loop.replace(reduce, blocks)
+        if not reduced:
+            return blocks
+        # i may be increased in the inner loops as well
+        blocks = loop.blocks()
+        for ((i, factor), (initial, k)) in reduced.items():
+            loop.preheader.statements.append(initial)
+            for block in blocks:
+                statements = []
+                for statement in block.statements:
+                    statements.append(statement)
+                    if statement.defines() == i:
+                        step = statement.increment().times(k)
+                        statements.append(initial.identifier.plus(step).assign(
+                                              repr(initial.identifier)))
+                        loop.count(statements[-1])
+                block.statements = statements
+        return blocks
+
+    def move_invariants(self, loop, blocks):
+        '''Moves the expressions in blocks, blocks of the loop, whose value
+           does not change in the loop before it, into new variables.'''
+        variant = loop.changed
+        hoisted = {}
+        def hoist(expression):
+            if expression.simple or expression.uses() & variant or \
+               expression.may_fail():
+                return None
+            key = repr(expression)
+            if key not in hoisted:
+                hoisted[key] = expression.assign(self.temporary())
+            return hoisted[key].identifier
+        loop.replace(hoist, blocks)
+        loop.preheader.statements += hoisted.values()
+
+    def optimise(self, loops=True):
+        '''Simplifies the graph as far as possible. If loops is True, the
+           loops are optimised as well, the inner ones first, and simplified
+           again. Finally chains of equality tests become switches.
+
+           Once an inner loop is optimised, what is left in it depends on
+           what changes in it, so the loops around it find nothing more to
+           move or reduce there: a loop only looks at its own blocks, and
+           the blocks the strength reduction adds to, and takes what
+           changes in the inner loops from their summaries.'''
+        self.simplify()
+        if loops and self.loops:
+            for loop in self.loops:
+                loop.summarise()
+                blocks = self.reduce_strength(loop)
+                self.move_invariants(loop, blocks)
+            self.simplify()
+        self.make_switches()
+
+    def simplify(self):
+        '''Runs copy and constant propagation, dead branch elimination and
+           dead store elimination until there is nothing left to remove.'''
+        self.propagate()
+        while self.eliminate_dead_branches() or self.eliminate_dead_stores():
+            self.propagate()
+
+    # Code generation.
+
+    def code(self, context):
+        '''Emits the code of the blocks in order. A jump to the next block is
+           left out, so it falls through.'''
+        for block in self.blocks:
+            block.label = context.label_generator.next()
+        for (index, block) in enumerate(self.blocks):
+            following = self.blocks[index + 1] if index + 1 < len(self.blocks) else None
+            context.output.label(block.label)
+            for statement in block.statements:
+                statement.code(context)
+            if isinstance(block.condition, Switch):
+                block.condition.code(context, [b.label for b in block.successors])
+            elif len(block.successors) == 2 and \
+               block.successors[0] is not block.successors[1]:
+                true_block, false_block = block.successors
+                E_true = None if true_block is following else true_block.label
+                E_false = None if false_block is following else false_block.label
+                block.condition.code(context, E_true, E_false)
+            elif block.successors and block.successors[0] is not following:
+                context.output.emit('goto', block.successors[0].label)
+
+def assign_values(statement, values):
+    '''Returns statement with the variables it reads replaced by their
+       values, and records the value it assigns, if it is a constant or a
+       variable. Returns None for an assignment of a variable to itself.'''
+    statement = statement.substitute(values)
+    variable = statement.defines()
+    if variable is None:
+        return statement
+    # values equal to the old value of the variable are no longer known
+    values.pop(variable, None)
+    for (other, value) in list(values.items()):
+        if variable in value.uses():
+            del values[other]
+    expression = getattr(statement, 'expression', None)
+    if expression is not None and expression.simple:
+        if variable in expression.uses():
+            return None
+        values[variable] = expression
+    return statement
+
+def lower(statements):
+    '''Returns the flow graph of statements.'''
+    graph = Flow_Graph()
+    statements.lower(graph)
+    return graph
@@ -0,0 +1,254 @@
+'''A peephole optimiser for the instructions emitted by the code generator.
+
+It works on the list of instructions collected by compiler.Code_List (see
+classfile.py for their form). Each rule looks at the instructions starting
+at one index and may replace some of them. The rules are applied until none
+of them matches anywhere, and the optimiser counts how often each rule hit.
+
+A rule is a function rule(code, index, labels) that returns None if it does
+not match at code[index], or a pair (length, replacement) to replace the
+length instructions starting at index by the list replacement. labels is
+the Label_Info of code.
+'''
+
+from classfile import is_label, negations, opcodes, unconditional, \
+    BRANCH, TABLE_SWITCH, LOOKUP_SWITCH
+
+def is_instruction(instruction):
+    '''Returns True for an instruction, False for a label or directive.'''
+    return instruction[0] in opcodes
+
+def constant(instruction):
+    '''Returns the int an instruction pushes, or None if it is not a
+       constant load.'''
+    op = instruction[0]
+    if op == 'iconst_m1':
+        return -1
+    if op[:7] == 'iconst_':
+        return int(op[7:])
+    if op in ('bipush', 'sipush') or \
+       op == 'ldc' and isinstance(instruction[1], int):
+        return instruction[1]
+    return None
+
+def jump_labels(instruction):
+    '''Returns the labels a branch or switch can jump to.'''
+    kind = opcodes[instruction[0]][1] if is_instruction(instruction) else None
+    if kind == BRANCH:
+        return [instruction[1]]
+    if kind == TABLE_SWITCH:
+        return instruction[2] + [instruction[3]]
+    if kind == LOOKUP_SWITCH:
+        return [label for (key, label) in instruction[1]] + [instruction[2]]
+    return []
+
+def replace_labels(instruction, new_label):
+    '''Returns instruction with each label L it jumps to replaced by
+       new_label(L).'''
+    kind = opcodes[instruction[0]][1]
+    if kind == BRANCH:
+        return (instruction[0], new_label(instruction[1]))
+    if kind == TABLE_SWITCH:
+        return (instruction[0], instruction[1],
+                [new_label(label) for label in instruction[2]],
+                new_label(instruction[3]))
+    return (instruction[0],
+            [(key, new_label(label)) for (key, label) in instruction[1]],
+            new_label(instruction[2]))
+
+class Label_Info:
+    '''Where the labels of a list of instructions are and how they are
+       used.'''
+    def __init__(self, code):
+        self.code = code
+        # index of each label definition
+        self.position = {}
+        for (index, instruction) in enumerate(code):
+            if is_label(instruction):
+                self.position[instruction[0][:-1]] = index
+        # how often each label is mentioned, by jumps or by directives
+        self.references = dict((label, 0) for label in self.position)
+        for instruction in code:
+            if not is_label(instruction):
+                for operand in instruction[1:]:
+                    for label in (operand if isinstance(operand, list) else [operand]):
+                        if isinstance(label, tuple):
+                            label = label[1]
+                        if isinstance(label, str) and label in self.references:
+                            self.references[label] += 1
+        # the labels defined together, the label jumps to each should use
+        # and the instruction after them, found once for the whole code
+        self.runs, self.canonicals, self.after = {}, {}, {}
+        run = []
+        for instruction in code + [None]:
+            if instruction is not None and is_label(instruction):
+                run.append(instruction[0][:-1])
+            elif run:
+                used = [label for label in run if self.references[label] > 0]
+                for label in run:
+                    self.runs[label] = run
+                    self.canonicals[label] = used[0] if used else label
+                    self.after[label] = instruction
+                run = []
+        # where the jumps to each label end up, as they are asked for
+        self.destinations = {}
+
+    def run(self, label):
+        '''Returns the labels defined together with label, without any
+           instruction in between.'''
+        return self.runs[label]
+
+    def canonical(self, label):
+        '''Returns the label that jumps to label should use: the first of the
+           labels defined together with it that is already used.'''
+        return self.canonicals[label]
+
+    def following(self, label):
+        '''Returns the first instruction or directive after label.'''
+        return self.after[label]
+
+    def destination(self, label):
+        '''Returns the label where a jump to label really ends up, after
+           following any gotos it leads to.'''
+        if label in self.destinations:
+            return self.destinations[label]
+        path = []
+        seen = set()
+        while label not in seen:
+            if label in self.destinations:
+                result = self.destinations[label]
+                break
+            seen.add(label)
+            path.append(label)
+            instruction = self.after[label]
+            if instruction is None or instruction[0] != 'goto':
+                result = self.canonicals[label]
+                break
+            label = instruction[1]
+        else:
+            # the gotos form a loop, so leave the jump alone
+            return self.canonicals[label]
+        for other in path:
+            self.destinations[other] = result
+        return result
+
+# The rules.
+
+def store_load(code, index, labels):
+    '''istore n; iload n; ...; iload n  ->  dup; ...; dup; istore n'''
+    if code[index][0] == 'istore':
+        end = index + 1
+        while end < len(code) and code[end] == ('iload', code[index][1]):
+            end += 1
+        if end > index + 1:
+            return end - index, [('dup',)] * (end - index - 1) + [code[index]]
+
+def increment(code, index, labels):
+    '''iload x; const c; iadd/isub; istore x  ->  iinc x (-)c
+       const c; iload x; iadd; istore x  ->  iinc x c'''
+    window = code[index:index + 4]
+    if len(window) < 4 or window[3][0] != 'istore':
+        return None
+    local = window[3][1]
+    if window[0] == ('iload', local) and constant(window[1]) is not None and \
+       window[2][0] in ('iadd', 'isub'):
+        value = constant(window[1])
+        if window[2][0] == 'isub':
+            value = -value
+    elif constant(window[0]) is not None and window[1] == ('iload', local) and \
+         window[2][0] == 'iadd':
+        value = constant(window[0])
+    else:
+        return None
+    if -128 <= value <= 127:
+        return 4, [('iinc', local, value)]
+
+def push_pop(code, index, labels):
+    '''load or constant; pop  ->  nothing'''
+    if index + 1 < len(code) and code[index + 1][0] == 'pop' and \
+       (code[index][0] in ('iload', 'aload', 'dup') or
+        constant(code[index]) is not None):
+        return 2, []
+
+def branch_over_goto(code, index, labels):
+    '''if_x L1; goto L2; L1:  ->  if_not_x L2; L1:'''
+    window = code[index:index + 3]
+    if len(window) == 3 and window[0][0] in negations and \
+       window[1][0] == 'goto' and is_label(window[2]) and \
+       window[0][1] == window[2][0][:-1]:
+        return 2, [(negations[window[0][0]], window[1][1])]
+
+def goto_next(code, index, labels):
+    '''goto L; L:  ->  L:'''
+    if code[index][0] == 'goto':
+        next_index = index + 1
+        while next_index < len(code) and is_label(code[next_index]):
+            if code[next_index][0][:-1] == code[index][1]:
+                return 1, []
+            next_index += 1
+
+def goto_return(code, index, labels):
+    '''goto L; ... L: return  ->  return; ... L: return'''
+    if code[index][0] == 'goto':
+        following = labels.following(code[index][1])
+        if following in (('return',), ('ireturn',), ('areturn',)):
+            return 1, [following]
+
+def jump_to_jump(code, index, labels):
+    '''jump L1; ... L1: goto L2  ->  jump L2, and jumps to one of several
+       labels at the same place all use the same label'''
+    targets = jump_labels(code[index])
+    if targets:
+        retargeted = replace_labels(code[index], labels.destination)
+        if jump_labels(retargeted) != targets:
+            return 1, [retargeted]
+
+def unreachable(code, index, labels):
+    '''goto/return/...; instructions without a label  ->  goto/return/...'''
+    if is_instruction(code[index]) and code[index][0] in unconditional:
+        end = index + 1
+        while end < len(code) and is_instruction(code[end]):
+            end += 1
+        if end > index + 1:
+            return end - index, [code[index]]
+
+def unused_label(code, index, labels):
+    '''L: where nothing jumps to L  ->  nothing'''
+    if is_label(code[index]) and labels.references[code[index][0][:-1]] == 0:
+        return 1, []
+
+default_rules = [store_load, increment, push_pop, branch_over_goto,
+                 goto_next, goto_return, jump_to_jump, unreachable,
+                 unused_label]
+
+class Peephole_Optimiser:
+    '''Applies rules, by default default_rules, to lists of instructions.
+       hits counts how often each rule has matched, by the name of the
+       rule, over all the lists optimised.'''
+    def __init__(self, rules=None):
+        self.rules = list(default_rules if rules is None else rules)
+        self.hits = dict((rule.__name__, 0) for rule in self.rules)
+
+    def optimise(self, code):
+        '''Returns code with the rules applied until none of them matches.'''
+        changed = True
+        while changed:
+            changed = False
+            labels = Label_Info(code)
+            result = []
+            index = 0
+            while index < len(code):
+                for rule in self.rules:
+                    match = rule(code, index, labels)
+                    if match:
+                        length, replacement = match
+                        self.hits[rule.__name__] += 1
+                        result += replacement
+                        index += length
+                        changed = True
+                        break
+                else:
+                    result.append(code[index])
+                    index += 1
+            code = result
+        return code
@@ -0,0 +1,159 @@
+'''A compile server, which keeps the compiler loaded between compilations.
+
+Usage: python server.py [--socket PATH] [--workers N]
+
+The server listens on a Unix socket for the requests of client.py, which
+also describes the protocol. Starting Python and importing the compiler
+takes longer than compiling a small program, so tools that compile often
+can send their programs to one long-running server instead. The
+connections are served concurrently by asyncio, and the programs are
+compiled on a pool of worker processes, which import the compiler once.
+'''
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from classfile import Assembly_Error
+from client import default_socket, encode_message
+from compiler import Compile_Error, Compile_Stats, compile, compile_class
+from peephole import Peephole_Optimiser
+
+# the options of compiler.generate that a request may give
+request_options = { 'optimise', 'optimise_loops', 'fast_io', 'method_size',
+                    'stream' }
+
+def compile_request(source, format='jasmin', options={}, peephole_stats=False,
+                    profile=False, profile_memory=False):
+    '''Compiles source, the UTF-8 bytes of a program, in a worker process
+       and returns the header and payload of the response.'''
+    peephole = Peephole_Optimiser()
+    stats = Compile_Stats(profile_memory) if profile or profile_memory else None
+    # as a binary file, so it is scanned as compiler.py scans a file
+    source = io.BytesIO(source)
+    try:
+        if format == 'class':
+            payload = compile_class(source, peephole=peephole, stats=stats,
+                                    **options)
+        else:
+            payload = compile(source, peephole=peephole, stats=stats,
+                              **options).encode('utf-8')
+    except (Compile_Error, Assembly_Error) as error:
+        return { 'status': 'error' }, str(error).encode('utf-8')
+    header = { 'status': 'ok' }
+    if peephole_stats:
+        header['peephole'] = peephole.hits
+    if stats:
+        header['profile'] = stats.as_dict()
+    return header, payload
+
+def check_request(header):
+    '''Returns the report of what is wrong with the header of a request, or
+       None if nothing is.'''
+    if header.get('format', 'jasmin') not in ('jasmin', 'class'):
+        return 'unknown format ' + repr(header['format'])
+    options = header.get('options', {})
+    if not isinstance(options, dict):
+        return 'the options must be an object'
+    unknown = sorted(set(options) - request_options)
+    if unknown:
+        return 'unknown options: ' + ', '.join(unknown)
+    return None
+
+class Compile_Server:
+    '''Serves the requests on path with a pool of workers processes
+       (default: one per CPU). requests counts the requests served.'''
+    def __init__(self, path=None, workers=None):
+        self.path = path or default_socket()
+        self.workers = workers or os.cpu_count() or 1
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        '''Answers the requests of one connection, in order, until the
+           client closes it. A request that cannot be read ends the
+           connection.'''
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                header = json.loads(line)
+                source = await reader.readexactly(header['length'])
+                problem = check_request(header)
+                if problem:
+                    response = ({ 'status': 'error' },
+                                ('bad request: ' + problem).encode('utf-8'))
+                else:
+                    try:
+                        response = await loop.run_in_executor(
+                            self.pool, compile_request, source,
+                            header.get('format', 'jasmin'), header.get('options', {}),
+                            bool(header.get('peephole_stats')),
+                            bool(header.get('profile')),
+                            bool(header.get('profile_memory')))
+                    except Exception as error:
+                        # options of the wrong type, or a fault in the
+                        # compiler, which must not stop the server
+                        response = ({ 'status': 'error' },
+                                    ('internal error: ' + repr(error)).encode('utf-8'))
+                self.requests += 1
+                writer.write(encode_message(*response))
+                await writer.drain()
+        except (ValueError, KeyError, TypeError, asyncio.IncompleteReadError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        '''Serves until cancelled or terminated, and then removes the
+           socket. Raises OSError if another server is listening on it.'''
+        if os.path.exists(self.path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.path)
+                except OSError:
+                    # left by a server that did not stop cleanly
+                    os.remove(self.path)
+                else:
+                    raise OSError('a server is listening on ' + self.path)
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        with ProcessPoolExecutor(self.workers) as self.pool:
+            # start the workers now, so the first requests do not wait for
+            # them to import the compiler
+            await asyncio.gather(*[loop.run_in_executor(self.pool, compile_request, b'')
+                                   for i in range(self.workers)])
+            server = await asyncio.start_unix_server(self.handle, self.path)
+            print('listening on ' + self.path, file=sys.stderr)
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                os.remove(self.path)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve compile requests from client.py on a Unix socket.')
+    parser.add_argument('--socket', default=None,
+                        help='the socket to listen on (default %s)' % default_socket())
+    parser.add_argument('--workers', '-j', type=int, default=None,
+                        help='number of worker processes (default: CPUs)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(Compile_Server(args.socket, args.workers).serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    except OSError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+'''Tests of the benchmark. Run with python -m unittest or pytest.'''
+
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from benchmark import PHASES, benchmark_phases, compare, growth, random_program
+from compiler import compile
+
+def record(phase, statements, seconds):
+    return { 'phase': phase, 'statements': statements, 'characters': 0,
+             'tokens': 10 * statements, 'seconds': seconds }
+
+class Random_Program_Test(unittest.TestCase):
+    def test_compiles(self):
+        for seed in range(5):
+            for options in [{}, { 'depth': 6, 'comparisons': 3 },
+                            { 'expression_size': 0, 'boolean_mix': (0, 1, 0) }]:
+                source = random_program(100, seed=seed, **options)
+                self.assertEqual(source, random_program(100, seed=seed, **options))
+                self.assertIn('.method', compile(source))
+
+class Benchmark_Test(unittest.TestCase):
+    def test_phases(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = benchmark_phases([20, 200], repeat=1)
+        self.assertEqual([(r['phase'], r['statements']) for r in results],
+                         [(phase, size) for size in [20, 200] for phase in PHASES])
+        self.assertTrue(all(r['tokens'] > 0 and r['seconds'] > 0 for r in results))
+
+    def test_growth(self):
+        results = [record('parse', 1000, 0.1), record('parse', 10000, 1.0),
+                   record('parse', 100000, 100.0), record('scan', 1000, 0.001)]
+        self.assertAlmostEqual(growth(results, 'parse'), 1.5)
+        # one time is too short to count
+        self.assertIsNone(growth(results, 'scan'))
+
+    def test_compare(self):
+        baseline = [record('parse', 1000, 0.1), record('parse', 10000, 1.0)]
+        self.assertEqual(compare(baseline, baseline), [])
+        slower = [record('parse', 1000, 0.1), record('parse', 10000, 2.0)]
+        self.assertEqual(compare(slower, baseline),
+                         ['parse on 10000 statements: 2.000s, was 1.000s',
+                          'parse grows as tokens^1.30, was tokens^1.00'])
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as directory:
+            results = os.path.join(directory, 'results.json')
+            # one size, as the growth of times this short is only noise
+            command = [sys.executable, 'benchmark.py', '--sizes', '50',
+                       '--repeat', '1']
+            here = os.path.dirname(os.path.abspath(__file__))
+            subprocess.run(command + ['--output', results], cwd=here, check=True,
+                           stdout=subprocess.DEVNULL)
+            with open(results) as results_file:
+                self.assertEqual(len(json.load(results_file)['results']), len(PHASES))
+            subprocess.run(command + ['--baseline', results, '--tolerance', '1000'],
+                           cwd=here, check=True, stdout=subprocess.DEVNULL)
+
+if __name__ == '__main__':
+    unittest.main()
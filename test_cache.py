@@ -0,0 +1,101 @@
+'''Tests of the compilation cache. Run with python -m unittest or pytest.'''
+
+import os
+import tempfile
+import unittest
+
+from batch import compile_file
+from cache import Compilation_Cache
+from compiler import Compile_Error, Compile_Stats
+from peephole import Peephole_Optimiser
+
+class Cache_Test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_total(self):
+        cache = Compilation_Cache(self.directory.name)
+        cache.put('aa01', b'12345')
+        cache.put('bb02', b'123')
+        cache.put('aa01', b'1')
+        self.assertEqual(cache.total, 4)
+        # a new cache counts what is there
+        self.assertEqual(Compilation_Cache(self.directory.name).total, 4)
+
+    def test_walks_only_when_full(self):
+        cache = Compilation_Cache(self.directory.name, max_bytes=10)
+        walks = []
+        entries = cache.entries
+        cache.entries = lambda: walks.append(1) or entries()
+        for number in range(5):
+            cache.put('%04d' % number, b'12')
+        self.assertEqual(walks, [])
+        cache.put('0005', b'12')
+        self.assertEqual(len(walks), 1)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.total, 10)
+
+    def test_evicts_least_recently_used(self):
+        cache = Compilation_Cache(self.directory.name, max_bytes=4)
+        cache.put('0001', b'12')
+        cache.put('0002', b'12')
+        os.utime(cache.path('0001'), (0, 0))
+        cache.put('0003', b'12')
+        self.assertIsNone(cache.get('0001'))
+        self.assertEqual(cache.get('0002'), b'12')
+        self.assertEqual(cache.get('0003'), b'12')
+
+    def test_compile(self):
+        cache = Compilation_Cache(self.directory.name)
+        first = cache.compile('read n; write n * n')
+        self.assertEqual(cache.compile('read n; write n * n'), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_options_keyed(self):
+        cache = Compilation_Cache(self.directory.name)
+        optimised = cache.compile('write 2 * 3')
+        plain = cache.compile('write 2 * 3', optimise=False)
+        self.assertNotEqual(optimised, plain)
+        self.assertEqual(cache.compile('write 2 * 3', optimise=False), plain)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_object_options_not_cached(self):
+        cache = Compilation_Cache(self.directory.name)
+        for _ in range(2):
+            stats = Compile_Stats()
+            cache.compile('read n; write n', peephole=Peephole_Optimiser(), stats=stats)
+            self.assertGreater(stats.as_dict()['tokens'], 0)
+        self.assertEqual((cache.hits, cache.misses, cache.total), (0, 0, 0))
+        with self.assertRaises(ValueError):
+            cache.key('read n; write n', stats=Compile_Stats())
+
+    def test_format_keyed(self):
+        cache = Compilation_Cache(self.directory.name)
+        assembly = cache.compile('write 1')
+        data = cache.compile('write 1', 'class')
+        self.assertIsInstance(assembly, str)
+        self.assertEqual(data[:4], b'\xca\xfe\xba\xbe')
+        self.assertEqual(cache.compile('write 1', 'class'), data)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_errors_not_cached(self):
+        cache = Compilation_Cache(self.directory.name)
+        for _ in range(2):
+            with self.assertRaises(Compile_Error):
+                cache.compile('write (')
+        self.assertEqual((cache.hits, cache.misses, cache.total), (0, 2, 0))
+
+    def test_batch(self):
+        source = os.path.join(self.directory.name, 'program.txt')
+        with open(source, 'w') as source_file:
+            source_file.write('read n; write n + 1')
+        cache = os.path.join(self.directory.name, 'cache')
+        first = compile_file(source, cache=cache)
+        second = compile_file(source, cache=cache)
+        self.assertEqual((first.cached, second.cached), (False, True))
+        with open(second.output) as output:
+            self.assertIn('.method', output.read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+'''Tests of the compiler. Run with python -m unittest or pytest.'''
+
+import io
+import time
+import unittest
+
+import classfile
+import ir
+from benchmark import NESTING, nested_program
+from compiler import Code_List, Context, Identifier_AST, Program_AST, compile, \
+    compile_class, generate, nodes, parse, prepare
+from executor import run
+from incremental import Incremental_Compiler
+
+# reads y before it is set when the loop does not run
+UNSET = 'read x; while x < 5 do x := x + 1; y := x * 7 end; write y'
+
+class Unset_Variable_Test(unittest.TestCase):
+    '''A program that may read a variable before setting it compiles to
+       Jasmin assembly in every mode, as it did before the .limit
+       directives were computed.'''
+    def limits(self, text):
+        return [line.split() for line in text.splitlines()
+                if line.strip().startswith('.limit')]
+
+    def test_optimised(self):
+        self.assertTrue(self.limits(compile(UNSET)))
+
+    def test_not_optimised(self):
+        self.assertTrue(self.limits(compile(UNSET, optimise=False)))
+
+    def test_streamed(self):
+        self.assertTrue(self.limits(compile(UNSET, optimise=False, stream=True)))
+
+    def test_incremental(self):
+        self.assertTrue(self.limits(Incremental_Compiler().update(UNSET)))
+
+    def test_same_limits(self):
+        # the limits do not depend on how they are computed
+        self.assertEqual(self.limits(compile(UNSET, optimise=False)),
+                         self.limits(compile(UNSET, optimise=False, stream=True)))
+
+class Limits_Test(unittest.TestCase):
+    '''The limits with_limits finds from the stack height alone are those
+       of the assembler's type flow.'''
+    programs = ['read n; write n * n',
+                'read n; s := 0; while n > 0 do s := s + n * (n - 1); n := n - 1 end; write s',
+                'read x; if x = 1 then write 1 else if x = 2 then write 2 else '
+                'if x = 3 then write 3 else write x / (x - 4) end end end']
+
+    def test_same_as_assembler(self):
+        for source in self.programs:
+            for options in [{}, {'optimise': False}, {'fast_io': True},
+                            {'method_size': 20}]:
+                output = Code_List()
+                generate(source, output, **options)
+                for method in classfile.read_class(output.instructions)[-1]:
+                    assembler = classfile.Method_Assembler(method, classfile.Constant_Pool())
+                    self.assertEqual((method.max_height(), method.locals_needed()),
+                                     assembler.limits())
+
+class Loop_Test(unittest.TestCase):
+    '''The loop optimisations on nested loops, which only look at the
+       blocks of each loop outside its inner loops.'''
+    # i is increased in the inner loop, i * k is used in the outer one and
+    # j * k is invariant in the inner one
+    source = '''read n; read k; i := 0; s := 0;
+                while i < n do
+                    j := 0;
+                    while j < 3 do s := s + j * k + i * k; i := i + 1; j := j + 1 end;
+                    if 1 = 2 then while s > 0 do s := s - 1 end end;
+                    write i * k + s
+                end'''
+
+    def test_same_results(self):
+        for inputs in [[0, 5], [4, 7], [9, -3]]:
+            self.assertEqual(run(self.source, inputs),
+                             run(self.source, inputs, optimise=False))
+
+    def test_loops(self):
+        graph = ir.lower(parse(Context(io.StringIO(self.source), None)).program)
+        inner, dead, outer = graph.loops
+        self.assertEqual([item for item in outer.body if isinstance(item, ir.Loop)],
+                         [inner, dead])
+        # the blocks of a loop are those from its first block on
+        start = graph.blocks.index(outer.first())
+        self.assertEqual(outer.blocks(), graph.blocks[start:start + len(outer.blocks())])
+        graph.optimise()
+        # the loop that cannot run is gone, and its blocks with it
+        self.assertEqual(graph.loops, [inner, outer])
+        self.assertTrue(set(outer.blocks()) <= set(graph.blocks))
+
+class Nesting_Test(unittest.TestCase):
+    '''Deeply nested programs compile without recursing, in time linear in
+       their depth. python benchmark.py --nesting checks deeper ones.'''
+    def seconds(self, source, **options):
+        start = time.perf_counter()
+        generate(source, Code_List(), **options)
+        return time.perf_counter() - start
+
+    def test_deep(self):
+        for kind in NESTING:
+            self.assertEqual(run(nested_program(kind, 3000), [1]),
+                             run(nested_program(kind, 3000), [1], optimise=False))
+
+    def test_linear(self):
+        for kind in NESTING:
+            for options in [{}, { 'stream': True }]:
+                small = min(self.seconds(nested_program(kind, 300), **options)
+                            for repeat in range(3))
+                large = min(self.seconds(nested_program(kind, 3000), **options)
+                            for repeat in range(2))
+                # ten times as deep takes about ten times as long, not 100
+                self.assertLess(large / small, 35, (kind, options))
+
+class Split_Test(unittest.TestCase):
+    '''A program split into many small methods gives the same results as
+       one that is not split.'''
+    source = '''read n; s := 0; i := 0; t := 1;
+                while i < n do
+                    if i / 2 * 2 = i then s := s + i * 3; t := t * 2 - s
+                    else s := s - 1; t := t + s * i end;
+                    j := 0;
+                    while j < i do s := s + j; j := j + 1 end;
+                    i := i + 1
+                end;
+                write s; write t; write i'''
+
+    def test_split(self):
+        self.assertEqual(compile(self.source).count('.method'), 2)
+        for method_size in [64, 16]:
+            self.assertGreater(compile(self.source, method_size=method_size)
+                               .count('.method'), 2)
+            for inputs in [[0], [5], [12]]:
+                self.assertEqual(run(self.source, inputs, method_size=method_size),
+                                 run(self.source, inputs))
+
+    def test_class_file(self):
+        data = compile_class(self.source, method_size=16)
+        self.assertEqual(data[:4], b'\xca\xfe\xba\xbe')
+
+class Leaf_Test(unittest.TestCase):
+    '''The parser makes one node for all the occurrences of a name or a
+       number in a program, and the passes never change it.'''
+    source = '''read x; y := x * 2 + 1; while x < 10 do x := x + y * 2 end;
+                if y = 1 then write 2 else write x + y * 2 end'''
+
+    def context(self):
+        return Context(io.StringIO(self.source), None)
+
+    def test_shared(self):
+        ast = parse(self.context())
+        xs = [node for node in nodes(ast.program)
+              if isinstance(node, Identifier_AST) and node.identifier == 'x']
+        self.assertGreater(len(xs), 2)
+        self.assertTrue(all(node is xs[0] for node in xs))
+
+    def test_own_context(self):
+        first, second = self.context(), self.context()
+        parse(first)
+        parse(second)
+        self.assertEqual(sorted(first.leaves), sorted(second.leaves))
+        for value in first.leaves:
+            self.assertIsNot(first.leaves[value], second.leaves[value])
+
+    def test_unchanged(self):
+        context = self.context()
+        prepare(context, method_size=16)
+        self.assertEqual(dict((value, leaf.heading())
+                              for (value, leaf) in context.leaves.items()),
+                         dict((value, value) for value in context.leaves))
+        # so compiling again in another context gives the same code
+        self.assertEqual(compile(self.source, method_size=16),
+                         compile(self.source, method_size=16))
+
+class Program_AST_Test(unittest.TestCase):
+    def test_own_lists(self):
+        a, b = Program_AST(None), Program_AST(None)
+        a.methods.append('method')
+        a.fields.append('x')
+        self.assertEqual((b.methods, b.fields), ([], []))
+
+if __name__ == '__main__':
+    unittest.main()
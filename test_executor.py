@@ -0,0 +1,80 @@
+'''Tests of the executor against what the JVM does with the compiled
+programs. Run with python -m unittest or pytest.'''
+
+import unittest
+
+from executor import Execution_Error, Step_Limit_Error, load, run
+
+def both(source, inputs=()):
+    '''Returns the output of source optimised, after checking that it is the
+       same without optimisation.'''
+    output = run(source, inputs)
+    assert run(source, inputs, optimise=False) == output
+    return output
+
+class Arithmetic_Test(unittest.TestCase):
+    def test_division_rounds_towards_zero(self):
+        self.assertEqual(both('read a; read b; write a / b; write a - a / b * b',
+                              [-7, 2]), [-3, -1])
+        self.assertEqual(both('read a; read b; write a / b', [7, -2]), [-3])
+        self.assertEqual(both('write 0 - 7 / 2'), [-3])
+
+    def test_wraps_around(self):
+        self.assertEqual(both('read a; write a + 1; write a * 2', [2**31 - 1]),
+                         [-2**31, -2])
+        self.assertEqual(both('read a; write a - 1; write a / (0 - 1)', [-2**31]),
+                         [2**31 - 1, -2**31])
+        self.assertEqual(both('write 65536 * 65536 + 2147483647 * 3'), [2147483645])
+
+    def test_deep_expression(self):
+        # deeper than executor.DEPTH, so evaluated with an explicit stack
+        source = 'read x; write ' + 'x - (' * 300 + '1' + ')' * 300
+        self.assertEqual(both(source, [5]), [1])
+
+class Control_Test(unittest.TestCase):
+    def test_loops(self):
+        source = '''read n; f := 1; i := 1;
+                    while i <= n do f := f * i; i := i + 1 end; write f'''
+        self.assertEqual(both(source, [10]), [3628800])
+        self.assertEqual(both(source, [13]), [1932053504])
+        self.assertEqual(both(source, [0]), [1])
+
+    def test_conditions(self):
+        source = '''read a; read b;
+                    if a < b and not a = 0 or b >= 10 then write 1 else write 0 end;
+                    if not a != b then write 2 end'''
+        for (inputs, output) in [([1, 2], [1]), ([0, 2], [0]), ([0, 10], [1]),
+                                 ([3, 3], [0, 2]), ([5, 10], [1])]:
+            self.assertEqual(both(source, inputs), output)
+
+    def test_run_again(self):
+        program = load('read n; write n * n')
+        self.assertEqual([program.run([n]) for n in range(4)], [[0], [1], [4], [9]])
+
+class Error_Test(unittest.TestCase):
+    def test_division_by_zero(self):
+        with self.assertRaises(Execution_Error) as caught:
+            run('read a; write 1; write 10 / a; write 2', [0])
+        self.assertEqual(str(caught.exception),
+                         'java.lang.ArithmeticException: / by zero')
+        self.assertEqual(caught.exception.output, [1])
+
+    def test_end_of_input(self):
+        with self.assertRaises(Execution_Error) as caught:
+            run('read a; write a; read b; write b', [4])
+        self.assertEqual(str(caught.exception), 'java.util.NoSuchElementException')
+        self.assertEqual(caught.exception.output, [4])
+
+    def test_input_too_large(self):
+        with self.assertRaises(Execution_Error) as caught:
+            run('read a; write a', [2**31])
+        self.assertEqual(str(caught.exception), 'java.util.InputMismatchException')
+
+    def test_step_limit(self):
+        with self.assertRaises(Step_Limit_Error) as caught:
+            run('x := 1; while x > 0 do write x; x := x + 1 end', max_steps=10)
+        self.assertTrue(0 < len(caught.exception.output) <= 10)
+        self.assertEqual(run('write 1', max_steps=10), [1])
+
+if __name__ == '__main__':
+    unittest.main()
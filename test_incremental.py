@@ -0,0 +1,102 @@
+'''Tests of the incremental compiler. Run with python -m unittest or pytest.'''
+
+import io
+import random
+import re
+import unittest
+
+from compiler import Code_List, Compile_Error, Context, prepare
+from incremental import Incremental_Compiler
+
+SOURCE = '''read a; b := 1;
+while a > 0 do b := b * a; a := a - 1 end;
+if b > 100 then write b else write 0 end;
+c := a + b;
+write c'''
+
+def full(source):
+    '''Returns the instructions of source compiled from scratch, as the
+       incremental compiler translates it.'''
+    context = Context(io.StringIO(source), Code_List())
+    prepare(context, optimise=False, method_size=2**30).code(context)
+    return context.output.instructions
+
+def normalised(instructions):
+    '''Returns instructions with the labels and locals numbered in the
+       order they first appear and without the .limit directives, which
+       may differ between compilations of the same program.'''
+    names = {}
+    def name(label):
+        return names.setdefault(label, 'L%d' % len(names))
+    result = []
+    for instruction in instructions:
+        if instruction[0] == '.limit':
+            continue
+        if instruction[0] == '.method':
+            locals = {}
+        if re.fullmatch(r'\w+:', instruction[0]):
+            instruction = (name(instruction[0][:-1]) + ':',)
+        elif instruction[0] in ('iload', 'istore', 'iinc'):
+            local = locals.setdefault(instruction[1], len(locals))
+            instruction = (instruction[0], local) + instruction[2:]
+        else:
+            instruction = tuple(name(operand) if isinstance(operand, str) and
+                                re.fullmatch(r'(s\d+)?l\d+', operand) else operand
+                                for operand in instruction)
+        result.append(instruction)
+    return result
+
+class Incremental_Test(unittest.TestCase):
+    def assertSameCode(self, compiler):
+        self.assertEqual(normalised(compiler.instructions()),
+                         normalised(full(compiler.source)))
+
+    def test_edits(self):
+        compiler = Incremental_Compiler()
+        compiler.update(SOURCE)
+        self.assertSameCode(compiler)
+        # in a loop, so the whole while statement is parsed again
+        compiler.edit(SOURCE.index('b * a'), SOURCE.index('b * a') + 5, 'b + a')
+        self.assertSameCode(compiler)
+        self.assertEqual((compiler.reparsed, compiler.reused), (1, 5))
+        # a new statement, with a new variable
+        compiler.edit(len(compiler.text), len(compiler.text), '; d := c * 2; write d')
+        self.assertSameCode(compiler)
+        # the first statement removed
+        compiler.edit(0, compiler.text.index(';') + 1, '')
+        self.assertSameCode(compiler)
+
+    def test_error(self):
+        compiler = Incremental_Compiler()
+        code = compiler.update(SOURCE)
+        with self.assertRaises(Compile_Error):
+            compiler.edit(0, 0, 'if ')
+        self.assertEqual((compiler.source, compiler.code()), (SOURCE, code))
+        # edits are made to the text with the error
+        compiler.edit(0, 3, 'write 2; ')
+        self.assertEqual(compiler.source, 'write 2; ' + SOURCE)
+        self.assertSameCode(compiler)
+
+    def test_random_edits(self):
+        pieces = ['', ' ', ';', 'end', ' end', 'if a < b then ', 'else ', 'x',
+                  '1', ')', '(', 'while a > 0 do ', 'write a;', '; b := 3', '\n']
+        rand = random.Random(0)
+        compiler = Incremental_Compiler()
+        compiler.update(SOURCE)
+        for step in range(1000):
+            text = compiler.source if rand.random() < 0.6 else compiler.text
+            start = rand.randrange(len(text) + 1)
+            end = min(len(text), start + rand.choice([0, 1, 2, 5, 20]))
+            new_text = text[:start] + rand.choice(pieces) + text[end:]
+            try:
+                expected = full(new_text)
+            except Compile_Error:
+                with self.assertRaises(Compile_Error):
+                    compiler.update(new_text)
+            else:
+                compiler.update(new_text)
+                self.assertEqual(normalised(compiler.instructions()),
+                                 normalised(expected))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+'''Tests of the peephole optimiser. Run with python -m unittest or pytest.'''
+
+import unittest
+
+from peephole import Label_Info, Peephole_Optimiser, branch_over_goto, default_rules, \
+    goto_next, goto_return, increment, jump_to_jump, push_pop, store_load, \
+    unreachable, unused_label
+
+class Rule_Test(unittest.TestCase):
+    '''Each rule on its own, applied until it no longer matches.'''
+    def optimise(self, rule, code):
+        optimiser = Peephole_Optimiser([rule])
+        return optimiser.optimise(code), optimiser.hits[rule.__name__]
+
+    def test_store_load(self):
+        code = [('istore', 1), ('iload', 1), ('iload', 1), ('ireturn',)]
+        self.assertEqual(self.optimise(store_load, code),
+                         ([('dup',), ('dup',), ('istore', 1), ('ireturn',)], 1))
+
+    def test_store_load_other_local(self):
+        code = [('istore', 1), ('iload', 2)]
+        self.assertEqual(self.optimise(store_load, code), (code, 0))
+
+    def test_increment(self):
+        code = [('iload', 1), ('iconst_2',), ('iadd',), ('istore', 1)]
+        self.assertEqual(self.optimise(increment, code), ([('iinc', 1, 2)], 1))
+
+    def test_increment_constant_first(self):
+        code = [('bipush', 7), ('iload', 1), ('iadd',), ('istore', 1)]
+        self.assertEqual(self.optimise(increment, code), ([('iinc', 1, 7)], 1))
+
+    def test_increment_subtract(self):
+        code = [('iload', 1), ('bipush', 5), ('isub',), ('istore', 1)]
+        self.assertEqual(self.optimise(increment, code), ([('iinc', 1, -5)], 1))
+
+    def test_increment_other_local(self):
+        code = [('iload', 1), ('iconst_1',), ('iadd',), ('istore', 2)]
+        self.assertEqual(self.optimise(increment, code), (code, 0))
+
+    def test_increment_limits(self):
+        # iinc takes a signed byte: x - 128 fits, x + 128 and x - -128 do not
+        code = [('iload', 1), ('sipush', 128), ('isub',), ('istore', 1)]
+        self.assertEqual(self.optimise(increment, code), ([('iinc', 1, -128)], 1))
+        for (value, op) in [(128, 'iadd'), (-128, 'isub'), (-129, 'iadd')]:
+            code = [('iload', 1), ('sipush', value), (op,), ('istore', 1)]
+            self.assertEqual(self.optimise(increment, code), (code, 0))
+        code = [('iload', 1), ('bipush', 127), ('iadd',), ('istore', 1)]
+        self.assertEqual(self.optimise(increment, code), ([('iinc', 1, 127)], 1))
+
+    def test_push_pop(self):
+        code = [('iload', 1), ('pop',), ('iconst_3',), ('pop',),
+                ('dup',), ('pop',), ('return',)]
+        self.assertEqual(self.optimise(push_pop, code), ([('return',)], 3))
+
+    def test_push_pop_keeps_side_effects(self):
+        code = [('invokestatic', 'Program/f()I'), ('pop',)]
+        self.assertEqual(self.optimise(push_pop, code), (code, 0))
+
+    def test_branch_over_goto(self):
+        code = [('iflt', 'L1'), ('goto', 'L2'), ('L1:',), ('return',)]
+        self.assertEqual(self.optimise(branch_over_goto, code),
+                         ([('ifge', 'L2'), ('L1:',), ('return',)], 1))
+
+    def test_branch_over_goto_elsewhere(self):
+        code = [('iflt', 'L3'), ('goto', 'L2'), ('L1:',), ('return',)]
+        self.assertEqual(self.optimise(branch_over_goto, code), (code, 0))
+
+    def test_goto_next(self):
+        code = [('goto', 'L2'), ('L1:',), ('L2:',), ('return',)]
+        self.assertEqual(self.optimise(goto_next, code),
+                         ([('L1:',), ('L2:',), ('return',)], 1))
+
+    def test_goto_next_past_instruction(self):
+        code = [('goto', 'L1'), ('iconst_0',), ('L1:',), ('return',)]
+        self.assertEqual(self.optimise(goto_next, code), (code, 0))
+
+    def test_goto_return(self):
+        code = [('goto', 'L1'), ('iconst_0',), ('L1:',), ('ireturn',)]
+        self.assertEqual(self.optimise(goto_return, code),
+                         ([('ireturn',), ('iconst_0',), ('L1:',), ('ireturn',)], 1))
+
+    def test_jump_to_jump(self):
+        code = [('ifeq', 'L1'), ('return',), ('L1:',), ('goto', 'L2'),
+                ('L2:',), ('goto', 'L3'), ('L3:',), ('return',)]
+        self.assertEqual(self.optimise(jump_to_jump, code),
+                         ([('ifeq', 'L3'), ('return',), ('L1:',), ('goto', 'L3'),
+                           ('L2:',), ('goto', 'L3'), ('L3:',), ('return',)], 2))
+
+    def test_jump_to_jump_same_place(self):
+        # jumps to labels at the same place use the one already used
+        code = [('goto', 'L1'), ('ifeq', 'L2'), ('L1:',), ('L2:',), ('return',)]
+        optimised, hits = self.optimise(jump_to_jump, code)
+        self.assertEqual(optimised[1], ('ifeq', 'L1'))
+        self.assertEqual(hits, 1)
+
+    def test_jump_to_jump_switch(self):
+        code = [('tableswitch', 0, ['L1', 'L2'], 'L2'), ('L1:',), ('goto', 'L3'),
+                ('L2:',), ('L3:',), ('return',)]
+        optimised, hits = self.optimise(jump_to_jump, code)
+        self.assertEqual(optimised[0], ('tableswitch', 0, ['L2', 'L2'], 'L2'))
+        self.assertEqual(optimised[2], ('goto', 'L2'))
+        self.assertEqual(hits, 2)
+
+    def test_jump_to_jump_cycle(self):
+        # gotos that jump to each other are left alone
+        code = [('L1:',), ('goto', 'L2'), ('L2:',), ('goto', 'L1')]
+        self.assertEqual(self.optimise(jump_to_jump, code), (code, 0))
+
+    def test_unreachable(self):
+        code = [('goto', 'L1'), ('iconst_1',), ('pop',), ('L1:',), ('return',),
+                ('return',)]
+        self.assertEqual(self.optimise(unreachable, code),
+                         ([('goto', 'L1'), ('L1:',), ('return',)], 2))
+
+    def test_unused_label(self):
+        code = [('goto', 'L2'), ('L1:',), ('L2:',), ('return',)]
+        self.assertEqual(self.optimise(unused_label, code),
+                         ([('goto', 'L2'), ('L2:',), ('return',)], 1))
+
+    def test_label_used_by_directive(self):
+        code = [('.catch', 'all', 'from', 'L1', 'to', 'L2', 'using', 'L2'),
+                ('L1:',), ('return',), ('L2:',), ('athrow',)]
+        self.assertEqual(self.optimise(unused_label, code), (code, 0))
+
+class Label_Info_Test(unittest.TestCase):
+    code = [('goto', 'L4'), ('L1:',), ('ifeq', 'L2'), ('L2:',), ('L3:',),
+            ('goto', 'L1'), ('L4:',), ('goto', 'L3'), ('L5:',), ('L6:',)]
+
+    def test_runs(self):
+        labels = Label_Info(self.code)
+        self.assertEqual(labels.run('L3'), ['L2', 'L3'])
+        self.assertEqual(labels.canonical('L3'), 'L2')
+        self.assertEqual(labels.canonical('L6'), 'L6')
+        self.assertEqual(labels.following('L2'), ('goto', 'L1'))
+        self.assertIsNone(labels.following('L5'))
+
+    def test_destination(self):
+        labels = Label_Info(self.code)
+        self.assertEqual(labels.destination('L4'), 'L1')
+        self.assertEqual(labels.destination('L1'), 'L1')
+        # the same answers once they are known
+        self.assertEqual(labels.destination('L3'), 'L1')
+        self.assertEqual(labels.destination('L4'), 'L1')
+
+class Optimiser_Test(unittest.TestCase):
+    def test_default_rules(self):
+        self.assertEqual(Peephole_Optimiser().rules, default_rules)
+
+    def test_fixed_point(self):
+        # each rule opens the way for the next
+        code = [('iload', 1), ('iconst_1',), ('iadd',), ('istore', 1),
+                ('iload', 1), ('ifle', 'L1'), ('goto', 'L2'), ('L1:',),
+                ('iconst_0',), ('pop',), ('L2:',), ('return',)]
+        optimiser = Peephole_Optimiser()
+        optimised = optimiser.optimise(code)
+        self.assertEqual(optimised, [('iinc', 1, 1), ('iload', 1), ('ifgt', 'L2'),
+                                     ('L2:',), ('return',)])
+        self.assertEqual(optimiser.optimise(optimised), optimised)
+
+    def test_hits(self):
+        code = [('iload', 1), ('iconst_1',), ('iadd',), ('istore', 1),
+                ('iload', 1), ('ifle', 'L1'), ('goto', 'L2'), ('L1:',),
+                ('iconst_0',), ('pop',), ('L2:',), ('return',)]
+        optimiser = Peephole_Optimiser()
+        optimiser.optimise(code)
+        hits = dict((rule.__name__, 0) for rule in default_rules)
+        hits.update(increment=1, branch_over_goto=1, push_pop=1, unused_label=1)
+        self.assertEqual(optimiser.hits, hits)
+        # the hits add up over the lists optimised
+        optimiser.optimise(code)
+        self.assertEqual(optimiser.hits['increment'], 2)
+        self.assertEqual(sum(optimiser.hits.values()), 8)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+'''Tests of the scanner of bytes against the scanner of strings. Run with
+python -m unittest or pytest.'''
+
+import io
+import os
+import tempfile
+import unittest
+
+from benchmark import random_program
+from compiler import Byte_Scanner, Compile_Error, Scanner, compile
+
+# multi-character tokens, and white space of one, two and three bytes in
+# UTF-8, which chunks of a few bytes split
+SOURCE = '''read count;\r\n total := 0;　i := 1;
+while i <= count and not total >= 2147483 do
+\u0085  total := total + i * 12345;  i := i + 1
+end;
+if total != 0 then write total else write 0 - 1 end'''
+
+# ends in an error: a character that is no token, in the middle of a line
+BAD = 'read x;　x := x\t+ 1;\n write x é 2'
+
+def tokens(scanner):
+    '''Returns the tokens scanner finds, with where each is, and the error
+       it ends with, if any.'''
+    result = []
+    try:
+        while scanner.lookahead() is not None:
+            result.append((scanner.current_token, scanner.where()))
+            scanner.consume(scanner.lookahead())
+    except Compile_Error as error:
+        result.append(str(error))
+    return result
+
+def scan(make_scanner):
+    '''Returns the tokens of the scanner make_scanner() returns, or the error
+       it raises on the first token.'''
+    try:
+        scanner = make_scanner()
+    except Compile_Error as error:
+        return [str(error)]
+    return tokens(scanner)
+
+class Byte_Scanner_Test(unittest.TestCase):
+    def assertSameTokens(self, source):
+        expected = scan(lambda: Scanner(io.StringIO(source)))
+        data = source.encode('utf-8')
+        for chunk_size in range(1, 65):
+            self.assertEqual(scan(lambda: Byte_Scanner(io.BytesIO(data), chunk_size)),
+                             expected, chunk_size)
+        # a file is mapped into memory instead
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'program.txt')
+            with open(path, 'wb') as program_file:
+                program_file.write(data)
+            self.assertEqual(scan(lambda: Byte_Scanner(path)), expected)
+            with open(path, 'rb') as program_file:
+                self.assertEqual(scan(lambda: Byte_Scanner(program_file)), expected)
+
+    def test_tokens(self):
+        self.assertSameTokens(SOURCE)
+
+    def test_errors(self):
+        self.assertSameTokens(BAD)
+        self.assertSameTokens('x := 99999999999999999999')
+        self.assertSameTokens('é')
+
+    def test_empty(self):
+        self.assertSameTokens('')
+        self.assertSameTokens(' \n　')
+
+    def test_random_programs(self):
+        for seed in range(3):
+            self.assertSameTokens(random_program(30, seed=seed))
+
+    def test_compile(self):
+        data = SOURCE.encode('utf-8')
+        self.assertEqual(compile(io.BytesIO(data)), compile(SOURCE))
+        with self.assertRaises(Compile_Error) as caught:
+            compile(io.BytesIO(BAD.encode('utf-8')))
+        self.assertIn('line 2, column 10', str(caught.exception))
+
+if __name__ == '__main__':
+    unittest.main()
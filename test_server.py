@@ -0,0 +1,90 @@
+'''Tests of the compile server and its client. Run with python -m unittest or
+pytest.'''
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from client import encode_message, read_message, request
+from compiler import compile, compile_class
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+class Server_Test(unittest.TestCase):
+    '''Runs a server with one worker on a socket of its own for all the
+       tests.'''
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'compiler.sock')
+        cls.server = subprocess.Popen([sys.executable, 'server.py', '--socket',
+                                       cls.path, '--workers', '1'],
+                                      cwd=HERE, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while not os.path.exists(cls.path):
+            if cls.server.poll() is not None or time.monotonic() > deadline:
+                cls.tearDownClass()
+                raise RuntimeError('the server did not start')
+            time.sleep(0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait(30)
+        cls.directory.cleanup()
+
+    def test_compile(self):
+        source = 'read n; while n > 0 do write n; n := n - 1 end'
+        header, payload = request(source, path=self.path)
+        self.assertEqual(header['status'], 'ok')
+        self.assertEqual(payload.decode('utf-8'), compile(source))
+        header, payload = request(source, 'class', { 'optimise': False },
+                                  path=self.path)
+        self.assertEqual(payload, compile_class(source, optimise=False))
+
+    def test_error(self):
+        header, payload = request('write (', path=self.path)
+        self.assertEqual(header['status'], 'error')
+        self.assertEqual(payload.decode('utf-8'),
+                         "syntax error: token in ['ID', 'LPAR', 'NUM'] "
+                         "expected but None found at line 1, column 8")
+        header, payload = request('write 1', options={ 'colour': True },
+                                  path=self.path)
+        self.assertEqual((header['status'], payload),
+                         ('error', b'bad request: unknown options: colour'))
+
+    def test_reports(self):
+        header, payload = request('read n; write n', peephole_stats=True,
+                                  profile=True, path=self.path)
+        self.assertIn('store_load', header['peephole'])
+        self.assertIn('parse', header['profile']['phases'])
+        self.assertIsNone(header['profile']['peak_memory'])
+
+    def test_connection(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(self.path)
+            with connection.makefile('rb') as stream:
+                for number in range(3):
+                    connection.sendall(encode_message({}, b'write %d' % number))
+                    header, payload = read_message(stream)
+                    self.assertEqual(payload.decode('utf-8'),
+                                     compile('write %d' % number))
+
+    def test_client(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt') as program:
+            program.write('read n; write n * n')
+            program.flush()
+            result = subprocess.run([sys.executable, 'client.py', '--socket',
+                                     self.path, '--profile', program.name],
+                                    cwd=HERE, capture_output=True, text=True,
+                                    check=True)
+        self.assertEqual(result.stdout, compile('read n; write n * n'))
+        self.assertIn('phases', json.loads(result.stderr))
+
+if __name__ == '__main__':
+    unittest.main()